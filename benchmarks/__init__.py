@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks for the slow paths in the purchasing suite
+
+Benchmarks run against the configured database inside a transaction
+that is rolled back at the end, so they can be pointed at a development
+database without leaving synthetic data behind. They are run through
+``manage.py`` commands.
+'''
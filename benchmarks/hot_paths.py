@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks for the project's hot paths
+
+Times the slow paths in scout, conductor and beacon against whatever is
+in the database, which is meant to be a dataset built by
+:py:func:`benchmarks.seed.seed_scale`. Every benchmark returns plain
+dictionaries, so a run can be written out as JSON and compared against
+another one.
+'''
+
+import os
+import datetime
+
+from bs4 import BeautifulSoup
+from flask import current_app
+
+from purchasing.database import db
+from purchasing.filters import better_title
+from purchasing.data.flows import Flow
+from purchasing.data.contracts import ContractBase
+from purchasing.data.contract_stages import ContractStage, ContractStageActionItem
+from purchasing.data.importer.scrape_county import grab_line_items
+from purchasing.utils import paginate_query
+from purchasing.conductor.util import (
+    in_progress_query, all_contracts_query, filter_index_query,
+    IN_PROGRESS_SORTS, IN_PROGRESS_SEARCHES, ALL_CONTRACTS_SORTS, ALL_CONTRACTS_SEARCHES
+)
+from purchasing.opportunities.models import Opportunity
+from purchasing.jobs.beacon_nightly import BeaconNewOppotunityOpenJob
+from purchasing.scout.util import (
+    find_contract_metadata, build_filter, build_cases, FILTER_FIELDS
+)
+
+from benchmarks.util import time_it
+from benchmarks.seed import table_counts
+
+SEARCHES = ['asphalt', 'pipe | valve', 'vehicle | tires | towing', 'steel']
+AWARD_PAGE = os.path.join('purchasing_test', 'mock', 'award.html')
+
+def bench_search(session, repeat, searches=None):
+    '''Time scout search, including the total count and found-in cases
+    '''
+    results = {}
+    for search_for in searches or SEARCHES:
+        filter_or = build_filter({}, FILTER_FIELDS, search_for, None, True)
+        case_statements = build_cases({}, FILTER_FIELDS, search_for, True)
+
+        def search():
+            return find_contract_metadata(search_for, case_statements, filter_or, [])
+
+        results[search_for] = time_it(search, repeat=repeat)
+        results[search_for]['results'] = search()[1].total_count
+    return results
+
+def bench_conductor_index(session, repeat):
+    '''Time the two queries behind the conductor index tables
+
+    Both the full queries and the first page of each table, which is what
+    the index page actually loads, are timed.
+    '''
+    results = {}
+    for name, query, sorts, searches in [
+        ('in_progress', in_progress_query, IN_PROGRESS_SORTS, IN_PROGRESS_SEARCHES),
+        ('all_contracts', all_contracts_query, ALL_CONTRACTS_SORTS, ALL_CONTRACTS_SEARCHES)
+    ]:
+        results[name] = time_it(lambda: query().all(), repeat=repeat)
+        results[name]['rows'] = len(query().all())
+        results[name + '_first_page'] = time_it(
+            lambda: paginate_query(filter_index_query(query(), sorts, searches), 1, 50),
+            repeat=repeat
+        )
+    return results
+
+def bench_metrics(session, repeat):
+    '''Time building the metrics for the flow with the most contract stages
+    '''
+    flow_id = session.query(ContractStage.flow_id).group_by(
+        ContractStage.flow_id
+    ).order_by(db.func.count().desc()).limit(1).scalar()
+    if flow_id is None:
+        return {}
+
+    flow = Flow.query.get(flow_id)
+    return {
+        'flow_id': flow.id,
+        'contract_stages': flow.contract_stages.count(),
+        'build_metrics_data': time_it(flow.build_metrics_data, repeat=repeat),
+        'build_metrics_summary': time_it(flow.build_metrics_summary, repeat=repeat),
+        'reshape_metrics_granular': time_it(flow.reshape_metrics_granular, repeat=repeat),
+        'iter_metrics_granular': time_it(lambda: list(flow.iter_metrics_granular()), repeat=repeat),
+    }
+
+def bench_action_log(session, repeat, sample=20):
+    '''Time filtering the action logs of the contracts with the longest logs
+    '''
+    contract_ids = [i[0] for i in session.query(ContractStage.contract_id).join(
+        ContractStageActionItem
+    ).group_by(
+        ContractStage.contract_id
+    ).order_by(db.func.count().desc()).limit(sample)]
+    contracts = ContractBase.query.filter(ContractBase.id.in_(contract_ids)).all()
+
+    def filter_logs():
+        return [contract.filter_action_log() for contract in contracts]
+
+    def filter_logs_python():
+        return [contract.filter_action_log_python() for contract in contracts]
+
+    results = time_it(filter_logs, repeat=repeat)
+    results['python'] = time_it(filter_logs_python, repeat=repeat)
+    results['contracts'] = len(contracts)
+    results['actions'] = sum(len(i) for i in filter_logs())
+    return results
+
+def bench_grab_line_items(session, repeat):
+    '''Time parsing line items out of a recorded county award page
+    '''
+    with open(os.path.join(current_app.config['PROJECT_ROOT'], AWARD_PAGE), 'r') as f:
+        page = f.read()
+
+    soup = BeautifulSoup(page, from_encoding='windows-1252')
+    results = {
+        'parse': time_it(lambda: BeautifulSoup(page, from_encoding='windows-1252'), repeat=repeat),
+        'grab_line_items': time_it(lambda: grab_line_items(soup), repeat=repeat),
+    }
+    results['grab_line_items']['line_items'] = len(grab_line_items(soup))
+    return results
+
+def bench_better_title(session, repeat, sample=1000):
+    '''Time title-casing a sample of contract descriptions
+    '''
+    descriptions = [i[0] for i in session.query(ContractBase.description).filter(
+        ContractBase.description != None
+    ).order_by(ContractBase.id).limit(sample)]
+
+    results = time_it(lambda: [better_title(i) for i in descriptions], repeat=repeat)
+    results['strings'] = len(descriptions)
+    return results
+
+class SampleOpportunityJob(BeaconNewOppotunityOpenJob):
+    '''The new opportunity job, run over a fixed sample of opportunities
+    '''
+    def __init__(self, opportunities):
+        super(SampleOpportunityJob, self).__init__(time_override=True)
+        self.opportunities = opportunities
+
+    def get_opportunities(self):
+        return self.opportunities
+
+def bench_beacon_notifications(session, repeat, sample=20):
+    '''Time building new opportunity notifications for a sample of opportunities
+
+    Building the notifications marks them as sent, so the sample's flags
+    are put back when the benchmark finishes.
+    '''
+    opportunities = Opportunity.query.filter(
+        Opportunity.is_public == True
+    ).order_by(Opportunity.id).limit(sample).all()
+    unsent = [i.id for i in opportunities if not i.publish_notification_sent]
+    job = SampleOpportunityJob(opportunities)
+
+    try:
+        results = time_it(job.build_notifications, repeat=repeat)
+        notifications = job.build_notifications()
+        results['notifications'] = len(notifications)
+        results['recipients'] = sum(len(i.to_email) for i in notifications)
+    finally:
+        if unsent:
+            Opportunity.query.filter(Opportunity.id.in_(unsent)).update(
+                {'publish_notification_sent': False}, synchronize_session=False
+            )
+            session.commit()
+
+    return results
+
+BENCHMARKS = [
+    ('search', bench_search),
+    ('conductor_index', bench_conductor_index),
+    ('metrics', bench_metrics),
+    ('action_log', bench_action_log),
+    ('grab_line_items', bench_grab_line_items),
+    ('better_title', bench_better_title),
+    ('beacon_notifications', bench_beacon_notifications),
+]
+
+def run(session, repeat=10, only=None):
+    '''Run the hot path benchmarks
+
+    Arguments:
+        session: Sqlalchemy session to execute with. The session is
+            rolled back when the benchmarks finish.
+
+    Keyword Arguments:
+        repeat: Number of timed runs of each benchmark
+        only: list of benchmark names to run, defaults to all of ``BENCHMARKS``
+
+    Returns:
+        Dictionary of benchmark results, along with the size of the dataset
+        they ran against
+    '''
+    results = {
+        'ran_at': datetime.datetime.utcnow().isoformat(),
+        'repeat': repeat,
+        'tables': table_counts(session),
+        'benchmarks': {}
+    }
+
+    # notifications render templates with external links in them
+    with current_app.test_request_context():
+        try:
+            for name, benchmark in BENCHMARKS:
+                if only and name not in only:
+                    continue
+                results['benchmarks'][name] = benchmark(session, repeat)
+        finally:
+            session.rollback()
+
+    return results
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+'''Benchmarks for scout search ranking
+
+Compares ranking search results the way it was done before the weighted
+document existed, by building it out of four tsvector columns for every
+row of a recreated copy of the old one-row-per-combination search index,
+against ranking with the precomputed per-contract ``tsv_document``
+column of the current index. It also compares the different
+strategies :py:func:`~purchasing.scout.util.find_contract_metadata` has
+for cutting down broad searches, and times typeahead suggestions.
+'''
+
+from purchasing.database import db
+from purchasing.data.searches import SearchView, rebuild_search_index
+from purchasing.data.contracts import ContractBase
+from purchasing.scout.util import (
+    find_suggestions, find_contract_metadata, build_filter, build_cases, FILTER_FIELDS
+)
+
+from benchmarks.util import time_it
+
+WORDS = [
+    'asphalt', 'boiler', 'cable', 'concrete', 'diesel', 'electrical', 'elevator',
+    'fencing', 'fuel', 'generator', 'glass', 'gravel', 'hardware', 'hvac', 'janitorial',
+    'lighting', 'lumber', 'masonry', 'paint', 'paper', 'pipe', 'plumbing', 'printing',
+    'roofing', 'salt', 'signage', 'steel', 'tires', 'towing', 'uniforms', 'valve', 'vehicle'
+]
+
+def build_corpus(session, contracts=2000, companies=500, properties=5, line_items=20):
+    '''Insert a synthetic corpus of contracts and build the search indexes
+
+    Everything is inserted with set-based SQL, so large corpora can be
+    built quickly.
+
+    Arguments:
+        session: Sqlalchemy session to execute with
+
+    Keyword Arguments:
+        contracts: Number of contracts to create
+        companies: Number of companies to create
+        properties: Number of properties per contract
+        line_items: Number of line items per contract
+
+    Along with the current search index, a temporary copy of the old
+    per-row search index is built from ``SEARCH_ROWS`` to compare against.
+
+    Returns:
+        Dictionary of the number of rows in the old per-row index and in
+        the current search index
+    '''
+    params = {
+        'words': WORDS, 'contracts': contracts, 'companies': companies,
+        'properties': properties, 'line_items': line_items
+    }
+    word = '(:words)[1 + floor(random() * array_length(:words, 1))::int]'
+
+    session.execute(db.text('''
+        CREATE TEMPORARY TABLE bench_contract (id INTEGER, n INTEGER) ON COMMIT DROP;
+        CREATE TEMPORARY TABLE bench_company (id INTEGER, n INTEGER) ON COMMIT DROP;
+    '''))
+
+    session.execute(db.text('''
+        WITH new AS (
+            INSERT INTO contract (description, financial_id, expiration_date, is_archived, is_visible, has_metrics)
+            SELECT {word} || ' ' || {word} || ' ' || i, 'BENCH-' || i,
+                current_date + 365, false, false, false
+            FROM generate_series(1, :contracts) i
+            RETURNING id
+        ) INSERT INTO bench_contract SELECT id, row_number() OVER () FROM new
+    '''.format(word=word)), params)
+
+    session.execute(db.text('''
+        WITH new AS (
+            INSERT INTO company (company_name)
+            SELECT {word} || ' ' || {word} || ' bench company ' || i
+            FROM generate_series(1, :companies) i
+            RETURNING id
+        ) INSERT INTO bench_company SELECT id, row_number() OVER () FROM new
+    '''.format(word=word)), params)
+
+    session.execute(db.text('''
+        INSERT INTO company_contract_association (contract_id, company_id)
+        SELECT c.id, co.id FROM bench_contract c
+        JOIN bench_company co ON co.n = 1 + c.n % :companies
+    '''), params)
+
+    session.execute(db.text('''
+        INSERT INTO contract_property (contract_id, key, value)
+        SELECT c.id, 'detail ' || i, {word} || ' ' || {word}
+        FROM bench_contract c, generate_series(1, :properties) i
+    '''.format(word=word)), params)
+
+    session.execute(db.text('''
+        INSERT INTO line_item (contract_id, description)
+        SELECT c.id, {word} || ' ' || {word} || ' ' || {word}
+        FROM bench_contract c, generate_series(1, :line_items) i
+    '''.format(word=word)), params)
+
+    rebuild_search_index(session)
+    session.execute(db.text('ANALYZE search_index'))
+    session.execute(db.text(SEARCH_ROWS))
+
+    return {
+        'per_row': session.execute(db.text('SELECT count(*) FROM bench_search_rows')).scalar(),
+        'document': session.execute(db.text('SELECT count(*) FROM search_index')).scalar(),
+    }
+
+# the search index as it was before the weighted document was added: one
+# row per contract/property/line item/company combination, with a GIN
+# index on each tsvector column
+SEARCH_ROWS = '''
+    CREATE TEMPORARY TABLE bench_search_rows ON COMMIT DROP AS
+    SELECT DISTINCT
+        c.id AS contract_id,
+        to_tsvector(c.description) AS tsv_contract_description,
+        to_tsvector(company.company_name) AS tsv_company_name,
+        to_tsvector(contract_property.value) AS tsv_detail_value,
+        to_tsvector(line_item.description) AS tsv_line_item_description
+    FROM contract c
+    LEFT OUTER JOIN contract_property ON c.id = contract_property.contract_id
+    LEFT OUTER JOIN line_item ON c.id = line_item.contract_id
+    LEFT OUTER JOIN company_contract_association ON c.id = company_contract_association.contract_id
+    LEFT OUTER JOIN company ON company.id = company_contract_association.company_id;
+
+    CREATE INDEX ON bench_search_rows (contract_id);
+    CREATE INDEX ON bench_search_rows USING gin (tsv_contract_description);
+    CREATE INDEX ON bench_search_rows USING gin (tsv_company_name);
+    CREATE INDEX ON bench_search_rows USING gin (tsv_detail_value);
+    CREATE INDEX ON bench_search_rows USING gin (tsv_line_item_description);
+    ANALYZE bench_search_rows;
+'''
+
+# ranking as it was done against those rows: the weighted document is
+# built for every matching row, and each contract keeps its best rank
+PER_ROW_SEARCH = '''
+    SELECT r.contract_id, max(ts_rank(
+        setweight(coalesce(r.tsv_company_name, ''), 'A') ||
+        setweight(coalesce(r.tsv_contract_description, ''), 'A') ||
+        setweight(coalesce(r.tsv_detail_value, ''), 'D') ||
+        setweight(coalesce(r.tsv_line_item_description, ''), 'B'),
+        q.query
+    )) AS rank
+    FROM bench_search_rows r
+    JOIN contract ON contract.id = r.contract_id
+    CROSS JOIN to_tsquery('english', :search_for) q(query)
+    WHERE r.tsv_company_name @@ q.query
+    OR r.tsv_contract_description @@ q.query
+    OR r.tsv_detail_value @@ q.query
+    OR r.tsv_line_item_description @@ q.query
+    GROUP BY r.contract_id
+    ORDER BY rank DESC, r.contract_id
+    LIMIT :limit
+'''
+
+def per_row_search(session, search_for, limit=50):
+    '''Fetch a first page of ranked results from the old per-row index
+    '''
+    return session.execute(
+        db.text(PER_ROW_SEARCH), {'search_for': search_for, 'limit': limit}
+    ).fetchall()
+
+def document_search(session, search_for, limit=50):
+    '''Fetch a first page of ranked results from the precomputed document
+    '''
+    query = db.func.to_tsquery(search_for, postgresql_regconfig='english')
+    return session.query(
+        SearchView.contract_id,
+        db.func.full_text.ts_rank(SearchView.tsv_document, query).label('rank')
+    ).join(
+        ContractBase, ContractBase.id == SearchView.contract_id
+    ).filter(
+        SearchView.tsv_document.match(search_for, postgresql_regconfig='english')
+    ).order_by(
+        db.text('rank DESC'), SearchView.contract_id
+    ).limit(limit).all()
+
+STRATEGIES = [
+    ('paginated', {}),
+    ('top_k', {'top_k': 50}),
+    ('min_rank', {'min_rank': 0.05}),
+    ('and_first', {'and_min_hits': 10}),
+    ('and_first_top_k', {'and_min_hits': 10, 'top_k': 50}),
+]
+
+def search_strategies(search_terms, repeat=10):
+    '''Time one search with each of the ``STRATEGIES``
+
+    Arguments:
+        search_terms: list of search terms
+
+    Keyword Arguments:
+        repeat: Number of timed runs of each strategy
+
+    Returns:
+        Dictionary of timings, keyed by strategy name
+    '''
+    search_for = ' | '.join(search_terms)
+    filter_or = build_filter({}, FILTER_FIELDS, search_for, None, True)
+    case_statements = build_cases({}, FILTER_FIELDS, search_for, True)
+
+    timings = {}
+    for name, options in STRATEGIES:
+        def search():
+            return find_contract_metadata(
+                search_for, case_statements, filter_or, [],
+                search_terms=search_terms, **options
+            )
+        timings[name] = time_it(search, repeat=repeat)
+        timings[name]['results'] = len(search()[0])
+    return timings
+
+def run(session, searches=None, prefixes=None, repeat=10, **corpus):
+    '''Benchmark search ranking against the old per-row index and the document
+
+    Arguments:
+        session: Sqlalchemy session to execute with. The session is
+            rolled back when the benchmark finishes.
+
+    Keyword Arguments:
+        searches: list of searches, each a space separated string of
+            search terms, defaults to a sample of ``WORDS``
+        prefixes: list of partially typed searches to time suggestions for
+        repeat: Number of timed runs of each search
+        **corpus: Passed through to :py:func:`build_corpus`
+
+    Returns:
+        Dictionary of benchmark results
+    '''
+    searches = searches or ['asphalt', 'pipe valve', 'vehicle tires towing']
+    prefixes = prefixes or ['a', 'pi', 'veh', 'bench co', 'bench 12']
+
+    try:
+        results = {'rows': build_corpus(session, **corpus), 'searches': []}
+
+        for search in searches:
+            search_terms = search.split()
+            search_for = ' | '.join(search_terms)
+            results['searches'].append({
+                'search_for': search_for,
+                'per_row': time_it(lambda: per_row_search(session, search_for), repeat=repeat),
+                'document': time_it(lambda: document_search(session, search_for), repeat=repeat),
+                'strategies': search_strategies(search_terms, repeat=repeat),
+            })
+
+        results['suggest'] = [{
+            'prefix': prefix,
+            'suggest': time_it(lambda: find_suggestions(prefix), repeat=repeat)
+        } for prefix in prefixes]
+    finally:
+        session.rollback()
+
+    return results
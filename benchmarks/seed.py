@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+'''Synthetic large-scale data for benchmarking
+
+Builds production-sized volumes of every table the slow paths touch:
+scout's contracts, companies, properties, line items and follows,
+conductor's flows, stages, in-progress contracts and action logs, and
+beacon's vendors, categories and opportunities. Everything is inserted
+with set-based SQL, so hundreds of thousands of rows take seconds rather
+than hours. The shapes follow the ones in ``purchasing_test/factories.py``
+and the county scraper.
+
+Random values come from ``setseed``, so the same arguments build the
+same dataset. Every name and email is prefixed, so a dataset can be
+built alongside real data (or another dataset with a different prefix).
+'''
+
+from purchasing.database import db
+from purchasing.data.searches import rebuild_search_index
+from purchasing.data.follows import rebuild_department_follows
+from purchasing.data.conductor_queue import rebuild_conductor_queue
+
+from benchmarks.search import WORDS
+
+STAGE_NAMES = [
+    'Review spec', 'Draft solicitation', 'Legal review', 'Advertise',
+    'Pre-bid meeting', 'Open bids', 'Evaluate bids', 'Award', 'Contract signed'
+]
+UNITS = ['EACH', 'BOX', 'CASE', 'GALLON', 'FOOT', 'TON', 'HOUR', 'DOZEN']
+TABLES = [
+    'department', 'users', 'company', 'contract', 'company_contract_association',
+    'contract_property', 'line_item', 'contract_user_association', 'stage', 'flow',
+    'contract_stage', 'contract_stage_action_item', 'category', 'vendor',
+    'category_vendor_association', 'opportunity', 'category_opportunity_association',
+    'opportunity_vendor_association_table'
+]
+
+def _random(array):
+    '''SQL for a random element of an array parameter
+    '''
+    return '(:{0})[1 + floor(random() * array_length(:{0}, 1))::int]'.format(array)
+
+def table_counts(session):
+    '''Count the rows in each of the tables a dataset fills
+    '''
+    return dict(
+        (table, session.execute(db.text('SELECT count(*) FROM ' + table)).scalar())
+        for table in TABLES
+    )
+
+def seed_scale(
+    session, prefix='scale', seed=0.5, contracts=20000, companies=4000,
+    properties=5, line_items=20, departments=25, users=1000, follows=10,
+    flows=4, stages=6, in_progress=2000, actions=3, categories=500,
+    vendors=10000, subscriptions=5, opportunities=2000
+):
+    '''Build a large synthetic dataset
+
+    Nothing is committed, so the caller decides whether to keep the data
+    or roll it back.
+
+    Arguments:
+        session: Sqlalchemy session to execute with
+
+    Keyword Arguments:
+        prefix: Prefix for every name and email, which need to be unique
+        seed: Seed for postgres' random number generator, between -1 and 1
+        contracts: Number of scout contracts
+        companies: Number of companies
+        properties: Number of properties per contract, including a spec number
+        line_items: Number of county-style line items per contract
+        departments: Number of departments
+        users: Number of city staff users
+        follows: Number of contracts each user follows
+        flows: Number of conductor flows
+        stages: Number of stages in each flow
+        in_progress: Number of contracts being worked on in conductor
+        actions: Number of notes in each in-progress contract's action log,
+            on top of its stage transitions
+        categories: Number of beacon categories
+        vendors: Number of beacon vendors
+        subscriptions: Number of categories and opportunities each vendor
+            subscribes to
+        opportunities: Number of beacon opportunities
+
+    Returns:
+        Dictionary of table name to the number of rows in the table
+    '''
+    params = {
+        'prefix': prefix, 'words': WORDS, 'stage_names': STAGE_NAMES, 'units': UNITS,
+        'contracts': contracts, 'companies': companies, 'properties': properties,
+        'line_items': line_items, 'departments': departments, 'users': users,
+        'follows': follows, 'flows': flows, 'stages': stages,
+        'in_progress': min(in_progress, contracts), 'actions': actions,
+        'categories': categories, 'vendors': vendors,
+        'subscriptions': subscriptions, 'opportunities': opportunities
+    }
+    word = _random('words')
+
+    def execute(sql):
+        session.execute(db.text(sql.format(word=word)), params)
+
+    session.execute(db.text('SELECT setseed(:seed)'), {'seed': seed})
+
+    for table in [
+        'department', 'contract_type', 'users', 'company', 'contract', 'stage',
+        'flow', 'progress', 'category', 'vendor', 'opportunity'
+    ]:
+        session.execute(db.text(
+            'CREATE TEMPORARY TABLE scale_{} (id INTEGER, n INTEGER) ON COMMIT DROP'.format(table)
+        ))
+
+    # departments, users and their roles
+    execute('''
+        WITH new AS (
+            INSERT INTO department (name)
+            SELECT :prefix || ' department ' || i FROM generate_series(1, :departments) i
+            RETURNING id, name
+        ) INSERT INTO scale_department
+        SELECT id, substring(name FROM '\\d+$')::int FROM new
+    ''')
+    execute('''
+        INSERT INTO roles (name)
+        SELECT new_role FROM unnest(ARRAY['staff', 'conductor']) new_role
+        WHERE NOT EXISTS (SELECT 1 FROM roles WHERE roles.name = new_role)
+    ''')
+    execute('''
+        WITH new AS (
+            INSERT INTO users (email, first_name, last_name, active, password, confirmed_at, department_id)
+            SELECT
+                :prefix || '-user-' || i || '@example.com', 'User', 'Number ' || i,
+                true, md5(random()::text), now(), d.id
+            FROM generate_series(1, :users) i
+            JOIN scale_department d ON d.n = 1 + i % :departments
+            RETURNING id, email
+        ) INSERT INTO scale_users
+        SELECT id, substring(email FROM '-(\\d+)@')::int FROM new
+    ''')
+    execute('''
+        INSERT INTO roles_users (user_id, role_id)
+        SELECT u.id, roles.id FROM scale_users u
+        JOIN roles ON roles.name = CASE WHEN u.n % 10 = 0 THEN 'conductor' ELSE 'staff' END
+    ''')
+
+    # contract types: one managed in conductor and open to opportunities, one not
+    execute('''
+        WITH new AS (
+            INSERT INTO contract_type (name, allow_opportunities, managed_by_conductor)
+            VALUES (:prefix || ' County', true, true), (:prefix || ' COSTARS', false, false)
+            RETURNING id, managed_by_conductor
+        ) INSERT INTO scale_contract_type
+        SELECT id, CASE WHEN managed_by_conductor THEN 1 ELSE 2 END FROM new
+    ''')
+
+    # companies and contracts
+    execute('''
+        WITH new AS (
+            INSERT INTO company (company_name)
+            SELECT {word} || ' ' || {word} || ' ' || :prefix || ' company ' || i
+            FROM generate_series(1, :companies) i
+            RETURNING id, company_name
+        ) INSERT INTO scale_company
+        SELECT id, substring(company_name FROM '\\d+$')::int FROM new
+    ''')
+    execute('''
+        WITH new AS (
+            INSERT INTO contract (
+                description, financial_id, expiration_date, contract_href,
+                is_archived, is_visible, has_metrics, contract_type_id, department_id
+            )
+            SELECT
+                {word} || ' ' || {word} || ' ' || {word},
+                upper(:prefix) || '-' || i,
+                current_date + (random() * 900 - 180)::int,
+                'http://example.com/' || :prefix || '/' || i || '.pdf',
+                random() < 0.05, true, true, t.id, d.id
+            FROM generate_series(1, :contracts) i
+            JOIN scale_contract_type t ON t.n = CASE WHEN i % 3 = 0 THEN 2 ELSE 1 END
+            JOIN scale_department d ON d.n = 1 + i % :departments
+            RETURNING id, financial_id
+        ) INSERT INTO scale_contract
+        SELECT id, substring(financial_id FROM '\\d+$')::int FROM new
+    ''')
+    execute('''
+        INSERT INTO company_contract_association (contract_id, company_id)
+        SELECT c.id, co.id FROM scale_contract c
+        JOIN scale_company co ON co.n = 1 + c.n % :companies
+        UNION ALL
+        SELECT c.id, co.id FROM scale_contract c
+        JOIN scale_company co ON co.n = 1 + (c.n * 7) % :companies
+        WHERE c.n % 4 = 0 AND (c.n * 7) % :companies != c.n % :companies
+    ''')
+    execute('''
+        INSERT INTO contract_property (contract_id, key, value)
+        SELECT c.id, 'Spec Number', lpad(c.n::text, 7, '0') FROM scale_contract c
+        UNION ALL
+        SELECT c.id, 'Detail ' || i, {word} || ' ' || {word}
+        FROM scale_contract c, generate_series(2, :properties) i
+    ''')
+    execute('''
+        INSERT INTO line_item (
+            contract_id, description, manufacturer, model_number, quantity,
+            unit_of_measure, unit_cost, total_cost, percentage, company_name, company_id
+        )
+        SELECT
+            contract_id, description, manufacturer, model_number, quantity,
+            unit_of_measure, unit_cost, quantity * unit_cost, false, company_name, company_id
+        FROM (
+            SELECT
+                c.id AS contract_id, upper({word} || ' ' || {word} || ' ' || {word}) AS description,
+                initcap({word}) || ' Manufacturing' AS manufacturer,
+                upper(substr(md5(random()::text), 1, 8)) AS model_number,
+                1 + (random() * 500)::int AS quantity, {unit} AS unit_of_measure,
+                round((random() * 2000)::numeric, 2)::float AS unit_cost,
+                co.company_name, co.id AS company_id
+            FROM scale_contract c
+            JOIN company_contract_association cca ON cca.contract_id = c.id
+            JOIN company co ON co.id = cca.company_id
+            CROSS JOIN generate_series(1, :line_items) i
+            WHERE c.n % 3 != 0
+        ) items
+    '''.replace('{unit}', _random('units')))
+
+    # follows, picking contracts before joining so random() runs once per pick
+    execute('''
+        INSERT INTO contract_user_association (user_id, contract_id)
+        SELECT DISTINCT picks.user_id, c.id FROM (
+            SELECT u.id AS user_id, 1 + floor(random() * :contracts)::int AS n
+            FROM scale_users u, generate_series(1, :follows) i
+        ) picks JOIN scale_contract c ON c.n = picks.n
+    ''')
+
+    # conductor flows and their stages
+    execute('''
+        INSERT INTO stage (name, post_opportunities, default_message)
+        SELECT
+            (:stage_names)[1 + (s - 1) % array_length(:stage_names, 1)] ||
+                ' (' || :prefix || ' flow ' || f || ', stage ' || s || ')',
+            s = 3, 'Default message for stage ' || s
+        FROM generate_series(1, :flows) f, generate_series(1, :stages) s
+    ''')
+    execute('''
+        INSERT INTO scale_stage
+        SELECT stage.id, f * 1000 + s
+        FROM generate_series(1, :flows) f, generate_series(1, :stages) s
+        JOIN stage ON stage.name LIKE '% (' || :prefix || ' flow ' || f || ', stage ' || s || ')'
+    ''')
+    execute('''
+        WITH new AS (
+            INSERT INTO flow (flow_name, stage_order, is_archived)
+            SELECT :prefix || ' flow ' || n / 1000, array_agg(id ORDER BY n), false
+            FROM scale_stage GROUP BY n / 1000
+            RETURNING id, flow_name
+        ) INSERT INTO scale_flow
+        SELECT id, substring(flow_name FROM '\\d+$')::int FROM new
+    ''')
+
+    # contracts being worked on in conductor are invisible copies of a
+    # managed parent contract, partway through a flow
+    session.execute(db.text('''
+        CREATE TEMPORARY TABLE scale_progress_plan ON COMMIT DROP AS
+        SELECT
+            parent.id AS parent_id, parent.n,
+            1 + floor(random() * :flows)::int AS flow_n,
+            1 + floor(random() * :stages)::int AS position,
+            (1 + floor(random() * (:users / 10))::int) * 10 AS user_n,
+            (now() AT TIME ZONE 'utc') - (random() * 365) * interval '1 day' AS started,
+            (1 + random() * 20) * interval '1 day' AS step
+        FROM scale_contract parent
+        WHERE parent.n % 3 != 0
+        ORDER BY parent.n LIMIT :in_progress
+    '''), params)
+    execute('''
+        WITH new AS (
+            INSERT INTO contract (
+                description, financial_id, expiration_date, is_archived, is_visible,
+                has_metrics, contract_type_id, department_id, parent_id, flow_id,
+                current_stage_id, assigned_to
+            )
+            SELECT
+                parent.description, parent.financial_id, parent.expiration_date,
+                false, false, true, parent.contract_type_id, parent.department_id,
+                parent.id, f.id, s.id, u.id
+            FROM scale_progress_plan plan
+            JOIN contract parent ON parent.id = plan.parent_id
+            JOIN scale_flow f ON f.n = plan.flow_n
+            JOIN scale_stage s ON s.n = plan.flow_n * 1000 + plan.position
+            JOIN scale_users u ON u.n = LEAST(plan.user_n, :users)
+            RETURNING id, parent_id
+        ) INSERT INTO scale_progress
+        SELECT new.id, plan.n FROM new JOIN scale_progress_plan plan ON plan.parent_id = new.parent_id
+    ''')
+    execute('''
+        INSERT INTO contract_property (contract_id, key, value)
+        SELECT p.id, 'Spec Number', lpad(p.n::text, 7, '0') FROM scale_progress p
+    ''')
+    execute('''
+        INSERT INTO contract_stage (id, contract_id, stage_id, flow_id, entered, exited)
+        SELECT
+            nextval('autoincr_contract_stage_id'), p.id, s.id, f.id,
+            CASE WHEN s.n % 1000 <= plan.position
+                THEN plan.started + (s.n % 1000 - 1) * plan.step END,
+            CASE WHEN s.n % 1000 < plan.position
+                THEN plan.started + (s.n % 1000) * plan.step END
+        FROM scale_progress p
+        JOIN scale_progress_plan plan ON plan.n = p.n
+        JOIN scale_flow f ON f.n = plan.flow_n
+        JOIN scale_stage s ON s.n / 1000 = plan.flow_n
+    ''')
+    execute('''
+        INSERT INTO contract_stage_action_item (
+            contract_stage_id, action_type, action_detail, taken_at, taken_by
+        )
+        SELECT
+            cs.id, action.action_type, json_build_object(
+                'timestamp', to_char(action.taken_at, 'YYYY-MM-DD"T"HH24\\:MI\\:SS'),
+                'date', to_char(action.taken_at, 'YYYY-MM-DD'),
+                'type', action.action_type, 'label', action.label, 'stage_name', stage.name
+            ), action.taken_at, c.assigned_to
+        FROM contract_stage cs
+        JOIN scale_progress p ON p.id = cs.contract_id
+        JOIN contract c ON c.id = cs.contract_id
+        JOIN stage ON stage.id = cs.stage_id
+        CROSS JOIN LATERAL (
+            VALUES (cs.entered, 'entered', 'Started work'),
+                   (cs.exited, 'exited', 'Completed work')
+        ) action (taken_at, action_type, label)
+        WHERE action.taken_at IS NOT NULL
+    ''')
+    execute('''
+        INSERT INTO contract_stage_action_item (
+            contract_stage_id, action_type, action_detail, taken_at, taken_by
+        )
+        SELECT
+            cs.id, 'activity', json_build_object(
+                'note', {word} || ' ' || {word} || ' ' || {word} || ' ' || {word},
+                'stage_name', stage.name
+            ), cs.entered + (coalesce(cs.exited, now() AT TIME ZONE 'utc') - cs.entered) * random(),
+            c.assigned_to
+        FROM contract_stage cs
+        JOIN scale_progress p ON p.id = cs.contract_id
+        JOIN contract c ON c.id = cs.contract_id
+        JOIN stage ON stage.id = cs.stage_id AND stage.id = c.current_stage_id
+        CROSS JOIN generate_series(1, :actions) i
+    ''')
+
+    # beacon categories, vendors and opportunities
+    execute('''
+        WITH new AS (
+            INSERT INTO category (
+                nigp_codes, category, subcategory, category_friendly_name, examples, examples_tsv
+            )
+            SELECT
+                ARRAY[10000 + i], initcap({word}), initcap({word}) || ' ' || :prefix || ' ' || i,
+                initcap({word}) || ' and ' || {word}, examples, to_tsvector(examples)
+            FROM (
+                SELECT i, {word} || ', ' || {word} || ', ' || {word} AS examples
+                FROM generate_series(1, :categories) i
+            ) categories
+            RETURNING id, subcategory
+        ) INSERT INTO scale_category
+        SELECT id, substring(subcategory FROM '\\d+$')::int FROM new
+    ''')
+    execute('''
+        WITH new AS (
+            INSERT INTO vendor (
+                business_name, email, first_name, last_name, minority_owned,
+                veteran_owned, woman_owned, disadvantaged_owned, subscribed_to_newsletter
+            )
+            SELECT
+                initcap({word}) || ' ' || initcap({word}) || ' LLC',
+                :prefix || '-vendor-' || i || '@example.com', 'Vendor', 'Number ' || i,
+                random() < 0.1, random() < 0.1, random() < 0.1, random() < 0.1,
+                random() < 0.3
+            FROM generate_series(1, :vendors) i
+            RETURNING id, email
+        ) INSERT INTO scale_vendor
+        SELECT id, substring(email FROM '-(\\d+)@')::int FROM new
+    ''')
+    execute('''
+        INSERT INTO category_vendor_association (category_id, vendor_id)
+        SELECT DISTINCT c.id, picks.vendor_id FROM (
+            SELECT v.id AS vendor_id, 1 + floor(random() * :categories)::int AS n
+            FROM scale_vendor v, generate_series(1, :subscriptions) i
+        ) picks JOIN scale_category c ON c.n = picks.n
+    ''')
+    execute('''
+        WITH new AS (
+            INSERT INTO opportunity (
+                title, description, planned_publish, planned_submission_start,
+                planned_submission_end, vendor_documents_needed, is_public, is_archived,
+                published_at, publish_notification_sent, department_id, contact_id,
+                opportunity_type_id
+            )
+            SELECT
+                initcap({word} || ' ' || {word}) || ' (' || :prefix || ' ' || i || ')',
+                {word} || ' ' || {word} || ' ' || {word} || ' ' || {word},
+                publish, publish + interval '7 days', publish + interval '30 days',
+                ARRAY[]::integer[], publish < now(), false,
+                CASE WHEN publish < now() THEN publish END, publish < now(),
+                d.id, u.id, t.id
+            FROM (
+                SELECT i, now() + (random() * 240 - 180) * interval '1 day' AS publish
+                FROM generate_series(1, :opportunities) i
+            ) opportunities
+            JOIN scale_department d ON d.n = 1 + i % :departments
+            JOIN scale_users u ON u.n = 1 + i % :users
+            JOIN scale_contract_type t ON t.n = 1
+            RETURNING id, title
+        ) INSERT INTO scale_opportunity
+        SELECT id, substring(title FROM '(\\d+)\\)$')::int FROM new
+    ''')
+    execute('''
+        INSERT INTO category_opportunity_association (category_id, opportunity_id)
+        SELECT DISTINCT c.id, picks.opportunity_id FROM (
+            SELECT o.id AS opportunity_id, 1 + floor(random() * :categories)::int AS n
+            FROM scale_opportunity o, generate_series(1, 3) i
+        ) picks JOIN scale_category c ON c.n = picks.n
+    ''')
+    execute('''
+        INSERT INTO opportunity_vendor_association_table (opportunity_id, vendor_id)
+        SELECT DISTINCT o.id, picks.vendor_id FROM (
+            SELECT v.id AS vendor_id, 1 + floor(random() * :opportunities)::int AS n
+            FROM scale_vendor v, generate_series(1, :subscriptions) i
+        ) picks JOIN scale_opportunity o ON o.n = picks.n
+    ''')
+
+    # raw inserts skip the orm events that keep these up to date
+    rebuild_search_index(session)
+    rebuild_department_follows(session)
+    rebuild_conductor_queue(session)
+
+    return table_counts(session)
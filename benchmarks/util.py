@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+def percentile(timings, pct):
+    '''Returns the value at a percentile of a list of timings
+
+    Arguments:
+        timings: list of numbers
+        pct: percentile, between 0 and 100
+
+    Returns:
+        The nearest-rank percentile of the timings
+    '''
+    ordered = sorted(timings)
+    index = max(int(round(pct / 100.0 * len(ordered))) - 1, 0)
+    return ordered[index]
+
+def time_it(func, repeat=10, warmup=1):
+    '''Time repeated calls to a function
+
+    Arguments:
+        func: function that takes no arguments
+
+    Keyword Arguments:
+        repeat: Number of timed calls
+        warmup: Number of untimed calls to make first, so that
+            caches are warm
+
+    Returns:
+        Dictionary of timing statistics, in milliseconds
+    '''
+    for _ in range(warmup):
+        func()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'max_ms': round(max(timings), 3),
+    }
@@ -86,7 +86,7 @@ def import_old_contracts(filepath):
     print 'Importing data from {filepath}\n'.format(filepath=filepath)
     main(filepath)
     print 'Import finished!'
-    print 'Refreshing search_view...'
+    print 'Rebuilding search index...'
     refresh_search_view()
     print 'Done!'
     return
@@ -103,7 +103,7 @@ def import_state(filepath):
     print 'Importing data from {filepath}\n'.format(filepath=filepath)
     main(filepath)
     print 'Import finished!'
-    print 'Refreshing search_view...'
+    print 'Rebuilding search index...'
     refresh_search_view()
     print 'Done!'
     return
@@ -287,6 +287,100 @@ def seed(user=None, secret=None, bucket=None):
     import_nigp('./purchasing/data/importer/seed/2015-07-01-seed-nigp-cleaned.csv')
     print ''
 
+@manager.command
+def rebuild_search_index():
+    '''Rebuilds the entire scout search index from the contract tables
+    '''
+    refresh_search_view()
+    print 'Done!'
+
+@manager.command
+def rebuild_department_follows():
+    '''Recounts every department's contract follows from scratch
+    '''
+    from purchasing.data.follows import rebuild_department_follows
+    rebuild_department_follows(db.session)
+    db.session.commit()
+    print 'Done!'
+
+@manager.command
+def rebuild_conductor_queue():
+    '''Rebuilds the conductor queue from scratch, fixing any drift
+    '''
+    from purchasing.data.conductor_queue import rebuild_conductor_queue
+    rebuild_conductor_queue(db.session)
+    db.session.commit()
+    print 'Done!'
+
+@manager.option('-n', '--contracts', dest='contracts', default=2000)
+@manager.option('-r', '--repeat', dest='repeat', default=10)
+def benchmark_search(contracts=2000, repeat=10):
+    '''Benchmarks scout search ranking against a synthetic corpus
+
+    The corpus is rolled back when the benchmark finishes.
+    '''
+    import json
+    from benchmarks import search
+    print json.dumps(search.run(
+        db.session, repeat=int(repeat), contracts=int(contracts)
+    ), indent=2)
+
+@manager.option('-p', '--prefix', dest='prefix', default='scale')
+@manager.option('-s', '--seed', dest='seed', default=0.5)
+@manager.option('-n', '--contracts', dest='contracts', default=20000)
+@manager.option('-u', '--users', dest='users', default=1000)
+@manager.option('-i', '--in-progress', dest='in_progress', default=2000)
+@manager.option('-v', '--vendors', dest='vendors', default=10000)
+@manager.option('-o', '--opportunities', dest='opportunities', default=2000)
+def seed_scale(
+    prefix='scale', seed=0.5, contracts=20000, users=1000, in_progress=2000,
+    vendors=10000, opportunities=2000
+):
+    '''Seeds a large, reproducible synthetic dataset for benchmarking
+
+    Unlike seed, which imports a handful of real contracts, this builds
+    production-sized tables for scout, conductor and beacon. Run it again
+    with a different prefix to add another dataset alongside.
+    '''
+    import json
+    from benchmarks.seed import seed_scale as _seed_scale
+    from purchasing.data.searches import bump_search_generation
+
+    counts = _seed_scale(
+        db.session, prefix=prefix, seed=float(seed), contracts=int(contracts),
+        companies=max(int(contracts) / 5, 1), users=int(users), in_progress=int(in_progress),
+        vendors=int(vendors), opportunities=int(opportunities)
+    )
+    db.session.commit()
+    bump_search_generation()
+    db.session.execute('ANALYZE')
+    db.session.commit()
+    print json.dumps(counts, indent=2, sort_keys=True)
+
+@manager.option('-r', '--repeat', dest='repeat', default=10)
+@manager.option('-o', '--output', dest='output', default=None)
+@manager.option('--only', dest='only', default=None)
+def bench(repeat=10, output=None, only=None):
+    '''Benchmarks scout, conductor and beacon hot paths
+
+    Meant to be run against a dataset built with seed_scale. Results are
+    written as JSON to the output file (or printed), so that runs from
+    before and after a change can be compared. Pass a comma-separated
+    list of benchmark names to only to run some of them.
+    '''
+    import json
+    from benchmarks import hot_paths
+    results = json.dumps(hot_paths.run(
+        db.session, repeat=int(repeat), only=only.split(',') if only else None
+    ), indent=2, sort_keys=True)
+
+    if output:
+        with open(output, 'w') as f:
+            f.write(results)
+        print 'Wrote results to {}'.format(output)
+    else:
+        print results
+
 @manager.command
 def reset_conductor():
     '''Totally resets conductor, unassigns all contracts/flows/stages
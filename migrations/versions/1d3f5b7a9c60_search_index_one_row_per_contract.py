@@ -0,0 +1,159 @@
+"""collapse the search index to one row per contract
+
+Revision ID: 1d3f5b7a9c60
+Revises: 4b7e1a9c2d58
+Create Date: 2026-10-18 12:20:33.870412
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1d3f5b7a9c60'
+down_revision = '4b7e1a9c2d58'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+index_set = [
+    'tsv_contract_description',
+    'tsv_company_name',
+    'tsv_detail_value',
+    'tsv_line_item_description',
+    'tsv_document'
+]
+
+def upgrade():
+    conn = op.get_bind()
+
+    op.drop_table('search_index')
+
+    op.create_table('search_index',
+    sa.Column('contract_id', sa.Integer(), nullable=False),
+    sa.Column('financial_id', sa.String(length=255), nullable=True),
+    sa.Column('expiration_date', sa.Date(), nullable=True),
+    sa.Column('contract_description', sa.Text(), nullable=True),
+    sa.Column('tsv_contract_description', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('company_ids', postgresql.ARRAY(sa.Integer()), nullable=True),
+    sa.Column('company_names', postgresql.ARRAY(sa.Text()), nullable=True),
+    sa.Column('tsv_company_name', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('tsv_detail_value', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('tsv_line_item_description', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('tsv_document', postgresql.TSVECTOR(), nullable=True),
+    sa.PrimaryKeyConstraint('contract_id')
+    )
+    op.create_index('ix_search_index_company_ids', 'search_index', ['company_ids'], postgresql_using='gin')
+
+    for index in index_set:
+        op.create_index(
+            'ix_search_index_{}'.format(index), 'search_index', [index], postgresql_using='gin'
+        )
+
+    # backfill the new table
+    conn.execute(sa.sql.text('''
+    INSERT INTO search_index (
+        contract_id, financial_id, expiration_date,
+        contract_description, tsv_contract_description,
+        company_ids, company_names, tsv_company_name,
+        tsv_detail_value, tsv_line_item_description,
+        tsv_document
+    )
+    SELECT
+        c.id AS contract_id,
+        c.financial_id, c.expiration_date,
+        c.description AS contract_description,
+        to_tsvector(c.description) AS tsv_contract_description,
+        coalesce(companies.ids, '{}') AS company_ids,
+        coalesce(companies.names, '{}') AS company_names,
+        to_tsvector(array_to_string(companies.names, ' ')) AS tsv_company_name,
+        to_tsvector(properties.value) AS tsv_detail_value,
+        to_tsvector(line_items.description) AS tsv_line_item_description,
+        setweight(to_tsvector(coalesce(array_to_string(companies.names, ' '), '')), 'A') ||
+        setweight(to_tsvector(coalesce(c.description, '')), 'A') ||
+        setweight(to_tsvector(coalesce(properties.value, '')), 'D') ||
+        setweight(to_tsvector(coalesce(line_items.description, '')), 'B') AS tsv_document
+    FROM contract c
+    LEFT JOIN LATERAL (
+        SELECT
+            array_agg(company.id ORDER BY company.id) AS ids,
+            array_agg(company.company_name ORDER BY company.id) AS names
+        FROM company
+        WHERE company.id IN (
+            SELECT company_id FROM company_contract_association
+            WHERE company_contract_association.contract_id = c.id
+        )
+    ) companies ON true
+    LEFT JOIN LATERAL (
+        SELECT string_agg(contract_property.value, ' ') AS value
+        FROM contract_property WHERE contract_property.contract_id = c.id
+    ) properties ON true
+    LEFT JOIN LATERAL (
+        SELECT string_agg(line_item.description, ' ') AS description
+        FROM line_item WHERE line_item.contract_id = c.id
+    ) line_items ON true
+    '''))
+
+def downgrade():
+    conn = op.get_bind()
+
+    op.drop_table('search_index')
+
+    op.create_table('search_index',
+    sa.Column('id', sa.Text(), nullable=False),
+    sa.Column('contract_id', sa.Integer(), nullable=True),
+    sa.Column('company_id', sa.Integer(), nullable=True),
+    sa.Column('financial_id', sa.String(length=255), nullable=True),
+    sa.Column('expiration_date', sa.Date(), nullable=True),
+    sa.Column('contract_description', sa.Text(), nullable=True),
+    sa.Column('tsv_contract_description', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('company_name', sa.Text(), nullable=True),
+    sa.Column('tsv_company_name', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('detail_key', sa.Text(), nullable=True),
+    sa.Column('detail_value', sa.Text(), nullable=True),
+    sa.Column('tsv_detail_value', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('line_item_description', sa.Text(), nullable=True),
+    sa.Column('tsv_line_item_description', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('tsv_document', postgresql.TSVECTOR(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_search_index_id'), 'search_index', ['id'], unique=False)
+    op.create_index(op.f('ix_search_index_contract_id'), 'search_index', ['contract_id'], unique=False)
+    op.create_index(op.f('ix_search_index_company_id'), 'search_index', ['company_id'], unique=False)
+
+    for index in index_set:
+        op.create_index(
+            'ix_search_index_{}'.format(index), 'search_index', [index], postgresql_using='gin'
+        )
+
+    conn.execute(sa.sql.text('''
+    INSERT INTO search_index (
+        id, contract_id, company_id, financial_id, expiration_date,
+        contract_description, tsv_contract_description,
+        company_name, tsv_company_name,
+        detail_key, detail_value, tsv_detail_value,
+        line_item_description, tsv_line_item_description,
+        tsv_document
+    )
+    SELECT DISTINCT
+        concat_ws('-', c.id, contract_property.id, line_item.id, company.id) AS id,
+        c.id AS contract_id,
+        company.id AS company_id,
+        c.financial_id, c.expiration_date,
+        c.description AS contract_description,
+        to_tsvector(c.description) AS tsv_contract_description,
+        company.company_name AS company_name,
+        to_tsvector(company.company_name) AS tsv_company_name,
+        contract_property.key AS detail_key,
+        contract_property.value AS detail_value,
+        to_tsvector(contract_property.value) AS tsv_detail_value,
+        line_item.description AS line_item_description,
+        to_tsvector(line_item.description) AS tsv_line_item_description,
+        setweight(to_tsvector(coalesce(company.company_name, '')), 'A') ||
+        setweight(to_tsvector(coalesce(c.description, '')), 'A') ||
+        setweight(to_tsvector(coalesce(contract_property.value, '')), 'D') ||
+        setweight(to_tsvector(coalesce(line_item.description, '')), 'B') AS tsv_document
+    FROM contract c
+    LEFT OUTER JOIN contract_property ON c.id = contract_property.contract_id
+    LEFT OUTER JOIN line_item ON c.id = line_item.contract_id
+    LEFT OUTER JOIN company_contract_association ON c.id = company_contract_association.contract_id
+    LEFT OUTER JOIN company ON company.id = company_contract_association.company_id
+    '''))
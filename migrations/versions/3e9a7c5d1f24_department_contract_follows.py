@@ -0,0 +1,47 @@
+"""add department contract follows
+
+Revision ID: 3e9a7c5d1f24
+Revises: 6c2e4a8f1b93
+Create Date: 2026-10-18 14:21:07.315842
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3e9a7c5d1f24'
+down_revision = '6c2e4a8f1b93'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    op.create_table('department_contract_follows',
+    sa.Column('department_id', sa.Integer(), nullable=False),
+    sa.Column('contract_id', sa.Integer(), nullable=False),
+    sa.Column('follows', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['contract_id'], ['contract.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['department_id'], ['department.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('department_id', 'contract_id')
+    )
+    op.create_index(
+        'ix_department_contract_follows_ranking', 'department_contract_follows',
+        ['department_id', sa.text('follows DESC'), 'contract_id'], unique=False
+    )
+
+    # backfill from the follows we already have
+    conn.execute(sa.sql.text('''
+    INSERT INTO department_contract_follows (department_id, contract_id, follows)
+    SELECT users.department_id, contract_user_association.contract_id, count(*)
+    FROM contract_user_association
+    JOIN users ON users.id = contract_user_association.user_id
+    WHERE users.department_id IS NOT NULL
+    AND contract_user_association.contract_id IS NOT NULL
+    GROUP BY 1, 2
+    '''))
+
+
+def downgrade():
+    op.drop_index('ix_department_contract_follows_ranking', table_name='department_contract_follows')
+    op.drop_table('department_contract_follows')
@@ -0,0 +1,37 @@
+"""add precomputed weighted search document
+
+Revision ID: 4b7e1a9c2d58
+Revises: 2f6b8d0c4e17
+Create Date: 2026-10-18 11:41:07.215563
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b7e1a9c2d58'
+down_revision = '2f6b8d0c4e17'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    op.add_column('search_index', sa.Column('tsv_document', postgresql.TSVECTOR(), nullable=True))
+
+    # backfill the document from the existing tsvector columns
+    conn.execute(sa.sql.text('''
+    UPDATE search_index SET tsv_document =
+        setweight(coalesce(tsv_company_name, ''), 'A') ||
+        setweight(coalesce(tsv_contract_description, ''), 'A') ||
+        setweight(coalesce(tsv_detail_value, ''), 'D') ||
+        setweight(coalesce(tsv_line_item_description, ''), 'B')
+    '''))
+
+    op.create_index('ix_search_index_tsv_document', 'search_index', ['tsv_document'], postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_search_index_tsv_document', table_name='search_index')
+    op.drop_column('search_index', 'tsv_document')
@@ -0,0 +1,128 @@
+"""replace search_view with search_index table
+
+Revision ID: 5a1c2e9d7b34
+Revises: 444872e13dac
+Create Date: 2026-10-18 10:12:41.318215
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5a1c2e9d7b34'
+down_revision = '444872e13dac'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+index_set = [
+    'tsv_contract_description',
+    'tsv_company_name',
+    'tsv_detail_value',
+    'tsv_line_item_description'
+]
+
+def upgrade():
+    conn = op.get_bind()
+
+    # drop the search_view
+    conn.execute(sa.sql.text('''
+    DROP MATERIALIZED VIEW IF EXISTS search_view
+    '''))
+
+    op.create_table('search_index',
+    sa.Column('id', sa.Text(), nullable=False),
+    sa.Column('contract_id', sa.Integer(), nullable=True),
+    sa.Column('company_id', sa.Integer(), nullable=True),
+    sa.Column('financial_id', sa.String(length=255), nullable=True),
+    sa.Column('expiration_date', sa.Date(), nullable=True),
+    sa.Column('contract_description', sa.Text(), nullable=True),
+    sa.Column('tsv_contract_description', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('company_name', sa.Text(), nullable=True),
+    sa.Column('tsv_company_name', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('detail_key', sa.Text(), nullable=True),
+    sa.Column('detail_value', sa.Text(), nullable=True),
+    sa.Column('tsv_detail_value', postgresql.TSVECTOR(), nullable=True),
+    sa.Column('line_item_description', sa.Text(), nullable=True),
+    sa.Column('tsv_line_item_description', postgresql.TSVECTOR(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_search_index_id'), 'search_index', ['id'], unique=False)
+    op.create_index(op.f('ix_search_index_contract_id'), 'search_index', ['contract_id'], unique=False)
+    op.create_index(op.f('ix_search_index_company_id'), 'search_index', ['company_id'], unique=False)
+
+    for index in index_set:
+        op.create_index(
+            'ix_search_index_{}'.format(index), 'search_index', [index], postgresql_using='gin'
+        )
+
+    # backfill the new table
+    conn.execute(sa.sql.text('''
+    INSERT INTO search_index (
+        id, contract_id, company_id, financial_id, expiration_date,
+        contract_description, tsv_contract_description,
+        company_name, tsv_company_name,
+        detail_key, detail_value, tsv_detail_value,
+        line_item_description, tsv_line_item_description
+    )
+    SELECT DISTINCT
+        concat_ws('-', c.id, contract_property.id, line_item.id, company.id) AS id,
+        c.id AS contract_id,
+        company.id AS company_id,
+        c.financial_id, c.expiration_date,
+        c.description AS contract_description,
+        to_tsvector(c.description) AS tsv_contract_description,
+        company.company_name AS company_name,
+        to_tsvector(company.company_name) AS tsv_company_name,
+        contract_property.key AS detail_key,
+        contract_property.value AS detail_value,
+        to_tsvector(contract_property.value) AS tsv_detail_value,
+        line_item.description AS line_item_description,
+        to_tsvector(line_item.description) AS tsv_line_item_description
+    FROM contract c
+    LEFT OUTER JOIN contract_property ON c.id = contract_property.contract_id
+    LEFT OUTER JOIN line_item ON c.id = line_item.contract_id
+    LEFT OUTER JOIN company_contract_association ON c.id = company_contract_association.contract_id
+    LEFT OUTER JOIN company ON company.id = company_contract_association.company_id
+    '''))
+
+def downgrade():
+    conn = op.get_bind()
+
+    for index in index_set:
+        op.drop_index('ix_search_index_{}'.format(index), table_name='search_index')
+    op.drop_index(op.f('ix_search_index_company_id'), table_name='search_index')
+    op.drop_index(op.f('ix_search_index_contract_id'), table_name='search_index')
+    op.drop_index(op.f('ix_search_index_id'), table_name='search_index')
+    op.drop_table('search_index')
+
+    # recreate our search view
+    conn.execute(sa.sql.text('''
+    CREATE MATERIALIZED VIEW search_view AS (
+        SELECT DISTINCT
+            c.id::VARCHAR || contract_property.id::VARCHAR || line_item.id::VARCHAR || company.id::VARCHAR AS id,
+            c.id AS contract_id,
+            company.id AS company_id,
+            c.expiration_date, c.financial_id,
+            c.description AS contract_description,
+            to_tsvector(c.description) AS tsv_contract_description,
+            company.company_name AS company_name,
+            to_tsvector(company.company_name) AS tsv_company_name,
+            contract_property.key AS detail_key,
+            contract_property.value AS detail_value,
+            to_tsvector(contract_property.value) AS tsv_detail_value,
+            line_item.description AS line_item_description,
+            to_tsvector(line_item.description) AS tsv_line_item_description
+        FROM contract c
+        LEFT OUTER JOIN contract_property ON c.id = contract_property.contract_id
+        LEFT OUTER JOIN line_item ON c.id = line_item.contract_id
+        LEFT OUTER JOIN company_contract_association ON c.id = company_contract_association.contract_id
+        LEFT OUTER JOIN company ON company.id = company_contract_association.company_id
+    )
+    '''))
+
+    op.create_index(op.f('ix_search_view_id'), 'search_view', ['id'], unique=True)
+
+    for index in index_set:
+        op.create_index(op.f(
+            'ix_tsv_{}'.format(index)), 'search_view', [index], postgresql_using='gin'
+        )
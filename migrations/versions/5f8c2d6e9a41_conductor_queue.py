@@ -0,0 +1,116 @@
+"""add conductor queue
+
+Revision ID: 5f8c2d6e9a41
+Revises: 9b1d5f3a7c62
+Create Date: 2026-10-18 16:02:44.571293
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5f8c2d6e9a41'
+down_revision = '9b1d5f3a7c62'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    op.create_table('conductor_queue',
+    sa.Column('contract_id', sa.Integer(), nullable=False),
+    sa.Column('description', sa.Text(), nullable=True),
+    sa.Column('financial_id', sa.String(length=255), nullable=True),
+    sa.Column('expiration_date', sa.Date(), nullable=True),
+    sa.Column('contract_href', sa.Text(), nullable=True),
+    sa.Column('spec_number', sa.Text(), nullable=True),
+    sa.Column('parent_id', sa.Integer(), nullable=True),
+    sa.Column('parent_spec', sa.Text(), nullable=True),
+    sa.Column('parent_expiration', sa.Date(), nullable=True),
+    sa.Column('parent_contract_href', sa.Text(), nullable=True),
+    sa.Column('flow_name', sa.Text(), nullable=True),
+    sa.Column('stage_name', sa.Text(), nullable=True),
+    sa.Column('entered', sa.DateTime(), nullable=True),
+    sa.Column('assigned_to', sa.Integer(), nullable=True),
+    sa.Column('first_name', sa.String(length=255), nullable=True),
+    sa.Column('email', sa.String(length=255), nullable=True),
+    sa.Column('department', sa.String(length=255), nullable=True),
+    sa.Column('companies', postgresql.ARRAY(sa.String()), nullable=True),
+    sa.Column('parent_companies', postgresql.ARRAY(sa.String()), nullable=True),
+    sa.Column('in_progress', sa.Boolean(), nullable=False),
+    sa.Column('available', sa.Boolean(), nullable=False),
+    sa.ForeignKeyConstraint(['contract_id'], ['contract.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('contract_id')
+    )
+    op.create_index(
+        'ix_conductor_queue_in_progress', 'conductor_queue',
+        ['entered', 'contract_id'], unique=False,
+        postgresql_where=sa.text('in_progress IS true')
+    )
+    op.create_index(
+        'ix_conductor_queue_available', 'conductor_queue',
+        ['expiration_date', 'contract_id'], unique=False,
+        postgresql_where=sa.text('available IS true')
+    )
+
+    # backfill from the contracts we already have
+    conn.execute(sa.sql.text('''
+    INSERT INTO conductor_queue (
+        contract_id, description, financial_id, expiration_date, contract_href,
+        spec_number, parent_id, parent_spec, parent_expiration, parent_contract_href,
+        flow_name, stage_name, entered, assigned_to, first_name, email, department,
+        companies, parent_companies, in_progress, available
+    )
+    SELECT
+        c.id, c.description, c.financial_id, c.expiration_date, c.contract_href,
+        spec.value, c.parent_id, parent_spec.value, p.expiration_date, p.contract_href,
+        f.flow_name, s.name, cs.entered, c.assigned_to, u.first_name, u.email, d.name,
+        ARRAY(
+            SELECT co.company_name FROM company_contract_association a
+            JOIN company co ON co.id = a.company_id
+            WHERE a.contract_id = c.id
+        ),
+        ARRAY(
+            SELECT co.company_name FROM company_contract_association a
+            JOIN company co ON co.id = a.company_id
+            WHERE a.contract_id = c.parent_id
+        ),
+        coalesce(
+            c.assigned_to IS NOT NULL AND u.id IS NOT NULL
+            AND c.is_visible = false AND c.is_archived = false
+            AND cs.entered IS NOT NULL AND s.id IS NOT NULL AND f.id IS NOT NULL,
+            false
+        ),
+        coalesce(
+            ct.managed_by_conductor = true AND c.is_visible = true AND spec.value IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM contract child WHERE child.parent_id = c.id),
+            false
+        )
+    FROM contract c
+    LEFT JOIN contract_type ct ON ct.id = c.contract_type_id
+    LEFT JOIN contract p ON p.id = c.parent_id
+    LEFT JOIN LATERAL (
+        SELECT value FROM contract_property
+        WHERE contract_id = c.id AND lower(key) = 'spec number'
+        ORDER BY id LIMIT 1
+    ) spec ON true
+    LEFT JOIN LATERAL (
+        SELECT value FROM contract_property
+        WHERE contract_id = c.parent_id AND lower(key) = 'spec number'
+        ORDER BY id LIMIT 1
+    ) parent_spec ON true
+    LEFT JOIN contract_stage cs ON cs.contract_id = c.id
+        AND cs.stage_id = c.current_stage_id AND cs.flow_id = c.flow_id
+    LEFT JOIN stage s ON s.id = c.current_stage_id
+    LEFT JOIN flow f ON f.id = c.flow_id
+    LEFT JOIN users u ON u.id = c.assigned_to
+    LEFT JOIN department d ON d.id = c.department_id
+    WHERE (ct.managed_by_conductor = true OR c.flow_id IS NOT NULL)
+    '''))
+
+
+def downgrade():
+    op.drop_index('ix_conductor_queue_available', table_name='conductor_queue')
+    op.drop_index('ix_conductor_queue_in_progress', table_name='conductor_queue')
+    op.drop_table('conductor_queue')
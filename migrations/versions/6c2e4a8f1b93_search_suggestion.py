@@ -0,0 +1,49 @@
+"""add search suggestions
+
+Revision ID: 6c2e4a8f1b93
+Revises: 1d3f5b7a9c60
+Create Date: 2026-10-18 13:05:52.441918
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6c2e4a8f1b93'
+down_revision = '1d3f5b7a9c60'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    op.create_table('search_suggestion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('contract_id', sa.Integer(), nullable=True),
+    sa.Column('kind', sa.String(length=255), nullable=True),
+    sa.Column('value', sa.Text(), nullable=True),
+    sa.Column('tsv_value', postgresql.TSVECTOR(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_search_suggestion_contract_id'), 'search_suggestion', ['contract_id'], unique=False)
+    op.create_index('ix_search_suggestion_tsv_value', 'search_suggestion', ['tsv_value'], postgresql_using='gin')
+
+    # backfill from the search index
+    conn.execute(sa.sql.text('''
+    INSERT INTO search_suggestion (contract_id, kind, value, tsv_value)
+    SELECT contract_id, kind, value, to_tsvector('simple', value) FROM (
+        SELECT contract_id, 'contract' AS kind, contract_description AS value FROM search_index
+        UNION ALL
+        SELECT contract_id, 'company', unnest(company_names) FROM search_index
+        UNION ALL
+        SELECT contract_id, 'financial_id', financial_id FROM search_index
+    ) suggestions
+    WHERE coalesce(value, '') != ''
+    '''))
+
+
+def downgrade():
+    op.drop_index('ix_search_suggestion_tsv_value', table_name='search_suggestion')
+    op.drop_index(op.f('ix_search_suggestion_contract_id'), table_name='search_suggestion')
+    op.drop_table('search_suggestion')
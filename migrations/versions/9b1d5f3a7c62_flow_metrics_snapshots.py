@@ -0,0 +1,48 @@
+"""add flow metrics snapshots
+
+Revision ID: 9b1d5f3a7c62
+Revises: 3e9a7c5d1f24
+Create Date: 2026-10-18 16:02:44.518207
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9b1d5f3a7c62'
+down_revision = '3e9a7c5d1f24'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table('flow_stage_snapshot',
+    sa.Column('flow_id', sa.Integer(), nullable=False),
+    sa.Column('snapshot_date', sa.Date(), nullable=False),
+    sa.Column('status', sa.String(length=10), nullable=False),
+    sa.Column('stage_id', sa.Integer(), nullable=False),
+    sa.Column('taken_at', sa.DateTime(), nullable=False),
+    sa.Column('stage_name', sa.String(length=255), nullable=True),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.Column('mean', sa.Float(), nullable=True),
+    sa.Column('median', sa.Float(), nullable=True),
+    sa.Column('p90', sa.Float(), nullable=True),
+    sa.Column('min', sa.Float(), nullable=True),
+    sa.Column('max', sa.Float(), nullable=True),
+    sa.Column('histogram', postgresql.ARRAY(sa.Integer()), nullable=True),
+    sa.ForeignKeyConstraint(['flow_id'], ['flow.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['stage_id'], ['stage.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('flow_id', 'snapshot_date', 'status', 'stage_id')
+    )
+    op.create_table('flow_throughput',
+    sa.Column('flow_id', sa.Integer(), nullable=False),
+    sa.Column('week', sa.Date(), nullable=False),
+    sa.Column('completed', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['flow_id'], ['flow.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('flow_id', 'week')
+    )
+
+
+def downgrade():
+    op.drop_table('flow_throughput')
+    op.drop_table('flow_stage_snapshot')
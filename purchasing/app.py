@@ -19,7 +19,7 @@ from flask_security import current_user, SQLAlchemyUserDatastore
 from purchasing.assets import assets, test_assets
 from purchasing.extensions import (
     cache, db, migrate, debug_toolbar, admin, s3, mail,
-    security
+    security, sql_instrumentation
 )
 
 from purchasing.filters import (
@@ -31,6 +31,11 @@ from purchasing.filters import (
 
 # import models so that flask-migrate can auto-detect
 from purchasing.public.models import AppStatus
+# also registers the listener that keeps department follow counts current
+from purchasing.data.follows import DepartmentContractFollows
+from purchasing.data.flow_metrics import FlowStageSnapshot, FlowThroughput
+# also registers the listener that keeps the conductor queue current
+from purchasing.data.conductor_queue import ConductorQueue
 
 def log_file(app):
     log_dir = '/var/log/chime'
@@ -92,6 +97,7 @@ def register_extensions(app):
     migrate.init_app(app, db)
     admin.init_app(app)
     s3.init_app(app)
+    sql_instrumentation.init_app(app)
 
     from purchasing.users.forms import ExtendedRegisterForm
     from purchasing.users.models import AnonymousUser, User, Role
@@ -1,23 +1,30 @@
 # -*- coding: utf-8 -*-
 
-from flask import request, render_template, current_app
+from flask import request, render_template, current_app, jsonify
 from flask_security import current_user
 
 from flask_security.decorators import roles_accepted
-from purchasing.database import db
 
-from purchasing.data.stages import Stage
-from purchasing.data.flows import Flow
-from purchasing.data.companies import Company
-from purchasing.data.contracts import ContractBase, ContractProperty, ContractType
-from purchasing.data.contract_stages import ContractStage
+from purchasing.utils import paginate_query
+from purchasing.conductor.util import (
+    in_progress_query, all_contracts_query, filter_index_query,
+    serialize_in_progress, serialize_all_contracts,
+    IN_PROGRESS_SORTS, IN_PROGRESS_SEARCHES,
+    ALL_CONTRACTS_SORTS, ALL_CONTRACTS_SEARCHES
+)
 
-from sqlalchemy.orm import aliased
-
-from purchasing.users.models import User, Role, Department
+from purchasing.users.models import User, Role
 
 from purchasing.conductor.manager import blueprint
 
+def get_conductors():
+    '''Get everyone a contract can be assigned to, starting with the current user
+    '''
+    return [current_user] + User.query.filter(
+        User.roles.any(Role.name == 'conductor'),
+        User.email != current_user.email
+    ).all()
+
 @blueprint.route('/')
 @roles_accepted('conductor', 'admin', 'superadmin')
 def index():
@@ -38,118 +45,108 @@ def index():
     ``managed_by_conductor`` field. Additionally, these are
     filtered by having no ``children``, and ``is_visible`` set to True
 
-    .. seealso:: :py:class:`~purchasing.data.contracts.ContractBase`,
+    The tables' rows are loaded a page at a time from
+    :py:func:`in_progress_data` and :py:func:`all_contracts_data`.
+
+    .. seealso:: :py:func:`~purchasing.conductor.util.in_progress_query`,
+        :py:func:`~purchasing.conductor.util.all_contracts_query`,
+        :py:class:`~purchasing.data.contracts.ContractBase`,
         :py:class:`~purchasing.data.contract_stages.ContractStage`,
         :py:class:`~purchasing.data.flows.Flow`
 
     :status 200: Render the main conductor index page
     '''
-    parent = aliased(ContractBase)
-
-    parent_specs = db.session.query(
-        ContractBase.id, ContractProperty.value,
-        parent.expiration_date, parent.contract_href,
-        Company.company_name
-    ).join(
-        ContractProperty,
-        ContractBase.parent_id == ContractProperty.contract_id
-    ).join(
-        parent, ContractBase.parent
-    ).outerjoin(
-        Company, parent.companies
-    ).filter(
-        db.func.lower(ContractProperty.key) == 'spec number',
-        ContractType.managed_by_conductor == True
-    ).subquery()
-
-    in_progress = db.session.query(
-        db.distinct(ContractBase.id).label('id'),
-        ContractProperty.value.label('spec_number'),
-        parent_specs.c.value.label('parent_spec'),
-        parent_specs.c.expiration_date.label('parent_expiration'),
-        parent_specs.c.contract_href.label('parent_contract_href'),
-        ContractBase.description, Flow.flow_name,
-        Stage.name.label('stage_name'), ContractStage.entered,
-        User.first_name, User.email,
-        Department.name.label('department'),
-        db.func.array_remove(
-            db.func.array_agg(parent_specs.c.company_name),
-            None
-        ).label('companies')
-    ).outerjoin(Department).join(
-        ContractStage, db.and_(
-            ContractStage.stage_id == ContractBase.current_stage_id,
-            ContractStage.contract_id == ContractBase.id,
-            ContractStage.flow_id == ContractBase.flow_id
-        )
-    ).join(
-        Stage, Stage.id == ContractBase.current_stage_id
-    ).join(
-        Flow, Flow.id == ContractBase.flow_id
-    ).outerjoin(
-        ContractProperty, ContractProperty.contract_id == ContractBase.id
-    ).outerjoin(
-        parent_specs, ContractBase.id == parent_specs.c.id
-    ).join(User, User.id == ContractBase.assigned_to).filter(
-        ContractStage.flow_id == ContractBase.flow_id,
-        ContractStage.entered != None,
-        ContractBase.assigned_to != None,
-        ContractBase.is_visible == False,
-        ContractBase.is_archived == False
-    ).group_by(
-        ContractBase.id,
-        ContractProperty.value.label('spec_number'),
-        parent_specs.c.value.label('parent_spec'),
-        parent_specs.c.expiration_date.label('parent_expiration'),
-        parent_specs.c.contract_href.label('parent_contract_href'),
-        ContractBase.description, Flow.flow_name,
-        Stage.name.label('stage_name'), ContractStage.entered,
-        User.first_name, User.email,
-        Department.name.label('department')
-    ).all()
-
-    all_contracts = db.session.query(
-        ContractBase.id, ContractBase.description,
-        ContractBase.financial_id, ContractBase.expiration_date,
-        ContractProperty.value.label('spec_number'),
-        ContractBase.contract_href, ContractBase.department,
-        User.first_name, User.email,
-        db.func.array_remove(
-            db.func.array_agg(Company.company_name),
-            None
-        ).label('companies')
-    ).join(ContractType).outerjoin(
-        User, User.id == ContractBase.assigned_to
-    ).outerjoin(Company, ContractBase.companies).outerjoin(
-        Department, Department.id == ContractBase.department_id
-    ).outerjoin(
-        ContractProperty, ContractProperty.contract_id == ContractBase.id
-    ).filter(
-        ContractType.managed_by_conductor == True,
-        db.func.lower(ContractProperty.key) == 'spec number',
-        ContractBase.children == None,
-        ContractBase.is_visible == True
-    ).group_by(
-        ContractBase.id, ContractBase.description,
-        ContractBase.financial_id, ContractBase.expiration_date,
-        ContractProperty.value.label('spec_number'),
-        ContractBase.contract_href, ContractBase.department,
-        User.first_name, User.email
-    ).order_by(ContractBase.expiration_date).all()
-
-    conductors = User.query.filter(
-        User.roles.any(Role.name == 'conductor'),
-        User.email != current_user.email
-    ).all()
-
     current_app.logger.info('CONDUCTOR INDEX - Conductor index page view')
 
     return render_template(
         'conductor/index.html',
-        in_progress=in_progress, _all=all_contracts,
         current_user=current_user,
-        conductors=[current_user] + conductors,
         path='{path}?{query}'.format(
             path=request.path, query=request.query_string
         )
     )
+
+def index_table_page(query, sorts, searches, serialize):
+    '''Build one page of a conductor index table from the request's arguments
+
+    Accepts the following query string arguments:
+
+    * ``page``: one-indexed page number
+    * ``per_page``: number of rows per page, at most ``PER_PAGE``
+    * ``sort`` and ``direction``: column to sort by, ``asc`` or ``desc``
+    * ``q``: text to search for
+    * ``mine``: if set, only show contracts assigned to the current user
+
+    Arguments:
+        query: Either :py:func:`~purchasing.conductor.util.in_progress_query`
+            or :py:func:`~purchasing.conductor.util.all_contracts_query`
+        sorts: Column labels the table can be sorted by, default first
+        searches: Column labels that ``q`` looks through
+        serialize: Function that turns a row into a dictionary
+
+    Returns:
+        A JSON response with one page of ``results``, the ``total``
+        number of rows that match, and the ``page`` and ``per_page``
+    '''
+    max_per_page = current_app.config.get('PER_PAGE', 50)
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        per_page = min(max(int(request.args.get('per_page', max_per_page)), 1), max_per_page)
+    except ValueError:
+        page, per_page = 1, max_per_page
+
+    rows, pagination = paginate_query(filter_index_query(
+        query, sorts, searches,
+        sort=request.args.get('sort'),
+        direction=request.args.get('direction', 'asc'),
+        search=request.args.get('q'),
+        email=current_user.email if request.args.get('mine') else None
+    ), page, per_page)
+
+    conductors = get_conductors()
+    return jsonify({
+        'results': [serialize(row, conductors) for row in rows],
+        'total': pagination.total_count,
+        'page': pagination.page,
+        'per_page': pagination.per_page,
+        'conductors': [i.print_pretty_name() for i in conductors]
+    })
+
+@blueprint.route('/index/in-progress')
+@roles_accepted('conductor', 'admin', 'superadmin')
+def in_progress_data():
+    '''One page of the in progress contracts table
+
+    See :py:func:`index_table_page` for the arguments it takes and what
+    it returns. Rows can be sorted by ``entered`` (the default),
+    ``spec_number``, ``description``, ``parent_expiration``,
+    ``stage_name``, or ``email``.
+
+    .. seealso:: :py:func:`~purchasing.conductor.util.in_progress_query`,
+        :py:func:`~purchasing.conductor.util.serialize_in_progress`
+
+    :status 200: JSON page of in progress contracts
+    '''
+    return index_table_page(
+        in_progress_query(), IN_PROGRESS_SORTS, IN_PROGRESS_SEARCHES,
+        serialize_in_progress
+    )
+
+@blueprint.route('/index/all')
+@roles_accepted('conductor', 'admin', 'superadmin')
+def all_contracts_data():
+    '''One page of the all contracts table
+
+    See :py:func:`index_table_page` for the arguments it takes and what
+    it returns. Rows can be sorted by ``expiration_date`` (the default),
+    ``id``, ``description``, ``spec_number``, ``financial_id``, or ``email``.
+
+    .. seealso:: :py:func:`~purchasing.conductor.util.all_contracts_query`,
+        :py:func:`~purchasing.conductor.util.serialize_all_contracts`
+
+    :status 200: JSON page of contracts that can be started
+    '''
+    return index_table_page(
+        all_contracts_query(), ALL_CONTRACTS_SORTS, ALL_CONTRACTS_SEARCHES,
+        serialize_all_contracts
+    )
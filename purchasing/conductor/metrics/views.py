@@ -2,13 +2,18 @@
 
 import datetime
 
-from flask import render_template, stream_with_context, Response, abort, jsonify
+from flask import render_template, abort, jsonify, json, request, current_app, Response
+from werkzeug.http import is_resource_modified
 
 from purchasing.database import db
+from purchasing.extensions import cache
 from flask_security.decorators import roles_accepted
 
 from purchasing.data.flows import Flow
-from purchasing.conductor.util import convert_to_str
+from purchasing.data.flow_metrics import (
+    FlowStageSnapshot, FlowThroughput, current_flow_metrics, flow_metrics_version
+)
+from purchasing.conductor.util import convert_to_str, tsv_response
 
 from purchasing.conductor.metrics import blueprint
 
@@ -34,22 +39,13 @@ def download_tsv_flow(flow_id):
     flow = Flow.query.get(flow_id)
     if flow:
 
-        tsv, headers = flow.reshape_metrics_granular()
-
-        def stream():
-            yield '\t'.join(headers) + '\n'
-            for contract_id, values in tsv.iteritems():
-                yield '\t'.join([str(i) for i in values]) + '\n'
-
-        resp = Response(
-            stream_with_context(stream()),
-            headers={
-                "Content-Disposition": "attachment; filename=conductor-{}-metrics.tsv".format(flow.flow_name)
-            },
-            mimetype='text/tsv'
+        rows = (
+            [unicode(i) for i in values] for _, values in flow.iter_metrics_granular()
+        )
+        return tsv_response(
+            'conductor-{}-metrics.tsv'.format(flow.flow_name),
+            flow.metrics_granular_headers(), rows
         )
-
-        return resp
     abort(404)
 
 @blueprint.route('/download/all')
@@ -75,10 +71,13 @@ def download_all():
     * the contract parent's spec number (parent_spec)
     * a string with the status of a contract (status)
 
+    Rows are read from a server-side cursor and written out as they
+    arrive, rather than fetching the whole result set up front.
+
     :return:
         A streamed tsv with the fields described above
     '''
-    results = db.session.execute('''
+    results = db.session.execute(db.text('''
     SELECT * FROM (
     SELECT
         c.id as item_number, NULL as parent_item_number,
@@ -146,22 +145,13 @@ def download_all():
     AND c.parent_id is not null
     ) x
     ORDER BY 1
-    ''').fetchall()
-
-    def stream():
-        yield '\t'.join([str(i) for i in results[0].keys()]) + '\n'
-        for row in results:
-            yield '\t'.join([convert_to_str(i) for i in row]) + '\n'
-
-    resp = Response(
-        stream_with_context(stream()),
-        headers={
-            "Content-Disposition": "attachment; filename=conductor-all-{}.tsv".format(datetime.date.today())
-        },
-        mimetype='text/tsv'
-    )
+    ''').execution_options(stream_results=True))
 
-    return resp
+    return tsv_response(
+        'conductor-all-{}.tsv'.format(datetime.date.today()),
+        [str(i) for i in results.keys()],
+        ([convert_to_str(i) for i in row] for row in results)
+    )
 
 @blueprint.route('/overview/<int:flow_id>')
 @roles_accepted('conductor', 'admin', 'superadmin')
@@ -192,33 +182,148 @@ def flow_overview(flow_id):
         return render_template('conductor/metrics/overview.html', flow=flow)
     abort(404)
 
+def build_flow_data(flow, raw=False):
+    '''Build the data for the metrics charts of a flow
+
+    Arguments:
+        flow: :py:class:`~purchasing.data.flows.Flow` to build data for
+
+    Keyword Arguments:
+        raw: Whether to build every contract's stages rather than the
+            per-stage statistics
+
+    Returns:
+        A dictionary of the data described in :py:func:`flow_data`
+    '''
+    data = {
+        'stageDataObj': [{i.id: {'name': i.name, 'id': i.id}} for i in flow.get_ordered_stages()],
+        'stageOrder': flow.stage_order
+    }
+
+    if raw:
+        results = flow.build_metrics_data()
+        data.update({
+            'complete': results['complete'].values(),
+            'current': results['current'].values()
+        })
+    else:
+        results = current_flow_metrics(flow)
+        data.update({
+            'complete': results['complete'],
+            'current': results['current'],
+            'throughput': [
+                {'week': week.isoformat(), 'completed': completed}
+                for week, completed in results['throughput']
+            ],
+            'snapshotTakenAt': results['snapshotTakenAt'].isoformat()
+            if results['snapshotTakenAt'] else None
+        })
+
+    return data
+
 @blueprint.route('/overview/<int:flow_id>/data')
 @roles_accepted('conductor', 'admin', 'superadmin')
 def flow_data(flow_id):
     '''Data to support the metrics charts
 
-    The returned object contains the ``complete`` and ``current``
-    dictionaries as described in :py:meth:`~purchasing.data.flows.Flow.build_metrics_data`
-    along with a ``stageOrder`` key of the flow's stage order for proper
-    sorting on the client side and ``stageDataObj``, which contains metadata
-    about each stage in the proper order
+    By default, the returned object contains the ``complete`` and
+    ``current`` per-stage statistics as described in
+    :py:meth:`~purchasing.data.flows.Flow.build_metrics_summary`, read
+    from the flow's latest nightly snapshot plus what has happened since
+    (see :py:func:`~purchasing.data.flow_metrics.current_flow_metrics`),
+    along with ``throughput``, the number of contracts that finished the
+    flow each week. Passing a ``raw`` query parameter instead returns the
+    ``complete`` and ``current`` dictionaries of every contract's stages
+    as described in :py:meth:`~purchasing.data.flows.Flow.build_metrics_data`,
+    which can be very large for busy flows. Both come along with a
+    ``stageOrder`` key of the flow's stage order for proper sorting on
+    the client side and ``stageDataObj``, which contains metadata about
+    each stage in the proper order
+
+    Responses carry an ETag and Last-Modified header from
+    :py:func:`~purchasing.data.flow_metrics.flow_metrics_version`, and
+    the rendered JSON is cached under that version, so polling an
+    unchanged flow only costs the version lookup. Only ``If-None-Match``
+    is honored, since the data also changes every day without any
+    change being made to the flow.
 
     .. seealso::
+        :py:func:`purchasing.data.flow_metrics.current_flow_metrics`
         :py:meth:`purchasing.data.flows.Flow.build_metrics_data`
 
     :status 200: Get data to build dashboards around a given
         :py:class:`~purchasing.data.flows.Flow`
+    :status 304: The data hasn't changed since the version the client has
     :status 404: Could not find given :py:class:`~purchasing.data.flows.Flow`
     '''
     flow = Flow.query.get(flow_id)
     if flow:
-        results = flow.build_metrics_data()
-        return jsonify(
-            {
-                'complete': results['complete'].values(),
-                'current': results['current'].values(),
-                'stageDataObj': [{i.id: {'name': i.name, 'id': i.id}} for i in flow.get_ordered_stages()],
-                'stageOrder': flow.stage_order
-            }
-        )
+        raw = bool(request.args.get('raw'))
+        etag, last_modified = flow_metrics_version(flow, raw=raw)
+
+        if not is_resource_modified(request.environ, etag=etag):
+            response = Response(status=304)
+        else:
+            key = 'conductor-metrics-{}'.format(etag)
+            data = cache.get(key)
+            if data is None:
+                data = json.dumps(build_flow_data(flow, raw=raw))
+                cache.set(
+                    key, data, timeout=current_app.config.get('METRICS_CACHE_TIMEOUT', 60 * 60 * 24)
+                )
+            response = Response(data, mimetype='application/json')
+
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # browsers can keep a copy, but have to check that it is current
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    abort(404)
+
+@blueprint.route('/overview/<int:flow_id>/history')
+@roles_accepted('conductor', 'admin', 'superadmin')
+def flow_history(flow_id):
+    '''History of a flow's metrics from its nightly snapshots
+
+    The returned object has a ``snapshots`` list with one entry per
+    snapshot, oldest first, each with its ``date`` and the ``complete``
+    and ``current`` stage statistics as of that day, along with the
+    flow's weekly ``throughput``. Nothing is recomputed from the contract
+    stages.
+
+    .. seealso::
+        :py:class:`purchasing.data.flow_metrics.FlowStageSnapshot`
+
+    :status 200: Get the metrics history of a given
+        :py:class:`~purchasing.data.flows.Flow`
+    :status 404: Could not find given :py:class:`~purchasing.data.flows.Flow`
+    '''
+    flow = Flow.query.get(flow_id)
+    if flow:
+        order = dict((stage_id, ix) for ix, stage_id in enumerate(flow.stage_order or []))
+        snapshots = {}
+        for row in FlowStageSnapshot.query.filter(FlowStageSnapshot.flow_id == flow.id):
+            snapshot = snapshots.setdefault(row.snapshot_date, {'current': [], 'complete': []})
+            snapshot[row.status].append(row.as_dict())
+
+        history = []
+        for snapshot_date in sorted(snapshots.keys()):
+            snapshot = snapshots[snapshot_date]
+            history.append({
+                'date': snapshot_date.isoformat(),
+                'complete': sorted(snapshot['complete'], key=lambda i: order.get(i['id'], len(order))),
+                'current': sorted(snapshot['current'], key=lambda i: order.get(i['id'], len(order))),
+            })
+
+        throughput = FlowThroughput.query.filter(
+            FlowThroughput.flow_id == flow.id
+        ).order_by(FlowThroughput.week)
+
+        return jsonify({
+            'snapshots': history,
+            'throughput': [
+                {'week': i.week.isoformat(), 'completed': i.completed} for i in throughput
+            ]
+        })
     abort(404)
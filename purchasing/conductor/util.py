@@ -1,23 +1,29 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import itertools
 import os
+import zlib
 
 from sqlalchemy.exc import IntegrityError
 
 from werkzeug import secure_filename
 
-from flask import current_app
+from flask import current_app, request, Response, stream_with_context, url_for
 from flask_security import current_user
 
 from purchasing.database import db
-from purchasing.filters import better_title
+from purchasing.filters import (
+    better_title, days_from_today, format_days_from_today,
+    datetimeformat, display_dedupe_array
+)
 from purchasing.utils import (
     connect_to_s3, upload_file, turn_off_sqlalchemy_events,
     turn_on_sqlalchemy_events, refresh_search_view
 )
 
 from purchasing.data.contracts import ContractBase, ContractType
+from purchasing.data.conductor_queue import ConductorQueue
 from purchasing.users.models import Department
 
 class ContractMetadataObj(object):
@@ -122,6 +128,180 @@ def parse_companies(companies):
             })
     return cleaned
 
+def in_progress_query():
+    '''Build the query for the contracts conductors are working on
+
+    In progress contracts have a ``parent_id``, an existing ``flow``, a
+    non-null ``entered`` current contract stage, and are neither
+    ``is_archived`` nor ``is_visible``. Rows are read from the
+    :py:class:`~purchasing.data.conductor_queue.ConductorQueue`.
+
+    Returns:
+        Sqlalchemy query with one row per in progress contract
+    '''
+    return db.session.query(
+        ConductorQueue.contract_id.label('id'),
+        ConductorQueue.spec_number, ConductorQueue.parent_spec,
+        ConductorQueue.parent_expiration, ConductorQueue.parent_contract_href,
+        ConductorQueue.description, ConductorQueue.flow_name,
+        ConductorQueue.stage_name, ConductorQueue.entered,
+        ConductorQueue.first_name, ConductorQueue.email,
+        ConductorQueue.department,
+        ConductorQueue.parent_companies.label('companies')
+    ).filter(ConductorQueue.in_progress == True)
+
+def all_contracts_query():
+    '''Build the query for the contracts that can be started in conductor
+
+    These have a :py:class:`~purchasing.data.contracts.ContractType` that is
+    ``managed_by_conductor``, a spec number, no ``children``, and
+    ``is_visible`` set to True. Rows are read from the
+    :py:class:`~purchasing.data.conductor_queue.ConductorQueue`.
+
+    Returns:
+        Sqlalchemy query with one row per contract, ordered by expiration date
+    '''
+    return db.session.query(
+        ConductorQueue.contract_id.label('id'), ConductorQueue.description,
+        ConductorQueue.financial_id, ConductorQueue.expiration_date,
+        ConductorQueue.spec_number, ConductorQueue.contract_href,
+        ConductorQueue.department, ConductorQueue.first_name,
+        ConductorQueue.email, ConductorQueue.companies
+    ).filter(
+        ConductorQueue.available == True
+    ).order_by(ConductorQueue.expiration_date)
+
+# columns the conductor index tables can be sorted by, default first,
+# and the text columns their search boxes look through
+IN_PROGRESS_SORTS = [
+    'entered', 'spec_number', 'description', 'parent_expiration', 'stage_name', 'email'
+]
+IN_PROGRESS_SEARCHES = [
+    'spec_number', 'parent_spec', 'description', 'stage_name',
+    'first_name', 'email', 'department'
+]
+ALL_CONTRACTS_SORTS = [
+    'expiration_date', 'id', 'description', 'spec_number', 'financial_id', 'email'
+]
+ALL_CONTRACTS_SEARCHES = [
+    'spec_number', 'description', 'financial_id', 'first_name', 'email'
+]
+
+def filter_index_query(query, sorts, searches, sort=None, direction='asc', search=None, email=None):
+    '''Sort, search, and filter one of the conductor index tables
+
+    Arguments:
+        query: Either :py:func:`in_progress_query` or
+            :py:func:`all_contracts_query`
+        sorts: List of the column labels the table can be sorted by,
+            with the default first
+        searches: List of the text column labels to search through
+
+    Keyword Arguments:
+        sort: Column label to sort by. Anything not in ``sorts`` falls
+            back to the default
+        direction: 'asc' or 'desc'
+        search: Text to look for in the searchable columns, the
+            contract's id, and the contract's company names
+        email: Only show contracts assigned to this email address
+
+    Returns:
+        Sqlalchemy query over the table's rows, ready to be passed to
+        :py:func:`~purchasing.utils.paginate_query`
+    '''
+    rows = query.order_by(None).subquery()
+    query = db.session.query(rows)
+
+    if email:
+        query = query.filter(rows.c.email == email)
+
+    if search:
+        term = u'%{}%'.format(
+            search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        )
+        query = query.filter(db.or_(
+            db.cast(rows.c.id, db.String).ilike(term),
+            db.func.array_to_string(rows.c.companies, ' ').ilike(term),
+            *[db.cast(rows.c[name], db.String).ilike(term) for name in searches]
+        ))
+
+    column = rows.c[sort if sort in sorts else sorts[0]]
+    order = column.desc() if direction == 'desc' else column.asc()
+    return query.order_by(order.nullslast(), rows.c.id)
+
+def _serialize_date(date):
+    if date is None:
+        return None
+    return {
+        'value': date.isoformat(),
+        'days': days_from_today(date),
+        'fromToday': format_days_from_today(date),
+        'formatted': datetimeformat(date, '%m/%d/%Y'),
+    }
+
+def _reassign_urls(contract_id, conductors):
+    return [
+        url_for('conductor.reassign', contract_id=contract_id, user_id=conductor.id)
+        for conductor in conductors
+    ]
+
+def serialize_in_progress(row, conductors):
+    '''Turn a row of :py:func:`in_progress_query` into a dictionary for the index table
+
+    Arguments:
+        row: Result row from :py:func:`in_progress_query`
+        conductors: List of :py:class:`~purchasing.users.models.User`
+            objects the contract can be reassigned to
+
+    Returns:
+        Dictionary of the row's values, with dates formatted for display
+        and the links for the row's actions
+    '''
+    return {
+        'id': row.id, 'spec_number': row.spec_number, 'parent_spec': row.parent_spec,
+        'description': row.description, 'title': better_title(row.description or ''),
+        'flow_name': row.flow_name, 'stage_name': row.stage_name,
+        'first_name': row.first_name, 'email': row.email, 'department': row.department,
+        'companies': better_title(display_dedupe_array(row.companies)),
+        'parent_expiration': _serialize_date(row.parent_expiration),
+        'entered': _serialize_date(row.entered),
+        'urls': {
+            'detail': url_for('conductor.detail', contract_id=row.id),
+            'contract': row.parent_contract_href,
+            'scout': url_for('scout.contract', contract_id=row.id),
+            'kill': url_for('conductor.kill_contract', contract_id=row.id),
+            'reassign': _reassign_urls(row.id, conductors),
+        }
+    }
+
+def serialize_all_contracts(row, conductors):
+    '''Turn a row of :py:func:`all_contracts_query` into a dictionary for the index table
+
+    Arguments:
+        row: Result row from :py:func:`all_contracts_query`
+        conductors: List of :py:class:`~purchasing.users.models.User`
+            objects the contract can be assigned to
+
+    Returns:
+        Dictionary of the row's values, with dates formatted for display
+        and the links for the row's actions
+    '''
+    return {
+        'id': row.id, 'spec_number': row.spec_number, 'financial_id': row.financial_id,
+        'description': row.description, 'title': better_title(row.description or ''),
+        'first_name': row.first_name, 'email': row.email,
+        'companies': better_title(display_dedupe_array(row.companies)),
+        'expiration_date': _serialize_date(row.expiration_date),
+        'urls': {
+            'start': url_for('conductor.start_work', contract_id=row.id),
+            'contract': row.contract_href,
+            'scout': url_for('scout.contract', contract_id=row.id),
+            'remove': url_for('conductor.remove', contract_id=row.id),
+            'kill': url_for('conductor.kill_contract', contract_id=row.id),
+            'reassign': _reassign_urls(row.id, conductors),
+        }
+    }
+
 def assign_a_contract(contract, flow, user, start_time=None, clone=True):
     '''Assign a contract a flow and a user
 
@@ -204,6 +384,57 @@ def assign_a_contract(contract, flow, user, start_time=None, clone=True):
 def convert_to_str(field):
     return str(field) if field is not None else ''
 
+def gzip_stream(chunks):
+    '''Gzip a stream of strings as it is being sent
+
+    Arguments:
+        chunks: Iterable of byte strings
+
+    Returns:
+        A generator of gzipped byte strings
+    '''
+    # 16 + MAX_WBITS writes a gzip header and trailer rather than a zlib one
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def tsv_response(filename, headers, rows):
+    '''Stream a tab-separated file download
+
+    Lines are written out as the rows are iterated over, so rows can
+    come straight from a server-side cursor. If the client accepts it and
+    ``GZIP_DOWNLOADS`` is turned on, the file is gzipped on the way out.
+
+    Arguments:
+        filename: Name of the downloaded file
+        headers: List of column names
+        rows: Iterable of lists of strings, one for each line of the file
+
+    Returns:
+        A streamed ``text/tsv`` response
+    '''
+    def lines():
+        for line in itertools.chain([headers], rows):
+            line = '\t'.join(line) + '\n'
+            yield line.encode('utf-8') if isinstance(line, unicode) else line
+
+    response_headers = {
+        'Content-Disposition': 'attachment; filename={}'.format(filename),
+        'Vary': 'Accept-Encoding'
+    }
+
+    body = lines()
+    if current_app.config.get('GZIP_DOWNLOADS') and 'gzip' in request.accept_encodings:
+        body = gzip_stream(body)
+        response_headers['Content-Encoding'] = 'gzip'
+
+    return Response(
+        stream_with_context(body), headers=response_headers, mimetype='text/tsv'
+    )
+
 def upload_costars_contract(_file):
     '''Upload a COSTARS pdf document to S3
 
@@ -33,9 +33,14 @@ class Company(RefreshSearchViewMixin, Model):
     def __repr__(self):
         return self.company_name
 
+    search_index_collections = ('contracts',)
+
     def __unicode__(self):
         return self.company_name
 
+    def search_index_keys(self):
+        return [], [self.id]
+
     @classmethod
     def all_companies_query_factory(cls):
         '''Query factory of all company ids and names ordered by name
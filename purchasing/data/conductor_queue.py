@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history, PASSIVE_NO_INITIALIZE
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from purchasing.database import db, Column
+from purchasing.data.contracts import ContractBase, ContractProperty, ContractType
+from purchasing.data.contract_stages import ContractStage
+from purchasing.data.companies import Company
+from purchasing.data.stages import Stage
+from purchasing.data.flows import Flow
+from purchasing.users.models import User, Department
+
+class ConductorQueue(db.Model):
+    '''Everything the conductor index tables show about a contract, in one row
+
+    There is one row for each contract whose
+    :py:class:`~purchasing.data.contracts.ContractType` is managed by
+    conductor, or that has been started in a flow. Rows are rebuilt
+    whenever the contract, its parent or children, its stages,
+    properties, or companies, or the people, departments, stages or
+    flows it points to change, so that the index tables can be read
+    from this table alone.
+
+    Attributes:
+        contract_id: Foreign key to :py:class:`~purchasing.data.contracts.ContractBase`
+        description: The contract's description
+        financial_id: The contract's controller number
+        expiration_date: When the contract expires
+        contract_href: Link to the contract's document
+        spec_number: The contract's spec number
+        parent_id: Id of the contract this one was cloned from
+        parent_spec: The parent contract's spec number
+        parent_expiration: When the parent contract expires
+        parent_contract_href: Link to the parent contract's document
+        flow_name: Name of the contract's :py:class:`~purchasing.data.flows.Flow`
+        stage_name: Name of the contract's current :py:class:`~purchasing.data.stages.Stage`
+        entered: When the contract entered its current stage
+        assigned_to: Id of the :py:class:`~purchasing.users.models.User`
+            working on the contract
+        first_name: First name of the assigned user
+        email: Email address of the assigned user
+        department: Name of the contract's department
+        companies: Names of the contract's companies
+        parent_companies: Names of the parent contract's companies
+        in_progress: Whether the contract shows up in the in progress table
+            (see :py:func:`~purchasing.conductor.util.in_progress_query`)
+        available: Whether the contract shows up in the all contracts table
+            (see :py:func:`~purchasing.conductor.util.all_contracts_query`)
+    '''
+    __tablename__ = 'conductor_queue'
+
+    contract_id = Column(
+        db.Integer, db.ForeignKey('contract.id', ondelete='CASCADE'), primary_key=True
+    )
+    description = Column(db.Text)
+    financial_id = Column(db.String(255))
+    expiration_date = Column(db.Date)
+    contract_href = Column(db.Text)
+    spec_number = Column(db.Text)
+    parent_id = Column(db.Integer)
+    parent_spec = Column(db.Text)
+    parent_expiration = Column(db.Date)
+    parent_contract_href = Column(db.Text)
+    flow_name = Column(db.Text)
+    stage_name = Column(db.Text)
+    entered = Column(db.DateTime)
+    assigned_to = Column(db.Integer)
+    first_name = Column(db.String(255))
+    email = Column(db.String(255))
+    department = Column(db.String(255))
+    companies = Column(ARRAY(db.String))
+    parent_companies = Column(ARRAY(db.String))
+    in_progress = Column(db.Boolean, nullable=False, default=False)
+    available = Column(db.Boolean, nullable=False, default=False)
+
+    __table_args__ = (
+        db.Index(
+            'ix_conductor_queue_in_progress', entered, contract_id,
+            postgresql_where=in_progress.is_(True)
+        ),
+        db.Index(
+            'ix_conductor_queue_available', expiration_date, contract_id,
+            postgresql_where=available.is_(True)
+        ),
+    )
+
+CONDUCTOR_QUEUE_ROWS = '''
+    INSERT INTO conductor_queue (
+        contract_id, description, financial_id, expiration_date, contract_href,
+        spec_number, parent_id, parent_spec, parent_expiration, parent_contract_href,
+        flow_name, stage_name, entered, assigned_to, first_name, email, department,
+        companies, parent_companies, in_progress, available
+    )
+    SELECT
+        c.id, c.description, c.financial_id, c.expiration_date, c.contract_href,
+        spec.value, c.parent_id, parent_spec.value, p.expiration_date, p.contract_href,
+        f.flow_name, s.name, cs.entered, c.assigned_to, u.first_name, u.email, d.name,
+        ARRAY(
+            SELECT co.company_name FROM company_contract_association a
+            JOIN company co ON co.id = a.company_id
+            WHERE a.contract_id = c.id
+        ),
+        ARRAY(
+            SELECT co.company_name FROM company_contract_association a
+            JOIN company co ON co.id = a.company_id
+            WHERE a.contract_id = c.parent_id
+        ),
+        coalesce(
+            c.assigned_to IS NOT NULL AND u.id IS NOT NULL
+            AND c.is_visible = false AND c.is_archived = false
+            AND cs.entered IS NOT NULL AND s.id IS NOT NULL AND f.id IS NOT NULL,
+            false
+        ),
+        coalesce(
+            ct.managed_by_conductor = true AND c.is_visible = true AND spec.value IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM contract child WHERE child.parent_id = c.id),
+            false
+        )
+    FROM contract c
+    LEFT JOIN contract_type ct ON ct.id = c.contract_type_id
+    LEFT JOIN contract p ON p.id = c.parent_id
+    LEFT JOIN LATERAL (
+        SELECT value FROM contract_property
+        WHERE contract_id = c.id AND lower(key) = 'spec number'
+        ORDER BY id LIMIT 1
+    ) spec ON true
+    LEFT JOIN LATERAL (
+        SELECT value FROM contract_property
+        WHERE contract_id = c.parent_id AND lower(key) = 'spec number'
+        ORDER BY id LIMIT 1
+    ) parent_spec ON true
+    LEFT JOIN contract_stage cs ON cs.contract_id = c.id
+        AND cs.stage_id = c.current_stage_id AND cs.flow_id = c.flow_id
+    LEFT JOIN stage s ON s.id = c.current_stage_id
+    LEFT JOIN flow f ON f.id = c.flow_id
+    LEFT JOIN users u ON u.id = c.assigned_to
+    LEFT JOIN department d ON d.id = c.department_id
+    WHERE (ct.managed_by_conductor = true OR c.flow_id IS NOT NULL)
+    {filters}
+    ON CONFLICT (contract_id) DO UPDATE SET
+        description = excluded.description, financial_id = excluded.financial_id,
+        expiration_date = excluded.expiration_date, contract_href = excluded.contract_href,
+        spec_number = excluded.spec_number, parent_id = excluded.parent_id,
+        parent_spec = excluded.parent_spec, parent_expiration = excluded.parent_expiration,
+        parent_contract_href = excluded.parent_contract_href, flow_name = excluded.flow_name,
+        stage_name = excluded.stage_name, entered = excluded.entered,
+        assigned_to = excluded.assigned_to, first_name = excluded.first_name,
+        email = excluded.email, department = excluded.department,
+        companies = excluded.companies, parent_companies = excluded.parent_companies,
+        in_progress = excluded.in_progress, available = excluded.available
+'''
+
+# the contracts whose rows depend on each kind of changed object. Only
+# the kinds that actually changed are queried, so that each one can use
+# its own index
+CONDUCTOR_QUEUE_CHANGES = {
+    'contract_ids': '''
+        SELECT id FROM contract WHERE id = ANY(:contract_ids)
+        UNION SELECT id FROM contract WHERE parent_id = ANY(:contract_ids)
+        UNION SELECT parent_id FROM contract WHERE id = ANY(:contract_ids)
+    ''',
+    'company_ids': '''
+        SELECT contract_id FROM company_contract_association WHERE company_id = ANY(:company_ids)
+        UNION SELECT c.id FROM contract c
+        JOIN company_contract_association a ON a.contract_id = c.parent_id
+        WHERE a.company_id = ANY(:company_ids)
+    ''',
+    'user_ids': 'SELECT id FROM contract WHERE assigned_to = ANY(:user_ids)',
+    'department_ids': 'SELECT id FROM contract WHERE department_id = ANY(:department_ids)',
+    'stage_ids': 'SELECT id FROM contract WHERE current_stage_id = ANY(:stage_ids)',
+    'flow_ids': 'SELECT id FROM contract WHERE flow_id = ANY(:flow_ids)',
+    'contract_type_ids': 'SELECT id FROM contract WHERE contract_type_id = ANY(:contract_type_ids)',
+}
+
+def refresh_conductor_queue(session, contract_ids=(), **changed):
+    '''Rebuild the conductor queue rows that depend on a set of changes
+
+    Rows are upserted, so two transactions refreshing the same contract
+    at once don't collide, and rows for contracts that no longer belong
+    in the queue are removed.
+
+    Arguments:
+        session: Sqlalchemy session or connection to execute with
+
+    Keyword Arguments:
+        contract_ids: Ids of contracts that changed. Their parents and
+            children are rebuilt along with them, since each shows up in
+            the other's row.
+        company_ids: Ids of companies that changed
+        user_ids: Ids of users that changed
+        department_ids: Ids of departments that changed
+        stage_ids: Ids of stages that changed
+        flow_ids: Ids of flows that changed
+        contract_type_ids: Ids of contract types that changed
+    '''
+    changed['contract_ids'] = contract_ids
+    params = dict(
+        (name, sorted(set(i for i in ids if i is not None)))
+        for name, ids in changed.items()
+    )
+    params = dict((name, ids) for name, ids in params.items() if ids)
+    if len(params) == 0:
+        return
+
+    contract_ids = sorted(set(params.get('contract_ids', [])) | set(
+        row[0] for row in session.execute(db.text(' UNION '.join(
+            CONDUCTOR_QUEUE_CHANGES[name] for name in sorted(params)
+        )), params) if row[0] is not None
+    ))
+    if len(contract_ids) == 0:
+        return
+
+    session.execute(db.text(
+        CONDUCTOR_QUEUE_ROWS.format(filters='AND c.id = ANY(:contract_ids)')
+    ), {'contract_ids': contract_ids})
+    session.execute(db.text('''
+        DELETE FROM conductor_queue q
+        WHERE q.contract_id = ANY(:contract_ids)
+        AND NOT EXISTS (
+            SELECT 1 FROM contract c
+            LEFT JOIN contract_type ct ON ct.id = c.contract_type_id
+            WHERE c.id = q.contract_id
+            AND (ct.managed_by_conductor = true OR c.flow_id IS NOT NULL)
+        )
+    '''), {'contract_ids': contract_ids})
+
+def rebuild_conductor_queue(session):
+    '''Rebuild the conductor queue for every contract
+
+    Arguments:
+        session: Sqlalchemy session or connection to execute with
+    '''
+    session.execute(db.text('DELETE FROM conductor_queue'))
+    session.execute(db.text(CONDUCTOR_QUEUE_ROWS.format(filters='')))
+
+# the attributes of each model that show up in the queue, and the keyword
+# argument of refresh_conductor_queue that finds the rows they show up in.
+# Changes to anything else (logins, follows, and so on) are ignored
+QUEUE_DEPENDENCIES = [
+    (ContractBase, 'contract_ids', [
+        'description', 'financial_id', 'expiration_date', 'contract_href',
+        'parent_id', 'parent', 'flow_id', 'flow', 'current_flow',
+        'current_stage_id', 'current_stage',
+        'assigned_to', 'assigned', 'department_id', 'department',
+        'contract_type_id', 'contract_type', 'is_visible', 'is_archived', 'companies'
+    ]),
+    (ContractStage, 'contract_ids', [
+        'contract_id', 'contract', 'flow_id', 'flow', 'stage_id', 'stage', 'entered'
+    ]),
+    (ContractProperty, 'contract_ids', ['contract_id', 'contract', 'key', 'value']),
+    (Company, 'company_ids', ['company_name', 'contracts']),
+    (User, 'user_ids', ['first_name', 'email']),
+    (Department, 'department_ids', ['name']),
+    (Stage, 'stage_ids', ['name']),
+    (Flow, 'flow_ids', ['flow_name']),
+    (ContractType, 'contract_type_ids', ['managed_by_conductor']),
+]
+
+def _has_changes(obj, attributes):
+    # collections that were never loaded can't have changed, so don't go
+    # to the database to find out
+    return any(
+        get_history(obj, attribute, passive=PASSIVE_NO_INITIALIZE).has_changes()
+        for attribute in attributes
+    )
+
+def conductor_queue_changed(session):
+    '''Find what a flush changed that shows up in the conductor queue
+
+    Contracts, contract stages and contract properties count when they
+    are added or deleted. Everything counts when it is deleted, or when
+    one of the attributes listed in ``QUEUE_DEPENDENCIES`` changes.
+
+    Arguments:
+        session: Sqlalchemy session that is being flushed
+
+    Returns:
+        Dictionary of keyword arguments for :py:func:`refresh_conductor_queue`
+    '''
+    changed = dict((name, set()) for _, name, _ in QUEUE_DEPENDENCIES)
+
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        for model, name, attributes in QUEUE_DEPENDENCIES:
+            if not isinstance(obj, model):
+                continue
+
+            contract_side = name == 'contract_ids'
+            if obj in session.deleted or (contract_side and obj in session.new) or \
+                    _has_changes(obj, attributes):
+                if isinstance(obj, ContractBase):
+                    # a contract's parent can only be started while it has no children
+                    changed[name].update([obj.id, obj.parent_id])
+                elif contract_side:
+                    changed[name].add(obj.contract_id)
+                else:
+                    changed[name].add(obj.id)
+
+    return changed
+
+QUEUE_MODELS = tuple(model for model, _, _ in QUEUE_DEPENDENCIES)
+
+@sqlalchemy.event.listens_for(Session, 'after_flush')
+def update_conductor_queue(session, flush_context):
+    # most flushes (beacon, jobs, and so on) touch nothing the queue
+    # depends on, so skip them before looking at any attribute history
+    if not any(
+        isinstance(obj, QUEUE_MODELS)
+        for obj in itertools.chain(session.new, session.dirty, session.deleted)
+    ):
+        return
+    refresh_conductor_queue(session, **conductor_queue_changed(session))
@@ -3,7 +3,7 @@
 import datetime
 
 from sqlalchemy.schema import Sequence
-from sqlalchemy.orm import backref
+from sqlalchemy.orm import backref, joinedload
 from sqlalchemy.dialects.postgresql import JSON
 
 from purchasing.database import Model, db, Column, ReferenceCol
@@ -114,9 +114,57 @@ class ContractStage(Model):
             cls.flow_id == flow_id
         ).order_by(cls.id).all()
 
-    def _fix_start_time(self):
+    @classmethod
+    def get_working_set(cls, contract_id, flow_id):
+        '''Get all of a contract's contract stages in a flow, along with their stages
+
+        Arguments:
+            contract_id: ID of the relevant
+                :py:class:`~purchasing.data.contracts.ContractBase`
+            flow_id: ID of the relevant
+                :py:class:`~purchasing.data.flows.Flow`
+
+        Returns:
+            Dictionary of :py:class:`~purchasing.data.stages.Stage` id to
+            :py:class:`~purchasing.data.contract_stages.ContractStage`
+
+        See Also:
+            :py:meth:`get_working_sets`
+        '''
+        return cls.get_working_sets([(contract_id, flow_id)])[(contract_id, flow_id)]
+
+    @classmethod
+    def get_working_sets(cls, contract_flows):
+        '''Get the contract stages for many contracts and flows in one query
+
+        Each contract stage comes with its :py:class:`~purchasing.data.stages.Stage`
+        already loaded, so that transitioning a contract through its stages
+        doesn't need any more queries to find them. Load working sets for
+        many contracts at once to transition all of them cheaply.
+
+        Arguments:
+            contract_flows: List of (contract id, flow id) two-tuples
+
+        Returns:
+            Dictionary of each (contract id, flow id) two-tuple to a
+            dictionary of :py:class:`~purchasing.data.stages.Stage` id to
+            :py:class:`~purchasing.data.contract_stages.ContractStage`
+        '''
+        working_sets = dict((i, {}) for i in contract_flows)
+        if len(working_sets) == 0:
+            return working_sets
+
+        for contract_stage in cls.query.options(joinedload(cls.stage)).filter(
+            db.tuple_(cls.contract_id, cls.flow_id).in_(working_sets.keys())
+        ):
+            working_sets[(contract_stage.contract_id, contract_stage.flow_id)][
+                contract_stage.stage_id
+            ] = contract_stage
+        return working_sets
+
+    def _fix_start_time(self, contract_stages):
         actions = []
-        previous_stage_exit = self._get_previous_stage_exit_time()
+        previous_stage_exit = self._get_previous_stage_exit_time(contract_stages)
         if previous_stage_exit is None or self.entered == previous_stage_exit:
             pass
         else:
@@ -130,12 +178,11 @@ class ContractStage(Model):
             self.enter(previous_stage_exit)
         return actions
 
-    def _get_previous_stage_exit_time(self):
-        current_stage_idx = self.contract.flow.stage_order.index(self.stage_id)
-        previous = ContractStage.get_one(
-            self.contract.id, self.flow.id, self.flow.stage_order[current_stage_idx - 1]
-        )
-        return previous.exited
+    def _get_previous_stage_exit_time(self, contract_stages):
+        previous_stage_id = self.flow.stage_positions.previous(self.stage_id)
+        if previous_stage_id is None:
+            return None
+        return contract_stages[previous_stage_id].exited
 
     def enter(self, enter_time=None):
         '''Set the contract stage's enter time
@@ -182,10 +229,10 @@ class ContractStage(Model):
         Arguments:
             target_stage_id: A :py:class:`~purchasing.data.stages.Stage` ID
         '''
-        if target_stage_id not in self.flow.stage_order:
+        positions = self.flow.stage_positions
+        if target_stage_id not in positions:
             return False
-        return self.flow.stage_order.index(self.stage_id) < \
-            self.flow.stage_order.index(target_stage_id)
+        return positions.index[self.stage_id] < positions.index[target_stage_id]
 
     def happens_before_or_on(self, target_stage_id):
         '''Check if this contract stage happens before or is a target stage
@@ -200,10 +247,10 @@ class ContractStage(Model):
         Arguments:
             target_stage_id: A :py:class:`purchasing.data.stages.Stage` ID
         '''
-        if target_stage_id not in self.flow.stage_order:
+        positions = self.flow.stage_positions
+        if target_stage_id not in positions:
             return False
-        return self.flow.stage_order.index(self.stage_id) <= \
-            self.flow.stage_order.index(target_stage_id)
+        return positions.index[self.stage_id] <= positions.index[target_stage_id]
 
     def happens_after(self, target_stage_id):
         '''Check if this contract stage happens after a target stage
@@ -216,10 +263,10 @@ class ContractStage(Model):
         Arguments:
             target_stage_id: A :py:class:`purchasing.data.stages.Stage` ID
         '''
-        if target_stage_id not in self.flow.stage_order:
+        positions = self.flow.stage_positions
+        if target_stage_id not in positions:
             return False
-        return self.flow.stage_order.index(self.stage_id) > \
-            self.flow.stage_order.index(target_stage_id)
+        return positions.index[self.stage_id] > positions.index[target_stage_id]
 
     def exit(self, exit_time=None):
         '''Set the contract stage's exit time
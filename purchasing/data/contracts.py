@@ -22,6 +22,55 @@ contract_user_association_table = Table(
     Column('contract_id', db.Integer, db.ForeignKey('contract.id'), index=True),
 )
 
+# Filters a contract's action log as described in ContractBase.filter_action_log_python.
+# Actions are ranked within their stage the same way the python version
+# sorts them: by the second they were taken (most recent first), then in
+# the order the complete action log returns them.
+FILTER_ACTION_LOG_QUERY = '''
+    SELECT a.* FROM contract_stage_action_item a
+    JOIN (
+        SELECT
+            ranked.*,
+            row_number() OVER (
+                PARTITION BY ranked.stage_id, ranked.kind, ranked.eligible
+                ORDER BY date_trunc('second', ranked.taken_at) DESC,
+                    ranked.taken_at, ranked.contract_stage_id, ranked.id
+            ) AS rn
+        FROM (
+            SELECT
+                a.id, a.taken_at, a.contract_stage_id, cs.stage_id,
+                CASE
+                    WHEN a.action_type IN ('entered', 'reversion') THEN 0
+                    WHEN a.action_type = 'exited' THEN 1
+                    ELSE 2
+                END AS kind,
+                CASE
+                    WHEN a.action_type IN ('entered', 'reversion')
+                    THEN array_position(f.stage_order, cs.stage_id) <=
+                        array_position(f.stage_order, :current_stage_id)
+                    WHEN a.action_type = 'exited'
+                    THEN array_position(f.stage_order, cs.stage_id) <
+                        array_position(f.stage_order, :current_stage_id)
+                    ELSE true
+                END IS TRUE AS eligible,
+                CASE
+                    WHEN a.action_type IN ('entered', 'reversion', 'exited')
+                    THEN CAST(a.action_detail->>'timestamp' AS timestamp)
+                    ELSE a.taken_at
+                END AS sort_key
+            FROM contract_stage_action_item a
+            JOIN contract_stage cs ON cs.id = a.contract_stage_id
+            LEFT JOIN flow f ON f.id = cs.flow_id
+            WHERE cs.contract_id = :contract_id
+        ) ranked
+    ) filtered ON filtered.id = a.id
+    WHERE filtered.eligible AND (filtered.kind = 2 OR filtered.rn = 1)
+    ORDER BY filtered.sort_key DESC, filtered.taken_at DESC,
+        filtered.stage_id, filtered.kind,
+        date_trunc('second', filtered.taken_at) DESC, filtered.taken_at,
+        filtered.contract_stage_id, filtered.id
+'''
+
 class ContractBase(RefreshSearchViewMixin, Model):
     '''Base contract model
 
@@ -118,9 +167,14 @@ class ContractBase(RefreshSearchViewMixin, Model):
         'parent', remote_side=[id], lazy='subquery'
     ))
 
+    search_index_collections = ('companies',)
+
     def __unicode__(self):
         return '{} (ID: {})'.format(self.description, self.id)
 
+    def search_index_keys(self):
+        return [self.id], []
+
     @property
     def scout_contract_status(self):
         '''Returns a string with the contract's status.
@@ -150,7 +204,7 @@ class ContractBase(RefreshSearchViewMixin, Model):
         contract's :py:class:`~purchasing.data.flows.Flow` id and its
         :py:class:`~purchasing.data.stages.Stage` id
         '''
-        return ContractStage.get_one(self.id, self.flow.id, self.current_stage.id)
+        return ContractStage.get_one(self.id, self.flow.id, self.current_stage_id)
 
     def get_spec_number(self):
         '''Returns the spec number for a given contract
@@ -217,6 +271,25 @@ class ContractBase(RefreshSearchViewMixin, Model):
     def filter_action_log(self):
         '''Returns a filtered action log for this contract
 
+        Filters the log the same way as :py:meth:`filter_action_log_python`,
+        but in a single query: window functions find the most recent start
+        and exit actions for each stage, and stage positions come straight
+        from the flow's ``stage_order`` with ``array_position``, so no
+        actions, contract stages or flows are loaded along the way.
+
+        Returns:
+            List of :py:class:`~purchasing.data.contract_stages.ContractStageActionItem`
+            objects, most recent first
+        '''
+        return ContractStageActionItem.query.from_statement(
+            db.text(FILTER_ACTION_LOG_QUERY).params(
+                contract_id=self.id, current_stage_id=self.current_stage_id
+            )
+        ).all()
+
+    def filter_action_log_python(self):
+        '''Returns a filtered action log for this contract, filtered in Python
+
         Because stages can be restarted, simple ordering by time an action was
         taken will lead to incorrectly ordered (and far too many) actions. Filtering
         these down is a multi-step process, which proceeds roughly as follows:
@@ -236,6 +309,10 @@ class ContractBase(RefreshSearchViewMixin, Model):
             c. Grab all other actions that took place on that stage
         4. Re-sort them based on the action's sort key, which will put them into the
            proper order for display
+
+        This lazily loads each action's contract stage and flow, so
+        :py:meth:`filter_action_log` does the same work in the database.
+        This version is kept to check that one against.
         '''
         all_actions = sorted(
             self.build_complete_action_log(), key=lambda x: (
@@ -317,7 +394,7 @@ class ContractBase(RefreshSearchViewMixin, Model):
         if self.flow:
             return ContractStage.query.filter(
                 ContractStage.contract_id == self.id,
-                ContractStage.stage_id == self.flow.stage_order[0],
+                ContractStage.stage_id == self.flow.stage_positions.first,
                 ContractStage.flow_id == self.flow_id
             ).first()
         return None
@@ -326,12 +403,16 @@ class ContractBase(RefreshSearchViewMixin, Model):
         '''Boolean to check if we have completed the last stage of our flow
         '''
         return self.flow is None or \
-            self.current_stage_id == self.flow.stage_order[-1] and \
+            self.current_stage_id == self.flow.stage_positions.last and \
             self.get_current_stage().exited is not None
 
     def add_follower(self, user):
         '''Add a follower from a contract's list of followers
 
+        The follower's department's count in
+        :py:class:`~purchasing.data.follows.DepartmentContractFollows`
+        is updated when the session flushes.
+
         Arguments:
             user: A :py:class:`~purchasing.users.models.User`
 
@@ -347,6 +428,10 @@ class ContractBase(RefreshSearchViewMixin, Model):
     def remove_follower(self, user):
         '''Remove a follower from a contract's list of followers
 
+        The follower's department's count in
+        :py:class:`~purchasing.data.follows.DepartmentContractFollows`
+        is updated when the session flushes.
+
         Arguments:
             user: A :py:class:`~purchasing.users.models.User`
 
@@ -459,44 +544,36 @@ class ContractBase(RefreshSearchViewMixin, Model):
 
         return clone
 
-    def _transition_to_first(self, user, complete_time):
-        contract_stage = ContractStage.get_one(
-            self.id, self.flow.id, self.flow.stage_order[0]
-        )
+    def _transition_to_first(self, user, complete_time, contract_stages):
+        first_stage_id = self.flow.stage_positions.first
+        contract_stage = contract_stages[first_stage_id]
 
-        self.current_stage_id = self.flow.stage_order[0]
+        self.current_stage_id = first_stage_id
         return [contract_stage.log_enter(user, complete_time)]
 
-    def _transition_to_next(self, user, complete_time):
-        stages = self.flow.stage_order
-        current_stage_idx = stages.index(self.current_stage.id)
-
-        current_stage = self.current_contract_stage
-        next_stage = ContractStage.get_one(
-            self.id, self.flow.id, self.flow.stage_order[current_stage_idx + 1]
-        )
+    def _transition_to_next(self, user, complete_time, contract_stages):
+        current_stage = contract_stages[self.current_stage_id]
+        next_stage = contract_stages[self.flow.stage_positions.next(self.current_stage_id)]
 
-        self.current_stage_id = next_stage.stage.id
-        actions = current_stage._fix_start_time()
+        self.current_stage_id = next_stage.stage_id
+        actions = current_stage._fix_start_time(contract_stages)
         actions.extend([
             current_stage.log_exit(user, complete_time),
             next_stage.log_enter(user, complete_time)
         ])
         return actions
 
-    def _transition_to_last(self, user, complete_time):
-        exit = self.current_contract_stage.log_exit(user, complete_time)
+    def _transition_to_last(self, user, complete_time, contract_stages):
+        exit = contract_stages[self.current_stage_id].log_exit(user, complete_time)
         return [exit]
 
-    def _transition_backwards_to_destination(self, user, destination, complete_time):
-        destination_idx = self.flow.stage_order.index(destination)
-        current_stage_idx = self.flow.stage_order.index(self.current_stage_id)
-
-        if destination_idx > current_stage_idx:
+    def _transition_backwards_to_destination(self, user, destination, complete_time, contract_stages):
+        positions = self.flow.stage_positions
+        if positions.index[destination] > positions.index[self.current_stage_id]:
             raise Exception('Skipping stages is not currently supported')
 
-        stages = self.flow.stage_order[destination_idx:current_stage_idx + 1]
-        to_revert = ContractStage.get_multiple(self.id, self.flow_id, stages)
+        stages = positions.between(destination, self.current_stage_id)
+        to_revert = [contract_stages[i] for i in stages]
 
         actions = []
 
@@ -505,13 +582,13 @@ class ContractBase(RefreshSearchViewMixin, Model):
                 actions.append(contract_stage.log_reopen(user, complete_time))
                 contract_stage.entered = complete_time
                 contract_stage.exited = None
-                self.current_stage_id = contract_stage.stage.id
+                self.current_stage_id = contract_stage.stage_id
             else:
                 contract_stage.full_revert()
 
         return actions
 
-    def transition(self, user, destination=None, complete_time=None):
+    def transition(self, user, destination=None, complete_time=None, contract_stages=None):
         '''Transition the contract to the appropriate stage.
 
         * If the contract has no current stage, transition it to the first
@@ -534,22 +611,30 @@ class ContractBase(RefreshSearchViewMixin, Model):
                 and :py:class:`~purchasing.data.contract_stages.ContractStage`
                 enter and exit times are marked with the passed time. The actions'
                 taken_at times are still marked with the current time, however.
+            contract_stages: The contract's working set of
+                :py:class:`~purchasing.data.contract_stages.ContractStage`
+                objects in its flow, from
+                :py:meth:`~purchasing.data.contract_stages.ContractStage.get_working_sets`.
+                Defaults to loading them in a single query.
 
         Returns:
             A list of :py:class:`~purchasing.data.contract_stages.ContractStageActionItem`
             objects which describe the actions in transition
         '''
         complete_time = complete_time if complete_time else datetime.datetime.utcnow()
+        if contract_stages is None:
+            contract_stages = ContractStage.get_working_set(self.id, self.flow.id)
+
         if self.current_stage_id is None:
-            actions = self._transition_to_first(user, complete_time)
+            actions = self._transition_to_first(user, complete_time, contract_stages)
         elif destination is not None:
             actions = self._transition_backwards_to_destination(
-                user, destination, complete_time
+                user, destination, complete_time, contract_stages
             )
-        elif self.current_stage_id == self.flow.stage_order[-1]:
-            actions = self._transition_to_last(user, complete_time)
+        elif self.current_stage_id == self.flow.stage_positions.last:
+            actions = self._transition_to_last(user, complete_time, contract_stages)
         else:
-            actions = self._transition_to_next(user, complete_time)
+            actions = self._transition_to_next(user, complete_time, contract_stages)
 
         return actions
 
@@ -732,6 +817,9 @@ class ContractProperty(RefreshSearchViewMixin, Model):
     def __unicode__(self):
         return u'{key}: {value}'.format(key=self.key, value=self.value)
 
+    def search_index_keys(self):
+        return [self.contract_id], []
+
 class ContractNote(Model):
     '''Model for contract notes
 
@@ -807,3 +895,6 @@ class LineItem(RefreshSearchViewMixin, Model):
 
     def __unicode__(self):
         return self.description
+
+    def search_index_keys(self):
+        return [self.contract_id], []
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import datetime
+
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from purchasing.database import db, Column
+
+class FlowStageSnapshot(db.Model):
+    '''Time-in-stage statistics for one stage of a flow, as of one day
+
+    One row is written for each status of each stage of each flow every
+    night by :py:class:`~purchasing.jobs.conductor_nightly.ConductorMetricsSnapshotJob`,
+    so the dashboards don't have to rescan every contract stage in the
+    flow on every load, and older snapshots make up the history of the
+    flow's metrics.
+
+    Attributes:
+        flow_id: Foreign key to :py:class:`~purchasing.data.flows.Flow`
+        snapshot_date: Date the snapshot was taken
+        status: 'current' for contracts still in the stage, 'complete'
+            for stages that were exited
+        stage_id: Foreign key to :py:class:`~purchasing.data.stages.Stage`
+        taken_at: When the snapshot was taken. Stages exited after this
+            are not counted in it
+        stage_name: Name of the stage
+        count: Number of times the stage was entered, which for
+            ``current`` stages is the number of contracts in progress
+        mean: Average seconds spent in the stage
+        median: Median seconds spent in the stage
+        p90: 90th percentile of seconds spent in the stage
+        min: Fewest seconds spent in the stage
+        max: Most seconds spent in the stage
+        histogram: Counts for each of the
+            :py:data:`~purchasing.data.flows.METRICS_HISTOGRAM_DAYS` bins
+
+    See Also:
+        :py:meth:`~purchasing.data.flows.Flow.build_metrics_summary`
+    '''
+    __tablename__ = 'flow_stage_snapshot'
+
+    flow_id = Column(
+        db.Integer, db.ForeignKey('flow.id', ondelete='CASCADE'), primary_key=True
+    )
+    snapshot_date = Column(db.Date, primary_key=True)
+    status = Column(db.String(10), primary_key=True)
+    stage_id = Column(
+        db.Integer, db.ForeignKey('stage.id', ondelete='CASCADE'), primary_key=True
+    )
+    taken_at = Column(db.DateTime, nullable=False)
+    stage_name = Column(db.String(255))
+    count = Column(db.Integer, nullable=False)
+    mean = Column(db.Float)
+    median = Column(db.Float)
+    p90 = Column(db.Float)
+    min = Column(db.Float)
+    max = Column(db.Float)
+    histogram = Column(ARRAY(db.Integer))
+
+    def as_dict(self):
+        return {
+            'id': self.stage_id, 'name': self.stage_name, 'count': self.count,
+            'mean': self.mean, 'median': self.median, 'p90': self.p90,
+            'min': self.min, 'max': self.max, 'histogram': self.histogram,
+        }
+
+class FlowThroughput(db.Model):
+    '''Number of contracts that finished a flow in a given week
+
+    Attributes:
+        flow_id: Foreign key to :py:class:`~purchasing.data.flows.Flow`
+        week: First day (Monday) of the week
+        completed: Number of contracts that exited the flow's last
+            stage during the week
+    '''
+    __tablename__ = 'flow_throughput'
+
+    flow_id = Column(
+        db.Integer, db.ForeignKey('flow.id', ondelete='CASCADE'), primary_key=True
+    )
+    week = Column(db.Date, primary_key=True)
+    completed = Column(db.Integer, nullable=False)
+
+def weekly_throughput(flow, since=None):
+    '''Count the contracts that finished a flow each week
+
+    Arguments:
+        flow: :py:class:`~purchasing.data.flows.Flow` to count
+
+    Keyword Arguments:
+        since: If passed, only count weeks from the one that this date
+            falls in onwards
+
+    Returns:
+        List of (week, completed) two-tuples, in week order
+    '''
+    return [(row.week, row.completed) for row in db.session.execute(db.text('''
+        SELECT date_trunc('week', cs.exited)::date AS week, count(DISTINCT cs.contract_id) AS completed
+        FROM contract_stage cs
+        JOIN flow f ON cs.flow_id = f.id
+        WHERE cs.flow_id = :flow_id
+        AND cs.stage_id = f.stage_order[array_upper(f.stage_order, 1)]
+        AND cs.exited IS NOT NULL
+        AND (CAST(:since AS date) IS NULL OR cs.exited >= date_trunc('week', CAST(:since AS date)))
+        GROUP BY 1
+        ORDER BY 1
+    '''), {'flow_id': flow.id, 'since': since})]
+
+def latest_snapshot(flow):
+    '''Get the rows of the most recent snapshot of a flow
+
+    Arguments:
+        flow: :py:class:`~purchasing.data.flows.Flow` to look up
+
+    Returns:
+        List of :py:class:`FlowStageSnapshot` rows, which is empty if the
+        flow has never been snapshotted
+    '''
+    snapshot_date = db.session.query(db.func.max(FlowStageSnapshot.snapshot_date)).filter(
+        FlowStageSnapshot.flow_id == flow.id
+    ).scalar()
+    if snapshot_date is None:
+        return []
+
+    return FlowStageSnapshot.query.filter(
+        FlowStageSnapshot.flow_id == flow.id,
+        FlowStageSnapshot.snapshot_date == snapshot_date
+    ).all()
+
+def snapshot_flow_metrics(flow, taken_at=None):
+    '''Write today's snapshot of a flow's metrics, and update its throughput
+
+    Running this more than once in a day replaces that day's snapshot.
+    Throughput is only recounted from the week of the flow's previous
+    snapshot onwards, since earlier weeks can no longer change.
+
+    Arguments:
+        flow: :py:class:`~purchasing.data.flows.Flow` to snapshot
+
+    Keyword Arguments:
+        taken_at: Naive UTC datetime to take the snapshot as of,
+            defaults to now
+
+    Returns:
+        List of the new :py:class:`FlowStageSnapshot` rows
+    '''
+    taken_at = taken_at if taken_at else datetime.datetime.utcnow()
+    previous = db.session.query(db.func.max(FlowStageSnapshot.taken_at)).filter(
+        FlowStageSnapshot.flow_id == flow.id,
+        FlowStageSnapshot.snapshot_date < taken_at.date()
+    ).scalar()
+
+    FlowStageSnapshot.query.filter(
+        FlowStageSnapshot.flow_id == flow.id,
+        FlowStageSnapshot.snapshot_date == taken_at.date()
+    ).delete(synchronize_session=False)
+
+    snapshot = []
+    for status, stages in flow.build_metrics_summary().items():
+        for stage in stages:
+            snapshot.append(FlowStageSnapshot(
+                flow_id=flow.id, snapshot_date=taken_at.date(), status=status,
+                stage_id=stage['id'], taken_at=taken_at, stage_name=stage['name'],
+                count=stage['count'], mean=stage['mean'], median=stage['median'],
+                p90=stage['p90'], min=stage['min'], max=stage['max'],
+                histogram=stage['histogram']
+            ))
+    db.session.add_all(snapshot)
+
+    throughput = FlowThroughput.query.filter(FlowThroughput.flow_id == flow.id)
+    if previous:
+        monday = previous.date() - datetime.timedelta(days=previous.weekday())
+        throughput = throughput.filter(FlowThroughput.week >= monday)
+    throughput.delete(synchronize_session=False)
+
+    db.session.add_all([
+        FlowThroughput(flow_id=flow.id, week=week, completed=completed)
+        for week, completed in weekly_throughput(flow, since=previous)
+    ])
+
+    return snapshot
+
+def merge_stage_stats(snapshot, delta):
+    '''Add a stage's completions since its snapshot onto the snapshot
+
+    Counts, means, extremes and histograms combine exactly. Percentiles
+    can't be combined without the underlying rows, so the snapshot's
+    median and p90 are kept until the next snapshot is taken.
+
+    Arguments:
+        snapshot: Stage statistics dictionary from a snapshot
+        delta: Stage statistics dictionary for the same stage, counting
+            only what happened after the snapshot was taken
+
+    Returns:
+        A combined stage statistics dictionary
+    '''
+    count = snapshot['count'] + delta['count']
+    merged = dict(snapshot)
+    merged.update({
+        'count': count,
+        'mean': (snapshot['mean'] * snapshot['count'] + delta['mean'] * delta['count']) / count,
+        'min': min(snapshot['min'], delta['min']),
+        'max': max(snapshot['max'], delta['max']),
+        'histogram': [a + b for a, b in zip(snapshot['histogram'], delta['histogram'])],
+    })
+    return merged
+
+def current_flow_metrics(flow):
+    '''Get a flow's metrics from its latest snapshot plus what has happened since
+
+    Stages completed since the snapshot are aggregated and merged into
+    the snapshot's ``complete`` statistics, and ``current`` statistics
+    are always computed live, since everything in progress keeps aging.
+    Both only touch the contract stages that are open or were exited
+    after the snapshot. Flows that have never been snapshotted are
+    computed from scratch.
+
+    Arguments:
+        flow: :py:class:`~purchasing.data.flows.Flow` to get metrics for
+
+    Returns:
+        A dictionary with the ``current`` and ``complete`` lists described
+        in :py:meth:`~purchasing.data.flows.Flow.build_metrics_summary`,
+        along with ``throughput``, a list of weekly completion counts,
+        and ``snapshotTakenAt``, when the snapshot used was taken
+    '''
+    snapshot = latest_snapshot(flow)
+    if len(snapshot) == 0:
+        results = flow.build_metrics_summary()
+        results['throughput'] = weekly_throughput(flow)
+        results['snapshotTakenAt'] = None
+        return results
+
+    taken_at = snapshot[0].taken_at
+    delta = flow.build_metrics_summary(exited_since=taken_at)
+
+    complete = dict(
+        (row.stage_id, row.as_dict()) for row in snapshot if row.status == 'complete'
+    )
+    for stage in delta['complete']:
+        if stage['id'] in complete:
+            complete[stage['id']] = merge_stage_stats(complete[stage['id']], stage)
+        else:
+            complete[stage['id']] = stage
+
+    order = flow.stage_positions.index
+
+    # weeks since the snapshot are still filling up, so count those live
+    throughput = dict(
+        (row.week, row.completed) for row in
+        FlowThroughput.query.filter(FlowThroughput.flow_id == flow.id)
+    )
+    throughput.update(dict(weekly_throughput(flow, since=taken_at)))
+
+    return {
+        'current': delta['current'],
+        'complete': sorted(complete.values(), key=lambda i: order.get(i['id'], len(order))),
+        'throughput': sorted(throughput.items()),
+        'snapshotTakenAt': taken_at,
+    }
+
+def flow_metrics_version(flow, raw=False):
+    '''Fingerprint the data behind a flow's metrics without computing them
+
+    The fingerprint changes whenever an action is taken on one of the
+    flow's contract stages, one of its contracts is updated, added to or
+    removed from the flow (or deleted), one of its stages is renamed, or a
+    new snapshot is taken. It also changes every day, since the time spent
+    in stages that are still in progress keeps growing.
+
+    Arguments:
+        flow: :py:class:`~purchasing.data.flows.Flow` to fingerprint
+
+    Keyword Arguments:
+        raw: Whether the fingerprint is for the raw per-contract metrics
+            rather than the summary
+
+    Returns:
+        Two-tuple of (fingerprint string to use as an ETag, naive UTC
+        datetime of the latest change, or None if nothing has happened)
+    '''
+    versions = db.session.execute(db.text('''
+        SELECT
+            (
+                SELECT max(a.taken_at) FROM contract_stage_action_item a
+                JOIN contract_stage cs ON a.contract_stage_id = cs.id
+                WHERE cs.flow_id = :flow_id
+            ) AS action_taken_at,
+            (SELECT max(updated_at) FROM contract WHERE flow_id = :flow_id) AS contract_updated_at,
+            (SELECT max(taken_at) FROM flow_stage_snapshot WHERE flow_id = :flow_id) AS snapshot_taken_at,
+            (SELECT max(updated_at) FROM stage WHERE id = ANY(:stage_ids)) AS stage_updated_at,
+            cs.contract_stages, cs.contract_stage_ids, cs.last_contract_stage_id,
+            c.contracts, c.contract_ids
+        FROM (
+            SELECT count(*) AS contract_stages, sum(id) AS contract_stage_ids,
+                max(id) AS last_contract_stage_id
+            FROM contract_stage WHERE flow_id = :flow_id
+        ) cs, (
+            SELECT count(*) AS contracts, sum(id) AS contract_ids
+            FROM contract WHERE flow_id = :flow_id
+        ) c
+    '''), {'flow_id': flow.id, 'stage_ids': flow.stage_order or []}).first()
+
+    fingerprint = hashlib.sha1('|'.join(str(i) for i in [
+        flow.id, flow.stage_order, raw, datetime.date.today()
+    ] + list(versions))).hexdigest()
+
+    changes = [i for i in versions[:4] if i is not None]
+    return fingerprint, max(changes) if changes else None
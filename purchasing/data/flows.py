@@ -12,6 +12,103 @@ from purchasing.utils import localize_datetime
 from purchasing.data.contract_stages import ContractStage
 from purchasing.data.stages import Stage
 
+# long data behind the metrics downloads: one row for each stage each
+# contract in a flow has entered, in contract and stage order. Extra
+# conditions on the contract stages can be filled in to narrow it down
+METRICS_QUERY = '''
+select
+    x.contract_id, x.description, x.department,
+    x.email, x.stage_name, x.rn, x.stage_id,
+    x.is_archived, x.pos,
+    min(x.entered) as entered,
+    max(x.exited) as exited
+
+from (
+
+    select
+        c.id as contract_id, c.description, d.name as department, c.is_archived,
+        u.email, s.name as stage_name, s.id as stage_id, cs.exited, cs.entered,
+        row_number() over (partition by c.id order by cs.entered asc, cs.id asc) as rn,
+        f.stage_order[s.id] as pos
+
+    from contract_stage cs
+    join stage s on cs.stage_id = s.id
+
+    join contract c on cs.contract_id = c.id
+
+    join users u on c.assigned_to = u.id
+    left join department d on c.department_id = d.id
+
+    join flow f on cs.flow_id = f.id
+
+    where cs.entered is not null
+    and cs.flow_id = :flow_id
+    and c.has_metrics is true
+    {filters}
+
+) x
+group by 1,2,3,4,5,6,7,8, pos
+order by contract_id, pos, rn asc
+'''
+
+METRICS_CSV_QUERY = METRICS_QUERY.format(filters='')
+
+# upper bounds, in days, of every time-in-stage histogram bin but the last,
+# which holds everything that took longer
+METRICS_HISTOGRAM_DAYS = [1, 7, 15, 30]
+
+# position lookups for every stage order in use, shared across requests.
+# Keyed by flow id and stage order, so a flow whose stages are edited gets
+# a fresh lookup; cleared out whenever it grows past its size limit
+_STAGE_POSITIONS = {}
+STAGE_POSITIONS_CACHE_SIZE = 256
+
+class StagePositions(object):
+    '''Where each stage falls in a flow's stage order
+
+    Built once per stage order by :py:attr:`Flow.stage_positions`, so that
+    looking up a stage's position, or the stages on either side of it,
+    doesn't have to scan the stage order every time.
+
+    Arguments:
+        stage_order: List of :py:class:`~purchasing.data.stages.Stage` ids,
+            in order
+
+    Attributes:
+        stage_order: Tuple of the stage ids, in order
+        index: Dictionary of stage id to its position in ``stage_order``
+        first: Id of the first stage, or None if there are no stages
+        last: Id of the last stage, or None if there are no stages
+    '''
+    def __init__(self, stage_order):
+        self.stage_order = tuple(stage_order or [])
+        # like list.index, a repeated stage keeps its first position
+        self.index = dict(
+            (stage_id, ix) for ix, stage_id in reversed(list(enumerate(self.stage_order)))
+        )
+        self.first = self.stage_order[0] if self.stage_order else None
+        self.last = self.stage_order[-1] if self.stage_order else None
+
+    def __contains__(self, stage_id):
+        return stage_id in self.index
+
+    def next(self, stage_id):
+        '''Get the id of the stage after a stage, or None if it is the last stage
+        '''
+        ix = self.index[stage_id] + 1
+        return self.stage_order[ix] if ix < len(self.stage_order) else None
+
+    def previous(self, stage_id):
+        '''Get the id of the stage before a stage, or None if it is the first stage
+        '''
+        ix = self.index[stage_id] - 1
+        return self.stage_order[ix] if ix >= 0 else None
+
+    def between(self, start_stage_id, end_stage_id):
+        '''Get the ids of the stages from one stage up to and including another
+        '''
+        return list(self.stage_order[self.index[start_stage_id]:self.index[end_stage_id] + 1])
+
 class Flow(Model):
     '''Model for flows
 
@@ -55,6 +152,25 @@ class Flow(Model):
         '''
         return cls.query.filter(cls.is_archived == False)
 
+    @property
+    def stage_positions(self):
+        '''A :py:class:`StagePositions` lookup for the flow's current ``stage_order``
+
+        The lookup is kept on the flow and shared with every other flow
+        object with the same id and stage order, so it is only built
+        again when the stage order changes.
+        '''
+        key = (self.id, tuple(self.stage_order or []))
+        positions = getattr(self, '_stage_positions', None)
+        if positions is None or positions[0] != key:
+            lookup = _STAGE_POSITIONS.get(key)
+            if lookup is None:
+                if len(_STAGE_POSITIONS) >= STAGE_POSITIONS_CACHE_SIZE:
+                    _STAGE_POSITIONS.clear()
+                lookup = _STAGE_POSITIONS[key] = StagePositions(key[1])
+            positions = self._stage_positions = (key, lookup)
+        return positions[1]
+
     def get_ordered_stages(self):
         '''Turns the flow's stage_order attribute into Stage objects
 
@@ -180,6 +296,89 @@ class Flow(Model):
 
         return results
 
+    def build_metrics_summary(self, histogram_days=METRICS_HISTOGRAM_DAYS, exited_since=None):
+        '''Build time-in-stage statistics for each stage in the flow
+
+        This is the same data as :py:meth:`build_metrics_data`, but
+        aggregated in the database, so only a handful of numbers per
+        stage are returned no matter how many contracts have gone
+        through the flow. Stages are split into ``current`` (stages
+        contracts are still in) and ``complete`` (stages that have been
+        exited), and are in stage order.
+
+        Example:
+            .. code-block:: python
+
+                results = {
+                    'current': [{
+                        'id': 'the stage id', 'name': 'the stage name',
+                        'count': 'number of times the stage was entered',
+                        'mean': 'average seconds spent in the stage',
+                        'median': 'median seconds spent in the stage',
+                        'p90': '90th percentile of seconds spent in the stage',
+                        'min': 'fewest seconds spent in the stage',
+                        'max': 'most seconds spent in the stage',
+                        'histogram': 'number of times for each histogram bin',
+                    }, ...],
+                    'complete': [...]
+                }
+
+        Arguments:
+            histogram_days: Upper bounds, in days, of the histogram bins.
+                There is one more bin than there are bounds.
+            exited_since: If passed, only count ``complete`` stages that
+                were exited at or after this (naive UTC) datetime.
+                ``current`` stages are always counted.
+
+        Returns:
+            A results dictionary described in the example above.
+        '''
+        edges = dict(
+            ('edge_{}'.format(ix), days * 86400) for ix, days in enumerate(histogram_days)
+        )
+        bins = ['sum(case when seconds < :edge_0 then 1 else 0 end)'] + [
+            'sum(case when seconds >= :edge_{} and seconds < :edge_{} then 1 else 0 end)'.format(ix - 1, ix)
+            for ix in range(1, len(histogram_days))
+        ] + ['sum(case when seconds >= :edge_{} then 1 else 0 end)'.format(len(histogram_days) - 1)]
+
+        params = {'flow_id': self.id, 'now': datetime.datetime.utcnow(), 'since': exited_since}
+        params.update(edges)
+        filters = 'and (cs.exited is null or cs.exited >= :since)' if exited_since else ''
+
+        rows = db.session.execute(db.text('''
+        with durations as (
+            select
+                stage_id, stage_name,
+                case when exited is null then 'current' else 'complete' end as status,
+                greatest(extract(epoch from coalesce(exited, :now) - entered), 0)::float as seconds
+            from ({}) metrics
+            where exited is not null or is_archived is not true
+        )
+
+        select
+            status, stage_id, stage_name, count(*) as count,
+            avg(seconds) as mean,
+            percentile_cont(0.5) within group (order by seconds) as median,
+            percentile_cont(0.9) within group (order by seconds) as p90,
+            min(seconds) as min, max(seconds) as max,
+            array[{}] as histogram
+        from durations
+        group by status, stage_id, stage_name
+        '''.format(METRICS_QUERY.format(filters=filters), ', '.join(bins))), params).fetchall()
+
+        order = self.stage_positions.index
+        results = {'current': [], 'complete': []}
+
+        for row in sorted(rows, key=lambda row: order.get(row.stage_id, len(order))):
+            results[row.status].append({
+                'id': row.stage_id, 'name': row.stage_name, 'count': row.count,
+                'mean': row.mean, 'median': row.median, 'p90': row.p90,
+                'min': row.min, 'max': row.max,
+                'histogram': [int(i) for i in row.histogram],
+            })
+
+        return results
+
     def reshape_metrics_granular(self, enter_and_exit=False):
         '''Transform long data from database into wide data for consumption
 
@@ -235,42 +434,70 @@ class Flow(Model):
 
         return results, headers
 
-    def get_metrics_csv_data(self):
-        '''Raw SQL query that returns the raw data to be reshaped for download or charting
-        '''
-        return db.session.execute('''
-        select
-            x.contract_id, x.description, x.department,
-            x.email, x.stage_name, x.rn, x.stage_id,
-            x.is_archived,
-            min(x.entered) as entered,
-            max(x.exited) as exited
+    def metrics_granular_headers(self):
+        '''Headers for the rows built by :py:meth:`iter_metrics_granular`
 
-        from (
+        Stage columns are in the order that the stages first show up in
+        the metrics data, the same order that
+        :py:meth:`reshape_metrics_granular` builds its headers in. They are
+        worked out by the database, so that the headers can be sent before
+        any of the rows have been read.
 
-            select
-                c.id as contract_id, c.description, d.name as department, c.is_archived,
-                u.email, s.name as stage_name, s.id as stage_id, cs.exited, cs.entered,
-                row_number() over (partition by c.id order by cs.entered asc, cs.id asc) as rn,
-                f.stage_order[s.id] as pos
+        Returns:
+            A list of strings which can be used to create the headers for
+            the downloadable file, or an empty list if there is no data
+        '''
+        stages = db.session.execute(db.text('''
+        select stage_name from ({}) metrics
+        group by stage_name
+        order by min(array[contract_id, pos, rn])
+        '''.format(METRICS_CSV_QUERY)), {
+            'flow_id': self.id
+        }).fetchall()
 
-            from contract_stage cs
-            join stage s on cs.stage_id = s.id
+        if len(stages) == 0:
+            return []
+        return ['item_number', 'description', 'assigned_to', 'department'] + \
+            [i.stage_name for i in stages]
 
-            join contract c on cs.contract_id = c.id
+    def iter_metrics_granular(self):
+        '''Transform long data from the database into wide data, one contract at a time
 
-            join users u on c.assigned_to = u.id
-            left join department d on c.department_id = d.id
+        Works like :py:meth:`reshape_metrics_granular`, but reads the data
+        from a server-side cursor and hands back each contract's row as soon
+        as all of its stages have been read, so that the whole result set
+        never has to be held in memory at once.
 
-            join flow f on cs.flow_id = f.id
+        Returns:
+            A generator of (contract id, values) two-tuples, in contract id
+            order, where the values line up with
+            :py:meth:`metrics_granular_headers`
+        '''
+        contract_id, values = None, []
+        for row in self.get_metrics_csv_data(stream=True):
+            if row.contract_id != contract_id:
+                if contract_id is not None:
+                    yield contract_id, values
+                contract_id = row.contract_id
+                values = [row.contract_id, row.description, row.email, row.department]
+            values.append(localize_datetime(row.exited))
+
+        if contract_id is not None:
+            yield contract_id, values
+
+    def get_metrics_csv_data(self, stream=False):
+        '''Raw SQL query that returns the raw data to be reshaped for download or charting
 
-            where cs.entered is not null
-            and cs.flow_id = :flow_id
-            and c.has_metrics is true
+        Arguments:
+            stream: Whether to read the rows from a server-side cursor as
+                they are iterated over, rather than fetching them all at once
 
-        ) x
-        group by 1,2,3,4,5,6,7,8, pos
-        order by contract_id, pos, rn asc
-        ''', {
-            'flow_id': self.id
-        }).fetchall()
+        Returns:
+            A list of rows, or a result proxy to iterate over if streaming
+        '''
+        query = db.text(METRICS_CSV_QUERY)
+        if stream:
+            return db.session.execute(
+                query.execution_options(stream_results=True), {'flow_id': self.id}
+            )
+        return db.session.execute(query, {'flow_id': self.id}).fetchall()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import collections
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history, PASSIVE_NO_INITIALIZE
+
+from purchasing.database import db, Column
+from purchasing.data.contracts import ContractBase
+from purchasing.users.models import User
+
+class DepartmentContractFollows(db.Model):
+    '''Number of people in each department following each contract
+
+    This is an aggregate of the ``contract_user_association`` table,
+    kept up to date whenever a contract's followers (or a follower's
+    department) change, so that the contracts a department follows most
+    can be read straight off of an index.
+
+    Attributes:
+        department_id: Foreign key to :py:class:`~purchasing.users.models.Department`
+        contract_id: Foreign key to :py:class:`~purchasing.data.contracts.ContractBase`
+        follows: Number of users in the department who follow the contract
+    '''
+    __tablename__ = 'department_contract_follows'
+
+    department_id = Column(
+        db.Integer, db.ForeignKey('department.id', ondelete='CASCADE'), primary_key=True
+    )
+    contract_id = Column(
+        db.Integer, db.ForeignKey('contract.id', ondelete='CASCADE'), primary_key=True
+    )
+    follows = Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index(
+            'ix_department_contract_follows_ranking',
+            department_id, follows.desc(), contract_id
+        ),
+    )
+
+DEPARTMENT_FOLLOWS_ROWS = '''
+    INSERT INTO department_contract_follows (department_id, contract_id, follows)
+    SELECT users.department_id, contract_user_association.contract_id, count(*)
+    FROM contract_user_association
+    JOIN users ON users.id = contract_user_association.user_id
+    WHERE users.department_id IS NOT NULL
+    AND contract_user_association.contract_id IS NOT NULL
+    GROUP BY 1, 2
+'''
+
+def apply_department_follows(session, deltas):
+    '''Add changes in follows to the department follow counts
+
+    Each count is changed in place with ``follows = follows + delta``, so
+    the row lock serializes transactions that change the same count and
+    none of their changes are lost. Counts that drop to zero are removed.
+
+    Arguments:
+        session: Sqlalchemy session or connection to execute with
+        deltas: Dictionary of (department id, contract id) to the change in
+            the number of users in that department following that contract
+    '''
+    # changing the counts in a consistent order keeps two transactions
+    # from each holding a row lock that the other is waiting on
+    params = [
+        {'department_id': department_id, 'contract_id': contract_id, 'delta': delta}
+        for (department_id, contract_id), delta in sorted(deltas.items()) if delta != 0
+    ]
+    if len(params) == 0:
+        return
+
+    session.execute(db.text('''
+        INSERT INTO department_contract_follows (department_id, contract_id, follows)
+        VALUES (:department_id, :contract_id, :delta)
+        ON CONFLICT (department_id, contract_id) DO UPDATE
+        SET follows = department_contract_follows.follows + excluded.follows
+    '''), params)
+    session.execute(db.text('''
+        DELETE FROM department_contract_follows
+        WHERE contract_id = ANY(:contract_ids) AND follows <= 0
+    '''), {'contract_ids': sorted(set(i['contract_id'] for i in params))})
+
+def rebuild_department_follows(session):
+    '''Recount the department follows for every contract
+
+    Arguments:
+        session: Sqlalchemy session or connection to execute with
+    '''
+    session.execute(db.text('DELETE FROM department_contract_follows'))
+    session.execute(db.text(DEPARTMENT_FOLLOWS_ROWS))
+
+def _department_ids(user):
+    # the user's department id before and after the flush
+    history = get_history(user, 'department_id')
+    if history.deleted:
+        return history.deleted[0], user.department_id
+
+    history = get_history(user, 'department', passive=PASSIVE_NO_INITIALIZE)
+    if history.deleted:
+        return getattr(history.deleted[0], 'id', None), user.department_id
+
+    return user.department_id, user.department_id
+
+def department_follows_changed(session):
+    '''Find how a flush changed the number of follows per department
+
+    Follows change when followers are added to or removed from contracts
+    (from either side of the relationship), and when a follower moves to a
+    different department, which moves all of their follows with them.
+    Contracts that were deleted are skipped, since the database removes
+    their counts.
+
+    Arguments:
+        session: Sqlalchemy session that is being flushed
+
+    Returns:
+        Dictionary of (department id, contract id) to the change in follows
+    '''
+    added, removed, users = set(), set(), set()
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, ContractBase):
+            # collections that were never loaded can't have changed, so
+            # don't go to the database to find out
+            followers = get_history(obj, 'followers', passive=PASSIVE_NO_INITIALIZE)
+            added.update((user, obj) for user in followers.added)
+            removed.update((user, obj) for user in followers.deleted)
+            users.update(followers.added)
+            users.update(followers.deleted)
+        elif isinstance(obj, User):
+            users.add(obj)
+            if obj in session.deleted:
+                following = get_history(obj, 'contracts_following')
+                removed.update((obj, contract) for contract in following.unchanged)
+            else:
+                following = get_history(obj, 'contracts_following', passive=PASSIVE_NO_INITIALIZE)
+                added.update((obj, contract) for contract in following.added)
+            removed.update((obj, contract) for contract in following.deleted)
+
+    departments = dict((user, _department_ids(user)) for user in users)
+
+    deltas = collections.defaultdict(int)
+    for user, contract in added:
+        deltas[(departments[user][1], contract.id)] += 1
+    for user, contract in removed:
+        deltas[(departments[user][0], contract.id)] -= 1
+    for user, (old, new) in departments.items():
+        if old != new and user not in session.new and user not in session.deleted:
+            for contract in get_history(user, 'contracts_following').unchanged:
+                if (user, contract) in added or (user, contract) in removed:
+                    continue
+                deltas[(old, contract.id)] -= 1
+                deltas[(new, contract.id)] += 1
+
+    deleted = set(obj.id for obj in session.deleted if isinstance(obj, ContractBase))
+    return dict(
+        ((department_id, contract_id), delta)
+        for (department_id, contract_id), delta in deltas.items()
+        if department_id is not None and contract_id is not None and contract_id not in deleted
+    )
+
+@sqlalchemy.event.listens_for(Session, 'after_flush')
+def update_department_follows(session, flush_context):
+    apply_department_follows(session, department_follows_changed(session))
@@ -1,14 +1,27 @@
 # -*- coding: utf-8 -*-
 
-from purchasing.database import db, Model, Column
-from sqlalchemy.dialects.postgresql import TSVECTOR
+import time
+import datetime
 
-class SearchView(Model):
-    '''SearchView is a materialized view with all of our text columns
+from purchasing.database import db, Column
+from purchasing.extensions import cache
+from sqlalchemy.dialects.postgresql import TSVECTOR, ARRAY
+
+class SearchView(db.Model):
+    '''SearchView is a table with all of our text columns
+
+    The search index holds exactly one row per contract. The text of a
+    contract's companies, properties, and line items is aggregated into
+    a single tsvector per field, so the size of the index and the cost
+    of rebuilding it grow with the number of contracts rather than with
+    the number of combinations of their children. Instead of being rebuilt
+    all at once like a materialized view, rows are maintained per contract:
+    whenever a contract or one of its searchable children changes, only that
+    contract's row is replaced (see :py:func:`reindex_contracts`).
 
     See Also:
-        For more detailed information about how this materialized view
-        is set up, please refer to `Multi-Table Full Text Search with Postgres,
+        For more detailed information about how the original materialized view
+        was set up, please refer to `Multi-Table Full Text Search with Postgres,
         Flask, and Sqlalchemy (Part I)
         <http://bensmithgall.com/blog/full-text-search-flask-sqlalchemy/>`_.
 
@@ -17,38 +30,370 @@ class SearchView(Model):
         <http://www.postgresql.org/docs/current/static/textsearch-intro.html>`_
 
     Attributes:
-        id: Primary key unique ID for result
-        contract_id: Unique ID for one contract
-        company_id: Unique ID for one company
+        contract_id: Primary key, the unique ID for one contract
         financial_id: Financial ID for a contract
         expiration_date: Date a contract expires
         contract_description: Description of the goods or services
             provided by a :py:class:`~purchasing.data.contracts.ContractBase`
         tsv_contract_description: `TSVECTOR`_ of the contract description
-        company_name: Name of the company providing services from the
-            :py:class:`~purchasing.data.companies.Company` model
-        tsv_company_name: `TSVECTOR`_ of the company name
-        detail_key: :py:class:`~purchasing.data.contracts.ContractProperty` key
-        detail_value: :py:class:`~purchasing.data.contracts.ContractProperty` value
-        tsv_detail_value: `TSVECTOR`_ of the detail_value
-        line_item_description: Description of a line item from the
-            :py:class:`~purchasing.data.contracts.LineItem` model
-        tsv_line_item_description: `TSVECTOR`_ of the line item description
+        company_ids: Array of the IDs of all of the contract's
+            :py:class:`~purchasing.data.companies.Company` objects
+        company_names: Array of the names of those companies, in the
+            same order as ``company_ids``
+        tsv_company_name: `TSVECTOR`_ of all of the company names
+        tsv_detail_value: `TSVECTOR`_ of all of the contract's
+            :py:class:`~purchasing.data.contracts.ContractProperty` values
+        tsv_line_item_description: `TSVECTOR`_ of all of the contract's
+            :py:class:`~purchasing.data.contracts.LineItem` descriptions
+        tsv_document: Weighted `TSVECTOR`_ of all of the searchable text,
+            used to rank results. Company names and contract descriptions
+            are weighted highest, then line items, then contract details
 
     '''
-    __tablename__ = 'search_view'
+    __tablename__ = 'search_index'
+    __table_args__ = (
+        db.Index('ix_search_index_company_ids', 'company_ids', postgresql_using='gin'),
+        db.Index('ix_search_index_tsv_contract_description', 'tsv_contract_description', postgresql_using='gin'),
+        db.Index('ix_search_index_tsv_company_name', 'tsv_company_name', postgresql_using='gin'),
+        db.Index('ix_search_index_tsv_detail_value', 'tsv_detail_value', postgresql_using='gin'),
+        db.Index('ix_search_index_tsv_line_item_description', 'tsv_line_item_description', postgresql_using='gin'),
+        db.Index('ix_search_index_tsv_document', 'tsv_document', postgresql_using='gin'),
+    )
 
-    id = Column(db.Text, primary_key=True, index=True)
-    contract_id = Column(db.Integer)
-    company_id = Column(db.Integer)
+    contract_id = Column(db.Integer, primary_key=True)
     financial_id = Column(db.String(255))
     expiration_date = Column(db.Date)
     contract_description = Column(db.Text)
     tsv_contract_description = Column(TSVECTOR)
-    company_name = Column(db.Text)
+    company_ids = Column(ARRAY(db.Integer))
+    company_names = Column(ARRAY(db.Text))
     tsv_company_name = Column(TSVECTOR)
-    detail_key = Column(db.Text)
-    detail_value = Column(db.Text)
     tsv_detail_value = Column(TSVECTOR)
-    line_item_description = Column(db.Text)
     tsv_line_item_description = Column(TSVECTOR)
+    tsv_document = Column(TSVECTOR)
+
+class SearchSuggestion(db.Model):
+    '''Short pieces of text to suggest while someone types a search
+
+    Suggestions are built from the search index alongside it, one row
+    per contract description, company name, and controller number. They
+    are matched by prefix with the ``simple`` text search configuration,
+    so that partial words aren't stemmed away.
+
+    Attributes:
+        id: Primary key unique ID
+        contract_id: ID of the :py:class:`~purchasing.data.contracts.ContractBase`
+            the suggestion came from
+        kind: What the suggestion is: one of "company", "contract",
+            or "financial_id"
+        value: Text of the suggestion
+        tsv_value: `TSVECTOR`_ of the value, for prefix matching
+    '''
+    __tablename__ = 'search_suggestion'
+    __table_args__ = (
+        db.Index('ix_search_suggestion_tsv_value', 'tsv_value', postgresql_using='gin'),
+    )
+
+    id = Column(db.Integer, primary_key=True)
+    contract_id = Column(db.Integer, index=True)
+    kind = Column(db.String(255))
+    value = Column(db.Text)
+    tsv_value = Column(TSVECTOR)
+
+class SearchIndexQueue(db.Model):
+    '''Queue of changes that still need to make it into the search index
+
+    Rows are written in the same transaction as the change that caused
+    them, so a change is never lost between being committed and being
+    picked up by a refresh.
+
+    Attributes:
+        id: Primary key unique ID
+        contract_id: ID of a :py:class:`~purchasing.data.contracts.ContractBase`
+            that needs to be reindexed
+        company_id: ID of a :py:class:`~purchasing.data.companies.Company`
+            whose contracts need to be reindexed
+        queued_at: When the change was made
+    '''
+    __tablename__ = 'search_index_queue'
+
+    id = Column(db.Integer, primary_key=True)
+    contract_id = Column(db.Integer)
+    company_id = Column(db.Integer)
+    queued_at = Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+class SearchIndexRefresh(db.Model):
+    '''Log of search index refreshes
+
+    Attributes:
+        id: Primary key unique ID
+        started_at: When the refresh started
+        finished_at: When the refresh finished
+        duration: Number of seconds the refresh took
+        lag: Number of seconds between the oldest change picked
+            up by the refresh and that change becoming searchable
+        changes: Number of queued changes picked up by the refresh
+        contracts: Number of contracts that were reindexed
+    '''
+    __tablename__ = 'search_index_refresh'
+
+    id = Column(db.Integer, primary_key=True)
+    started_at = Column(db.DateTime, nullable=False)
+    finished_at = Column(db.DateTime, nullable=False, index=True)
+    duration = Column(db.Float)
+    lag = Column(db.Float)
+    changes = Column(db.Integer)
+    contracts = Column(db.Integer)
+
+SEARCH_INDEX_INSERT = '''
+    INSERT INTO search_index (
+        contract_id, financial_id, expiration_date,
+        contract_description, tsv_contract_description,
+        company_ids, company_names, tsv_company_name,
+        tsv_detail_value, tsv_line_item_description,
+        tsv_document
+    )
+'''
+
+# each contract's children are aggregated in their own lateral subquery,
+# so that they are never joined against each other
+SEARCH_INDEX_ROWS = '''
+    SELECT
+        c.id AS contract_id,
+        c.financial_id, c.expiration_date,
+        c.description AS contract_description,
+        to_tsvector(c.description) AS tsv_contract_description,
+        coalesce(companies.ids, '{}') AS company_ids,
+        coalesce(companies.names, '{}') AS company_names,
+        to_tsvector(array_to_string(companies.names, ' ')) AS tsv_company_name,
+        to_tsvector(properties.value) AS tsv_detail_value,
+        to_tsvector(line_items.description) AS tsv_line_item_description,
+        setweight(to_tsvector(coalesce(array_to_string(companies.names, ' '), '')), 'A') ||
+        setweight(to_tsvector(coalesce(c.description, '')), 'A') ||
+        setweight(to_tsvector(coalesce(properties.value, '')), 'D') ||
+        setweight(to_tsvector(coalesce(line_items.description, '')), 'B') AS tsv_document
+    FROM contract c
+    LEFT JOIN LATERAL (
+        SELECT
+            array_agg(company.id ORDER BY company.id) AS ids,
+            array_agg(company.company_name ORDER BY company.id) AS names
+        FROM company
+        WHERE company.id IN (
+            SELECT company_id FROM company_contract_association
+            WHERE company_contract_association.contract_id = c.id
+        )
+    ) companies ON true
+    LEFT JOIN LATERAL (
+        SELECT string_agg(contract_property.value, ' ') AS value
+        FROM contract_property WHERE contract_property.contract_id = c.id
+    ) properties ON true
+    LEFT JOIN LATERAL (
+        SELECT string_agg(line_item.description, ' ') AS description
+        FROM line_item WHERE line_item.contract_id = c.id
+    ) line_items ON true
+'''
+
+SEARCH_SUGGESTION_ROWS = '''
+    INSERT INTO search_suggestion (contract_id, kind, value, tsv_value)
+    SELECT contract_id, kind, value, to_tsvector('simple', value) FROM (
+        SELECT contract_id, 'contract' AS kind, contract_description AS value FROM search_index
+        UNION ALL
+        SELECT contract_id, 'company', unnest(company_names) FROM search_index
+        UNION ALL
+        SELECT contract_id, 'financial_id', financial_id FROM search_index
+    ) suggestions
+    WHERE coalesce(value, '') != ''
+'''
+
+def contracts_for_companies(session, company_ids):
+    '''Find the contracts whose search index rows mention any of some companies
+
+    This looks both at the current company/contract associations and at
+    the rows already in the index, so that contracts which have just lost
+    a company are reindexed as well.
+
+    Arguments:
+        session: Sqlalchemy session or connection to execute with
+        company_ids: List of :py:class:`~purchasing.data.companies.Company` ids
+
+    Returns:
+        List of :py:class:`~purchasing.data.contracts.ContractBase` ids
+    '''
+    if not company_ids:
+        return []
+
+    return [row[0] for row in session.execute(db.text('''
+        SELECT contract_id FROM company_contract_association
+        WHERE company_id = ANY(:company_ids) AND contract_id IS NOT NULL
+        UNION
+        SELECT contract_id FROM search_index
+        WHERE company_ids && CAST(:company_ids AS INTEGER[])
+    '''), {'company_ids': list(company_ids)})]
+
+def reindex_contracts(session, contract_ids, company_ids=None):
+    '''Replace the search index and suggestion rows for a set of contracts
+
+    Only the rows of the passed contracts (and the contracts
+    attached to the passed companies) are touched, so the cost of a
+    reindex grows with the size of the changed contracts rather than
+    with the size of the whole index. Contracts that no longer exist
+    simply have their rows removed.
+
+    Arguments:
+        session: Sqlalchemy session or connection to execute with
+        contract_ids: List of :py:class:`~purchasing.data.contracts.ContractBase` ids
+
+    Keyword Arguments:
+        company_ids: List of :py:class:`~purchasing.data.companies.Company`
+            ids whose contracts should also be reindexed
+
+    Returns:
+        The list of contract ids that were reindexed
+    '''
+    contract_ids = sorted(
+        set(contract_ids or []) | set(contracts_for_companies(session, company_ids))
+    )
+
+    if len(contract_ids) == 0:
+        return contract_ids
+
+    session.execute(db.text('''
+        DELETE FROM search_index WHERE contract_id = ANY(:contract_ids)
+    '''), {'contract_ids': contract_ids})
+    session.execute(db.text('''
+        DELETE FROM search_suggestion WHERE contract_id = ANY(:contract_ids)
+    '''), {'contract_ids': contract_ids})
+    session.execute(db.text(
+        SEARCH_INDEX_INSERT + SEARCH_INDEX_ROWS +
+        'WHERE c.id = ANY(:contract_ids)'
+    ), {'contract_ids': contract_ids})
+    session.execute(db.text(
+        SEARCH_SUGGESTION_ROWS + 'AND contract_id = ANY(:contract_ids)'
+    ), {'contract_ids': contract_ids})
+
+    return contract_ids
+
+def rebuild_search_index(session):
+    '''Rebuild the entire search index from scratch
+
+    This is used to backfill the index (and its
+    :py:class:`SearchSuggestion` rows) and after bulk imports that
+    run with the Sqlalchemy events turned off. Rows are deleted rather
+    than truncated so that searches running alongside the rebuild keep
+    seeing the old index until the new one is committed.
+
+    Arguments:
+        session: Sqlalchemy session or connection to execute with
+    '''
+    session.execute(db.text('DELETE FROM search_index'))
+    session.execute(db.text(SEARCH_INDEX_INSERT + SEARCH_INDEX_ROWS))
+    session.execute(db.text('DELETE FROM search_suggestion'))
+    session.execute(db.text(SEARCH_SUGGESTION_ROWS))
+
+# key for the postgres advisory lock that makes sure only one
+# refresh of the search index runs at a time
+SEARCH_INDEX_LOCK = 9170631
+
+def has_queued_changes(session):
+    '''Check whether there are changes waiting to be indexed
+
+    Arguments:
+        session: Sqlalchemy session to execute with
+
+    Returns:
+        True if the :py:class:`SearchIndexQueue` has any rows, False otherwise
+    '''
+    return session.query(session.query(SearchIndexQueue).exists()).scalar()
+
+def refresh_queued_changes(session, min_interval=0):
+    '''Apply all queued changes to the search index
+
+    At most one refresh can run at a time: a Postgres advisory lock is
+    taken for the length of the transaction, and callers that can't get
+    it back off, leaving the queue to the refresh that holds it. Refreshes
+    are also spaced out by at least ``min_interval`` seconds, so that a
+    burst of edits is applied all at once.
+
+    All the queued changes are claimed, deduplicated, and reindexed with
+    :py:func:`reindex_contracts`. Changes that are queued while this runs
+    are left in the queue for the next refresh. The lock is released when
+    the session's transaction ends, so the caller should commit and then
+    check :py:func:`has_queued_changes` to see if a follow-up is needed.
+
+    Arguments:
+        session: Sqlalchemy session to execute with
+
+    Keyword Arguments:
+        min_interval: Minimum number of seconds between two refreshes
+
+    Returns:
+        Two-tuple of the new :py:class:`SearchIndexRefresh` (or None if no
+        refresh was run) and the number of seconds to wait before trying
+        again (or None if there is no need to try again)
+    '''
+    if not has_queued_changes(session):
+        return None, None
+
+    if not session.execute(
+        db.select([db.func.pg_try_advisory_xact_lock(SEARCH_INDEX_LOCK)])
+    ).scalar():
+        # another refresh is running, and it will pick up our changes
+        return None, None
+
+    now = datetime.datetime.utcnow()
+    last_refresh = session.query(db.func.max(SearchIndexRefresh.finished_at)).scalar()
+    if last_refresh and min_interval:
+        wait = min_interval - (now - last_refresh).total_seconds()
+        if wait > 0:
+            return None, wait
+
+    claimed = session.execute(db.text('''
+        DELETE FROM search_index_queue
+        RETURNING contract_id, company_id, queued_at
+    ''')).fetchall()
+
+    if len(claimed) == 0:
+        return None, None
+
+    contract_ids = reindex_contracts(
+        session,
+        set(i.contract_id for i in claimed if i.contract_id is not None),
+        set(i.company_id for i in claimed if i.company_id is not None)
+    )
+
+    finished = datetime.datetime.utcnow()
+    refresh = SearchIndexRefresh(
+        started_at=now, finished_at=finished,
+        duration=(finished - now).total_seconds(),
+        lag=(finished - min(i.queued_at for i in claimed)).total_seconds(),
+        changes=len(claimed), contracts=len(contract_ids)
+    )
+    session.add(refresh)
+
+    return refresh, None
+
+SEARCH_GENERATION = 'search-generation'
+
+def search_generation():
+    '''Get the current search generation
+
+    The generation changes every time the search index is refreshed, so
+    it can be made part of a cache key to throw away cached search results
+    as soon as they might be stale. If the generation has been lost from
+    the cache, it is restarted from the current time so that it can never
+    go back to a value that was already used.
+
+    Returns:
+        Integer search generation
+    '''
+    generation = cache.get(SEARCH_GENERATION)
+    if generation is None:
+        cache.add(SEARCH_GENERATION, int(time.time() * 1000), timeout=0)
+        generation = cache.get(SEARCH_GENERATION)
+    return generation
+
+def bump_search_generation():
+    '''Move to a new search generation after the search index changes
+    '''
+    search_generation()
+    cache.inc(SEARCH_GENERATION)
@@ -5,12 +5,10 @@ utilities.
 import datetime
 
 import sqlalchemy
-
-from purchasing.extensions import cache
 from flask_security import current_user
 
 from sqlalchemy.sql.functions import GenericFunction
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, Session
 
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
@@ -137,29 +135,66 @@ def before_update(mapper, connection, instance):
         instance.updated_by_id = current_user.id if hasattr(current_user, 'id') and not current_user.is_anonymous else None
 
 
+SEARCH_INDEX_QUEUED = 'search_index_queued'
+
 def refresh_search_view(mapper, connection, target):
+    '''Queue the search index rows affected by a change for a refresh
+
+    The affected contract and company ids are written to the
+    :py:class:`~purchasing.data.searches.SearchIndexQueue` as part of the
+    same transaction as the change itself. Once the session commits, a
+    refresh is scheduled to apply them (see
+    :py:func:`~purchasing.data.searches.refresh_queued_changes`).
+    '''
+    from purchasing.data.searches import SearchIndexQueue
+
+    session = db.session.object_session(target)
     # only fire the trigger if the object itself was actually modified
-    if db.session.object_session(target).is_modified(target, include_collections=False):
-        if cache.get('refresh-lock') is None:
-            cache.set('refresh-lock', True)
-            from purchasing.tasks import rebuild_search_view
-            rebuild_search_view.delay()
-        else:
-            return
+    if target in session.deleted or \
+        session.is_modified(target, include_collections=False) or \
+            any(
+                sqlalchemy.orm.attributes.get_history(target, collection).has_changes()
+                for collection in target.search_index_collections
+            ):
+        contract_ids, company_ids = target.search_index_keys()
+        queued = [
+            {'contract_id': i, 'company_id': None} for i in contract_ids if i is not None
+        ] + [
+            {'contract_id': None, 'company_id': i} for i in company_ids if i is not None
+        ]
+        if len(queued) > 0:
+            connection.execute(SearchIndexQueue.__table__.insert(), queued)
+            session.info[SEARCH_INDEX_QUEUED] = True
+
+@sqlalchemy.event.listens_for(Session, 'after_commit')
+def schedule_search_index_refresh(session):
+    if session.info.pop(SEARCH_INDEX_QUEUED, False):
+        from purchasing.tasks import refresh_search_index
+        refresh_search_index.delay()
+
+@sqlalchemy.event.listens_for(Session, 'after_rollback')
+def clear_search_index_queued(session):
+    session.info.pop(SEARCH_INDEX_QUEUED, None)
 
 class RefreshSearchViewMixin(object):
-    '''Mixin to trigger a search view refresh.
+    '''Mixin to trigger a search index update.
 
     Concretely, any Model that subclasses this mixin will trigger a
-    refresh of the search view after any additions, modifications, or
-    deletions.
+    reindex of the search index rows it contributes to after any additions,
+    modifications, or deletions.
 
     Any model that subclasses this mixin will have two new classmethods
     attached: an ``event_handler`` method, which handles what should
     happen when the events are fired by SQLAlchemy, and a ``__declare_last__``
     method, which allows the events to be attached to the models after all
     the SQLAlchemy mappers are declared. In this case, our ``event_handler``
-    is used to trigger a referesh on our materialized search view.
+    is used to record which contracts need to be reindexed.
+
+    Models tell the event handler which parts of the index they touch by
+    overriding ``search_index_keys``. Relationship collections that feed
+    the index (for example, the companies attached to a contract) are listed
+    in ``search_index_collections`` so that changes to them count as
+    modifications.
 
     See Also:
         For a brief discussion on using Model mixins to create event listeners,
@@ -169,11 +204,20 @@ class RefreshSearchViewMixin(object):
         For detailed discussion of the implementation, please read `this blog post
         <http://bensmithgall.com/blog/full-text-search-sqlalchemy-part-ii/>`_
 
-        The search view is primarily used by Scout. For more, see:
+        The search index is primarily used by Scout. For more, see:
 
-        * :py:mod:`purchasing.data.searches` for more on the search query
+        * :py:mod:`purchasing.data.searches` for more on the search index
         * :py:class:`~purchasing.scout.forms.SearchForm` for the search form construction
     '''
+    search_index_collections = ()
+
+    def search_index_keys(self):
+        '''Returns the ids of the search index rows this object feeds
+
+        Returns:
+            Two-tuple of (list of contract ids, list of company ids)
+        '''
+        return [], []
 
     @classmethod
     def event_handler(cls, *args, **kwargs):
@@ -26,6 +26,9 @@ s3 = FlaskS3()
 from flask_mail import Mail
 mail = Mail()
 
+from purchasing.instrumentation import SQLInstrumentation
+sql_instrumentation = SQLInstrumentation()
+
 from flask_admin import Admin, AdminIndexView, expose
 class PermissionsBase(ConductorAuthMixin, AdminIndexView):
     @expose('/')
@@ -36,9 +36,18 @@ def flash_errors(form, category="warning"):
 def format_currency(value):
     return "${:,.2f}".format(value)
 
-def url_for_other_page(page):
+def url_for_other_page(page, cursor=None):
+    '''Build a link to another page of the current view
+
+    If a keyset ``cursor`` is passed, it is carried along with the
+    page number. Otherwise any cursor on the current request is dropped
+    so that the page is fetched by offset.
+    '''
     args = dict(request.view_args.items() + request.args.to_dict().items())
     args['page'] = page
+    args.pop('cursor', None)
+    if cursor:
+        args['cursor'] = cursor
     return url_for(request.endpoint, **args)
 
 def thispage():
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+'''Per-request SQL instrumentation
+
+When ``SQL_INSTRUMENTATION`` is turned on, every statement run while
+handling a request is counted and timed. When the request finishes, a
+one-line summary is written to the app logger, and the numbers are folded
+into running per-endpoint aggregates.
+
+When ``SLOW_QUERY_THRESHOLD`` is set, statements from the views in
+``SLOW_QUERY_BLUEPRINTS`` that run longer than the threshold are written,
+along with their query plans, to a rotating JSON lines file.
+
+When both are turned off, no listeners are registered at all.
+'''
+
+import os
+import sys
+import time
+import json
+import datetime
+import logging
+import logging.handlers
+import threading
+from collections import Counter
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+HERE = os.path.dirname(os.path.abspath(__file__)) + os.sep
+THIS_FILE = os.path.splitext(os.path.abspath(__file__))[0]
+
+def call_site():
+    '''Find the line of app code that caused a statement to be run
+
+    Walks up the stack to the first frame that belongs to the purchasing
+    package (including compiled templates), skipping over sqlalchemy,
+    flask and anything else in between.
+
+    Returns:
+        A ``path:line`` string relative to the purchasing package, or
+        None if no app code is on the stack
+    '''
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if filename.startswith(HERE) and os.path.splitext(filename)[0] != THIS_FILE:
+            return '{}:{}'.format(os.path.relpath(filename, HERE), frame.f_lineno)
+        frame = frame.f_back
+    return None
+
+class RequestQueries(object):
+    '''The statements run while handling a single request
+
+    Attributes:
+        count: Number of statements run
+        duration: Total seconds spent waiting on the database
+        calls: Counter of (statement, call site) two-tuples
+    '''
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.calls = Counter()
+
+    def record(self, statement, site, duration):
+        self.count += 1
+        self.duration += duration
+        self.calls[(statement, site)] += 1
+
+    def repeated(self, threshold):
+        '''Find statements that look like an N+1 pattern
+
+        Arguments:
+            threshold: Number of times the same statement has to be run
+                from the same call site before it is flagged
+
+        Returns:
+            List of (call site, number of times run, statement) three-tuples,
+            most repeated first
+        '''
+        return sorted([
+            (site, count, statement) for (statement, site), count
+            in self.calls.items() if count >= threshold
+        ], key=lambda i: -i[1])
+
+class EndpointStats(object):
+    '''Running query aggregates for one endpoint
+
+    Attributes:
+        requests: Number of requests handled
+        statements: Total number of statements run
+        max_statements: Most statements run by a single request
+        duration: Total seconds spent waiting on the database
+        n_plus_one: Number of requests that had a repeated statement
+        call_sites: Counter of call sites flagged as N+1 patterns
+    '''
+    def __init__(self):
+        self.requests = 0
+        self.statements = 0
+        self.max_statements = 0
+        self.duration = 0.0
+        self.n_plus_one = 0
+        self.call_sites = Counter()
+
+    def add(self, queries, repeated):
+        self.requests += 1
+        self.statements += queries.count
+        self.max_statements = max(self.max_statements, queries.count)
+        self.duration += queries.duration
+        if repeated:
+            self.n_plus_one += 1
+            self.call_sites.update(site for site, _, _ in repeated)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'statements': self.statements,
+            'avg_statements': round(float(self.statements) / self.requests, 2),
+            'max_statements': self.max_statements,
+            'db_ms': round(self.duration * 1000, 2),
+            'avg_db_ms': round(self.duration * 1000 / self.requests, 2),
+            'n_plus_one_requests': self.n_plus_one,
+            'n_plus_one_call_sites': dict(self.call_sites),
+        }
+
+class SlowQueryLog(object):
+    '''Rotating JSON lines file of slow statements and their query plans
+
+    Arguments:
+        path: Path to the file to write to
+        threshold: Number of seconds a statement has to run for to be logged
+        max_bytes: Size the file can grow to before it is rotated
+        backup_count: Number of rotated files to keep around
+    '''
+    def __init__(self, path, threshold, max_bytes, backup_count):
+        self.threshold = threshold
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self.logger = logging.getLogger('purchasing.slow_queries.' + path)
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(
+                path, 'a', max_bytes, backup_count
+            )
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+
+    def explain(self, cursor, statement, parameters):
+        '''Get the query plan for a statement without running it again
+
+        The plan is fetched on the same connection (and so in the same
+        transaction) as the statement, inside of a savepoint so that a
+        failure doesn't abort the request's transaction.
+
+        Returns:
+            The text of the query plan
+        '''
+        explain = cursor.connection.cursor()
+        try:
+            explain.execute('SAVEPOINT slow_query_explain')
+            try:
+                explain.execute('EXPLAIN (ANALYZE off) ' + statement, parameters)
+                plan = '\n'.join(row[0] for row in explain.fetchall())
+                explain.execute('RELEASE SAVEPOINT slow_query_explain')
+            except Exception, e:
+                explain.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                plan = 'Could not explain statement: {}'.format(e)
+        finally:
+            explain.close()
+        return plan
+
+    def record(self, cursor, statement, parameters, duration, endpoint):
+        '''Write a slow statement to the log
+
+        Arguments:
+            cursor: DBAPI cursor the statement ran on
+            statement: The SQL that was run
+            parameters: The statement's bound parameters
+            duration: Number of seconds the statement ran for
+            endpoint: Name of the endpoint that ran the statement
+        '''
+        if statement.lstrip().split(None, 1)[0].upper() in EXPLAINABLE:
+            plan = self.explain(cursor, statement, parameters)
+        else:
+            plan = None
+
+        self.logger.info(json.dumps({
+            'logged_at': datetime.datetime.utcnow().isoformat(),
+            'endpoint': endpoint,
+            'duration_ms': round(duration * 1000, 2),
+            'statement': statement,
+            'parameters': parameters,
+            'plan': plan,
+        }, default=unicode))
+
+# statements that postgres can produce a plan for
+EXPLAINABLE = set(['SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'VALUES'])
+
+def _watching():
+    return has_request_context() and (
+        getattr(g, '_sql_queries', None) is not None or
+        getattr(g, '_slow_queries', None) is not None
+    )
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _watching():
+        conn.info.setdefault('instrumentation_start', []).append(time.time())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not _watching():
+        return
+
+    started = conn.info.get('instrumentation_start')
+    if not started:
+        return
+    duration = time.time() - started.pop()
+
+    queries = getattr(g, '_sql_queries', None)
+    if queries is not None:
+        queries.record(statement, call_site(), duration)
+
+    slow_queries = getattr(g, '_slow_queries', None)
+    if slow_queries is not None and not executemany and duration >= slow_queries.threshold:
+        slow_queries.record(cursor, statement, parameters, duration, request.endpoint)
+
+class SQLInstrumentation(object):
+    '''Flask extension that counts and times the statements run per request,
+    and logs the slow ones
+
+    Aggregates are kept per process, so with several workers each one
+    reports on the requests it has handled.
+    '''
+    def __init__(self, app=None):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        instrument = app.config.get('SQL_INSTRUMENTATION')
+        slow_query_threshold = app.config.get('SLOW_QUERY_THRESHOLD')
+        if not instrument and slow_query_threshold is None:
+            return
+
+        # listeners are per process rather than per app, so only attach them once
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+        if instrument:
+            threshold = app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 5)
+
+            @app.before_request
+            def start_counting():
+                g._sql_queries = RequestQueries()
+
+            @app.teardown_request
+            def report_queries(exc=None):
+                queries = getattr(g, '_sql_queries', None)
+                if queries is None:
+                    return
+                g._sql_queries = None
+                self.report(app, request.endpoint or request.path, queries, threshold)
+
+        if slow_query_threshold is not None:
+            slow_query_log = SlowQueryLog(
+                app.config['SLOW_QUERY_LOG'], slow_query_threshold / 1000.0,
+                app.config.get('SLOW_QUERY_LOG_BYTES', 10000000),
+                app.config.get('SLOW_QUERY_LOG_BACKUPS', 10)
+            )
+            blueprints = app.config.get('SLOW_QUERY_BLUEPRINTS', [])
+
+            @app.before_request
+            def start_watching():
+                # conductor_metrics, opportunities_admin, etc. count as
+                # part of the conductor and opportunities views
+                if request.blueprint and request.blueprint.split('_')[0] in blueprints:
+                    g._slow_queries = slow_query_log
+
+            @app.teardown_request
+            def stop_watching(exc=None):
+                g._slow_queries = None
+
+    def report(self, app, endpoint, queries, threshold):
+        '''Log a request's summary line and add it to the endpoint's aggregates
+
+        Arguments:
+            app: The current Flask app
+            endpoint: Name of the endpoint that handled the request
+            queries: :py:class:`RequestQueries` for the request
+            threshold: Number of identical statements from one call site
+                that gets flagged as an N+1 pattern
+        '''
+        repeated = queries.repeated(threshold)
+
+        with self.lock:
+            self.endpoints.setdefault(endpoint, EndpointStats()).add(queries, repeated)
+
+        message = 'SQLSTATS - {endpoint}: {count} statements, {ms:.1f}ms'.format(
+            endpoint=endpoint, count=queries.count, ms=queries.duration * 1000
+        )
+        if repeated:
+            app.logger.warning(message + ' | possible N+1: ' + ', '.join(
+                '{}x {}'.format(count, site) for site, count, _ in repeated
+            ))
+        else:
+            app.logger.info(message)
+
+    def summary(self):
+        '''Running aggregates for every endpoint seen so far
+
+        Returns:
+            Dictionary of endpoint name to that endpoint's aggregates
+        '''
+        with self.lock:
+            return dict(
+                (endpoint, stats.as_dict()) for endpoint, stats in self.endpoints.items()
+            )
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
@@ -8,3 +8,4 @@ from scout_nightly import (
 from beacon_nightly import (
     BeaconNewOppotunityOpenJob, BeaconBiweeklyDigestJob
 )
+from conductor_nightly import ConductorMetricsSnapshotJob
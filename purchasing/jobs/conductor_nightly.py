@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from purchasing.database import db
+from purchasing.jobs.job_base import JobBase
+
+from purchasing.data.flows import Flow
+from purchasing.data.flow_metrics import snapshot_flow_metrics
+
+@JobBase.register
+class ConductorMetricsSnapshotJob(JobBase):
+    '''Nightly job to snapshot the metrics for every conductor flow
+
+    See Also:
+        * :py:func:`purchasing.data.flow_metrics.snapshot_flow_metrics`
+        * :py:func:`purchasing.data.flow_metrics.current_flow_metrics`
+    '''
+    @property
+    def start_time(self):
+        '''Override default start time, snapshot as soon as the job is scheduled
+        '''
+        return None
+
+    def run_job(self, job):
+        '''Snapshot each flow's metrics and update their weekly throughput
+
+        Arguments:
+            job: :py:class:`~purchasing.jobs.job_base.JobStatus` object
+        '''
+        if job:
+            job.update(status='started')
+            try:
+                for flow in Flow.query.all():
+                    snapshot_flow_metrics(flow)
+                db.session.commit()
+                job.update(status='success')
+            except Exception, e:
+                db.session.rollback()
+                job.update(status='failed', info=str(e))
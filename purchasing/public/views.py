@@ -9,7 +9,9 @@ import json
 from flask import (
     render_template, jsonify, current_app, send_from_directory, request
 )
-from purchasing.extensions import cache
+from flask_security.decorators import roles_accepted
+
+from purchasing.extensions import cache, sql_instrumentation
 from purchasing.users.models import User
 from purchasing.public.models import AppStatus
 
@@ -80,3 +82,19 @@ def status():
 
     response['updated'] = int(time.time())
     return jsonify(response)
+
+@blueprint.route('/_status/sql')
+@roles_accepted('admin', 'superadmin')
+def sql_status():
+    '''Reports running query aggregates for each endpoint
+
+    Only has numbers when ``SQL_INSTRUMENTATION`` is turned on. The
+    aggregates cover the requests handled by this process.
+
+    :status 200: JSON of endpoint name to that endpoint's query aggregates
+    :status 302: Redirect to login if the user isn't an admin
+    '''
+    return jsonify({
+        'enabled': bool(current_app.config.get('SQL_INSTRUMENTATION')),
+        'endpoints': sql_instrumentation.summary()
+    })
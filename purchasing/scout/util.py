@@ -1,19 +1,29 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import hashlib
 
 from flask import current_app, flash, redirect, url_for, render_template
-from purchasing.extensions import db
+from sqlalchemy.orm import joinedload, subqueryload
+from sqlalchemy.util import KeyedTuple
+from purchasing.extensions import db, cache
 
 from purchasing.notifications import Notification
+from purchasing.utils import paginate_query, SimplePagination
 
 from purchasing.scout.forms import FeedbackForm, SearchForm
 from purchasing.users.models import Department, User, Role
-from purchasing.data.contracts import ContractBase
-from purchasing.data.searches import SearchView
+from purchasing.data.companies import Company
+from purchasing.data.contracts import ContractBase, ContractType
+from purchasing.data.searches import SearchView, SearchSuggestion, search_generation
 
 from flask_security import current_user
 
+# (column label, descending) pairs that uniquely order search results,
+# used to page through results by keyset
+SEARCH_KEYSET = [('rank', True), ('contract_id', False)]
+ALL_CONTRACTS_KEYSET = [('contract_id', False)]
+
 # build filter and filter form
 FILTER_FIELDS = [
     ('company_name', 'Company Name', SearchView.tsv_company_name),
@@ -23,6 +33,25 @@ FILTER_FIELDS = [
     ('financial_id', 'Controller Number', SearchView.financial_id),
 ]
 
+# fields that are all part of the precomputed search document, and so
+# can be matched with a single lookup when searching across everything
+DOCUMENT_FIELDS = ['company_name', 'line_item', 'contract_description', 'contract_detail']
+
+# named eager loading profiles for the scout profile pages. Each one loads
+# everything its template walks, so the number of queries a page runs
+# doesn't grow with the number of followers, companies or contracts.
+# (line items and contacts are dynamic relationships, and are always
+# fetched with a fixed number of queries of their own)
+CONTRACT_PAGE_LOADERS = [
+    joinedload(ContractBase.contract_type),
+    subqueryload('companies'),
+    subqueryload(ContractBase.followers).joinedload(User.department),
+]
+COMPANY_PAGE_LOADERS = [
+    # the template only needs each contract's id and description
+    subqueryload(Company.contracts).lazyload('*'),
+]
+
 def build_filter(req_args, fields, search_for, filter_form, _all):
     '''Build the non-exclusive filter conditions for scout search
 
@@ -30,6 +59,11 @@ def build_filter(req_args, fields, search_for, filter_form, _all):
     the passed in ``filter_form``, setting the *checked* property on the appropriate
     form fields.
 
+    When searching across all fields, the fields in ``DOCUMENT_FIELDS`` are
+    matched against the single precomputed search document instead of one
+    at a time. Because search terms are joined with ``|``, this matches
+    exactly the same rows as checking each field on its own.
+
     Arguments:
         req_args: request.args from Flask.request
         fields: list of three-tuples. Each three-tuple should contain the following:
@@ -48,7 +82,15 @@ def build_filter(req_args, fields, search_for, filter_form, _all):
         List of clauses that can be used in `Sqlalchemy query filters`_
     '''
     clauses = []
+    if _all:
+        clauses.append(SearchView.tsv_document.match(
+            search_for,
+            postgresql_regconfig='english')
+        )
+
     for arg_name, _, filter_column in fields:
+        if _all and arg_name in DOCUMENT_FIELDS:
+            continue
         if _all or req_args.get(arg_name) == 'y':
             if not _all:
                 filter_form[arg_name].checked = True
@@ -61,6 +103,11 @@ def build_filter(req_args, fields, search_for, filter_form, _all):
 def build_cases(req_args, fields, search_for, _all):
     '''Build case statements for categorizing search matches in scout search
 
+    Each field gets its own bit, based on its position in ``fields``. Summing
+    the case statements gives a bitmask of every field that a search result
+    was found in, which can be turned back into field names with
+    :func:`found_in_labels`.
+
     Arguments:
         req_args: request.args from Flask.request
         fields: list of three-tuples. Each three-tuple should contain the following:
@@ -69,26 +116,131 @@ def build_cases(req_args, fields, search_for, _all):
                 * desired output display name
                 * Model property that maps to the specific column name in question.
 
-            For build_cases, all three parts of the tuple are used
+            For build_cases, the column name and Model property are used
 
         search_for: string search term
         _all: Boolean -- true if we are searching across all fields, false otherwise
 
     Returns:
-        List of clauses that can be used in a
+        List of (clause, bit) two-tuples that can be used in
         `Sqlalchemy case expressions`_
     '''
     clauses = []
-    for arg_name, arg_description, filter_column in fields:
+    for ix, (arg_name, _, filter_column) in enumerate(fields):
         if _all or req_args.get(arg_name) == 'y':
             clauses.append(
                 (filter_column.match(
                     search_for,
                     postgresql_regconfig='english'
-                ) == True, arg_description)
+                ) == True, 1 << ix)
             )
     return clauses
 
+def found_in_labels(found_in, fields=FILTER_FIELDS):
+    '''Turn a found in bitmask back into the names of the matched fields
+
+    Arguments:
+        found_in: bitmask built from the clauses returned by :func:`build_cases`
+
+    Keyword Arguments:
+        fields: The same list of three-tuples passed to :func:`build_cases`
+
+    Returns:
+        List of the display names of the fields that matched
+    '''
+    return [
+        arg_description for ix, (_, arg_description, _) in enumerate(fields)
+        if (found_in or 0) & (1 << ix)
+    ]
+
+def search_cache_key(search_for, req_args, page, per_page, cursor):
+    '''Build the cache key for one page of scout search results
+
+    The key is made from the normalized search term, the checked filter
+    fields, the contract type, whether archived contracts are included,
+    and the page being requested. The current search generation and today's
+    date are folded in as well, so that refreshing the search index or
+    contracts expiring overnight moves every search to a fresh key.
+
+    Arguments:
+        search_for: Normalized search term
+        req_args: request.args from Flask.request
+        page: One-indexed page of results
+        per_page: Number of results per page
+        cursor: Keyset cursor from a previous page, or None
+
+    Returns:
+        String cache key
+    '''
+    key = u'|'.join(unicode(part) for part in [
+        search_for,
+        ','.join(sorted(name for name, _, _ in FILTER_FIELDS if req_args.get(name) == 'y')),
+        req_args.get('contract_type'), req_args.get('archived') == 'y',
+        page, per_page, cursor, datetime.date.today(), search_generation()
+    ])
+    return 'scout-search-{}'.format(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+def cached_search(key, search, *args, **kwargs):
+    '''Run a scout search, or fetch its results from the cache
+
+    Arguments:
+        key: Cache key from :func:`search_cache_key`
+        search: Either :func:`find_contract_metadata` or :func:`return_all_contracts`
+        *args: Passed through to ``search``
+        **kwargs: Passed through to ``search``
+
+    Returns:
+        Three-tuple of (result rows, :py:class:`~purchasing.utils.SimplePagination`,
+        True if the results came from the cache and False otherwise)
+    '''
+    cached = cache.get(key)
+    if cached is not None:
+        labels, values, pagination = cached
+        return [KeyedTuple(row, labels) for row in values], pagination, True
+
+    results, pagination = search(*args, **kwargs)
+    labels = results[0].keys() if len(results) > 0 else []
+    cache.set(
+        key, (labels, [tuple(row) for row in results], pagination),
+        timeout=current_app.config.get('SEARCH_CACHE_TIMEOUT', 60 * 60)
+    )
+    return results, pagination, False
+
+def cached_facets(key, search_for, contract_type=None, archived=False):
+    '''Count search facets, or fetch the counts from the cache
+
+    Arguments:
+        key: Cache key from :func:`search_cache_key`. Facets don't change
+            from page to page, so the key should be built without a page.
+        search_for: Passed through to :func:`find_facets`
+
+    Keyword Arguments:
+        contract_type: Passed through to :func:`find_facets`
+        archived: Passed through to :func:`find_facets`
+
+    Returns:
+        Dictionary of facet counts
+    '''
+    facets = cache.get(key + '-facets')
+    if facets is None:
+        facets = find_facets(search_for, contract_type=contract_type, archived=archived)
+        cache.set(
+            key + '-facets', facets,
+            timeout=current_app.config.get('SEARCH_CACHE_TIMEOUT', 60 * 60)
+        )
+    return facets
+
+def count_search_cache(hit):
+    '''Keep a running count of search cache hits or misses
+
+    Arguments:
+        hit: True if the search was served from the cache
+
+    Returns:
+        The number of hits (or misses, if ``hit`` is False) counted so far
+    '''
+    return cache.inc('scout-search-cache-hits' if hit else 'scout-search-cache-misses')
+
 def feedback_handler(contract, search_for=None):
     '''Allow user to send feedback on the data present in a specific contract
 
@@ -157,54 +309,108 @@ def add_archived_filter(query, archived):
     Returns:
         Original query with additional exclusionary filters and optionally archived contracts
     '''
-    query = query.filter(
-        ContractBase.financial_id != None,
-        ContractBase.expiration_date != None,
-        SearchView.expiration_date != None
+    return query.filter(
+        SearchView.expiration_date != None, *contract_visibility_filters(archived)
     )
 
+def contract_visibility_filters(archived):
+    '''Build the filters that hide contracts from scout
+
+    Arguments:
+        archived: Boolean to determine if archived contracts should be shown
+
+    Returns:
+        List of `Sqlalchemy query filters`_ on
+        :py:class:`~purchasing.data.contracts.ContractBase`
+
+    See Also:
+        :py:func:`add_archived_filter`
+    '''
+    filters = [
+        ContractBase.financial_id != None,
+        ContractBase.expiration_date != None
+    ]
+
     if not archived:
-        query = query.filter(
+        filters.extend([
             ContractBase.is_archived == False,
             ContractBase.expiration_date >= datetime.date.today(),
-        )
+        ])
 
-    return query
+    return filters
 
-def find_contract_metadata(search_for, case_statements, filter_or, filter_and, archived=False):
+def find_contract_metadata(
+    search_for, case_statements, filter_or, filter_and, archived=False,
+    page=1, per_page=50, cursor=None, top_k=None, min_rank=None, and_min_hits=None,
+    search_terms=None
+):
     '''
     Takes a search term, case statements, and filter clauses and
-    returns out a list of search results objects to be rendered into
+    returns out one page of search results objects to be rendered into
     the template.
 
+    By default, every result that matches any of the search terms is
+    ranked and paginated. There are a few options to cut that work down
+    for broad searches:
+
+    * ``top_k`` returns only the best ranked results as a single page,
+      without counting the rest of the match set. Every match is still
+      ranked; this only lets Postgres use a top-N sort for the ``LIMIT``
+      instead of sorting and counting everything. It only applies to the
+      first page, so asking for a later page or passing a cursor falls
+      back to the normal pagination.
+    * ``min_rank`` drops weak matches before they are sorted.
+    * ``and_min_hits`` first looks for results that contain every one of
+      the ``search_terms`` in one of the fields being searched, and only
+      widens the search to results that contain any of them if there are
+      fewer than ``and_min_hits`` of those.
+
     Arguments:
-        search_for: User's search term
-        case_statements: An iterable of `Sqlalchemy case expressions`_
+        search_for: User's search term, with terms joined by ``|``
+        case_statements: An iterable of (clause, bit) two-tuples from
+            :func:`build_cases`, used to build the ``found_in`` bitmask
         filter_or: An iterable of `Sqlalchemy query filters`_, used for non-exclusionary filtering
         filter_and: An iterable of `Sqlalchemy query filters`_, used for exclusionary filtering
         archived: Boolean of whether or not to add the ``is_archived`` filter
+        page: One-indexed page of results to return
+        per_page: Number of results per page
+        cursor: Optional keyset cursor from a previous page's pagination.
+            If it is valid, it takes precedence over ``page``
+        top_k: If passed, return only this many of the best ranked results
+            on the first page
+        min_rank: If passed, leave out results ranked lower than this
+        and_min_hits: If passed, match all of the search terms unless that
+            gives fewer than this many results
+        search_terms: List of the individual terms in ``search_for``, used
+            by ``and_min_hits``
 
     Returns:
-        A Sqlalchemy resultset that contains the fields to render the
-        search results view.
+        A two-tuple of (a Sqlalchemy resultset that contains the fields to
+        render one page of the search results view, a
+        :py:class:`~purchasing.utils.SimplePagination` for the results)
+
+    See Also:
+        :py:func:`~purchasing.utils.paginate_query` for how the page and count
+        are fetched
     '''
 
-    rank = db.func.max(db.func.full_text.ts_rank(
-        db.func.setweight(db.func.coalesce(SearchView.tsv_company_name, ''), 'A').concat(
-            db.func.setweight(db.func.coalesce(SearchView.tsv_contract_description, ''), 'A')
-        ).concat(
-            db.func.setweight(db.func.coalesce(SearchView.tsv_detail_value, ''), 'D')
-        ).concat(
-            db.func.setweight(db.func.coalesce(SearchView.tsv_line_item_description, ''), 'B')
-        ), db.func.to_tsquery(search_for, postgresql_regconfig='english')
-    ))
+    # cast up from a real so that the rank survives the trip through
+    # a pagination cursor without losing precision
+    rank = db.cast(db.func.full_text.ts_rank(
+        SearchView.tsv_document,
+        db.func.to_tsquery(search_for, postgresql_regconfig='english')
+    ), db.Float)
+
+    found_in = sum(
+        [db.case([case_statement], else_=0) for case_statement in case_statements],
+        db.literal(0)
+    )
 
     contracts = db.session.query(
-        db.distinct(SearchView.contract_id).label('contract_id'),
-        SearchView.company_id, SearchView.contract_description,
+        SearchView.contract_id, SearchView.contract_description,
         SearchView.financial_id, SearchView.expiration_date,
-        SearchView.company_name, db.case(case_statements).label('found_in'),
-        rank.label('rank')
+        SearchView.company_ids, SearchView.company_names,
+        found_in.label('found_in'), rank.label('rank')
     ).join(
         ContractBase, ContractBase.id == SearchView.contract_id
     ).filter(
@@ -213,41 +419,198 @@ def find_contract_metadata(search_for, case_statements, filter_or, filter_and, a
             *filter_or
         ),
         *filter_and
-    ).group_by(
-        SearchView.contract_id,
-        SearchView.company_id,
-        SearchView.contract_description,
-        SearchView.financial_id,
-        SearchView.expiration_date,
-        SearchView.company_name,
-        db.case(case_statements)
     ).order_by(
-        db.text('rank DESC')
+        db.text('rank DESC'), db.text('contract_id')
     )
 
     contracts = add_archived_filter(contracts, archived)
 
-    return contracts.all()
+    if min_rank is not None:
+        contracts = contracts.filter(rank >= min_rank)
+
+    if and_min_hits and search_terms and len(search_terms) > 1:
+        # match every term against the same columns that build_filter
+        # picked, so that fields the user left out don't count
+        match_all = contracts.filter(db.or_(*[
+            clause.left.match(' & '.join(search_terms), postgresql_regconfig='english')
+            for clause in filter_or
+        ]))
+        # only look as far as we need to in order to decide
+        hits = db.session.query(
+            match_all.order_by(None).limit(and_min_hits).subquery()
+        ).count()
+        if hits >= and_min_hits:
+            contracts = match_all
+
+    if top_k and page == 1 and cursor is None:
+        results = contracts.limit(top_k).all()
+        return results, SimplePagination(1, top_k, len(results))
+
+    return paginate_query(
+        contracts, page, per_page, keyset=SEARCH_KEYSET, cursor=cursor
+    )
+
+def find_facets(search_for, contract_type=None, archived=False):
+    '''Count how search results break down by filter, in a single query
+
+    All of the counts are made in one aggregate pass over the contracts
+    that match the search in any field, using ``GROUPING SETS`` to get
+    both the overall counts and the counts per contract type. Each count
+    answers "how many results would there be if I changed this filter",
+    so each one respects all of the currently selected filters except
+    its own:
+
+    * ``found_in`` counts how many results match in each of the
+      ``FILTER_FIELDS``, with the current contract type and archived filters
+    * ``contract_type`` counts results per contract type, with the current
+      archived filter
+    * ``active`` and ``archived`` count results that are and aren't
+      archived, with the current contract type filter
+
+    Arguments:
+        search_for: User's search term, with terms joined by ``|``. If it
+            is empty, all contracts are counted and ``found_in`` is left empty
+
+    Keyword Arguments:
+        contract_type: ID of the currently selected
+            :py:class:`~purchasing.data.contracts.ContractType`, or None
+        archived: Whether archived contracts are currently included
+
+    Returns:
+        Dictionary of facet counts
+    '''
+    is_active = db.and_(
+        ContractBase.is_archived == False,
+        ContractBase.expiration_date >= datetime.date.today()
+    )
+
+    columns = [
+        ContractBase.contract_type_id.label('contract_type_id'),
+        ContractType.name.label('contract_type_name'),
+        is_active.label('is_active'),
+    ]
+    if search_for:
+        case_statements = build_cases({}, FILTER_FIELDS, search_for, True)
+        columns.append(sum(
+            [db.case([case_statement], else_=0) for case_statement in case_statements],
+            db.literal(0)
+        ).label('found_in'))
+
+    matches = db.session.query(*columns).join(
+        SearchView, SearchView.contract_id == ContractBase.id
+    ).outerjoin(
+        ContractType, ContractType.id == ContractBase.contract_type_id
+    )
+    if search_for:
+        matches = matches.filter(db.or_(
+            db.cast(SearchView.financial_id, db.String) == search_for,
+            *build_filter({}, FILTER_FIELDS, search_for, None, True)
+        ))
+    matches = add_archived_filter(matches, True).subquery()
+
+    type_ok = db.true() if contract_type is None else \
+        matches.c.contract_type_id == int(contract_type)
+    archived_ok = db.true() if archived else matches.c.is_active
+
+    counts = [
+        db.func.grouping(matches.c.contract_type_id).label('overall'),
+        matches.c.contract_type_id, matches.c.contract_type_name,
+        db.func.count().filter(archived_ok).label('per_type'),
+        db.func.count().filter(db.and_(type_ok, matches.c.is_active)).label('active'),
+        db.func.count().filter(db.and_(type_ok, db.not_(matches.c.is_active))).label('archived'),
+    ]
+    if search_for:
+        counts.extend([
+            db.func.count().filter(db.and_(
+                type_ok, archived_ok, matches.c.found_in.op('&')(1 << ix) > 0
+            )).label(arg_name)
+            for ix, (arg_name, _, _) in enumerate(FILTER_FIELDS)
+        ])
+
+    rows = db.session.query(*counts).group_by(db.text(
+        'GROUPING SETS ((contract_type_id, contract_type_name), ())'
+    )).all()
+
+    facets = {'found_in': {}, 'contract_type': [], 'active': 0, 'archived': 0}
+    for row in rows:
+        if row.overall:
+            facets['active'], facets['archived'] = row.active, row.archived
+            if search_for:
+                facets['found_in'] = dict(
+                    (arg_name, getattr(row, arg_name)) for arg_name, _, _ in FILTER_FIELDS
+                )
+        elif row.per_type > 0:
+            facets['contract_type'].append(
+                (row.contract_type_id, row.contract_type_name, row.per_type)
+            )
+
+    # contracts without a type can't be filtered to, so they go last
+    facets['contract_type'].sort(key=lambda facet: (facet[0] is None, facet[1]))
+    return facets
 
-def return_all_contracts(filter_and, archived=False):
+def find_suggestions(prefix, limit=10):
+    '''Find company names, contract descriptions, and controller numbers by prefix
+
+    Every word of the prefix has to start a word of the suggestion, so
+    "road sa" will suggest "Road Salt". Shorter suggestions are returned
+    first. Only suggestions from contracts that a search would turn up
+    are returned (see :py:func:`contract_visibility_filters`).
+
+    Arguments:
+        prefix: What has been typed so far, stripped of any characters
+            that aren't letters, numbers, or spaces
+
+    Keyword Arguments:
+        limit: Maximum number of suggestions to return
+
+    Returns:
+        List of (kind, value) results
+    '''
+    terms = prefix.lower().split()
+    if len(terms) == 0:
+        return []
+
+    query = db.func.to_tsquery('simple', ' & '.join('{}:*'.format(term) for term in terms))
+
+    return db.session.query(
+        SearchSuggestion.kind, SearchSuggestion.value
+    ).join(
+        ContractBase, ContractBase.id == SearchSuggestion.contract_id
+    ).filter(
+        SearchSuggestion.tsv_value.op('@@')(query),
+        *contract_visibility_filters(False)
+    ).group_by(
+        SearchSuggestion.kind, SearchSuggestion.value
+    ).order_by(
+        db.func.length(SearchSuggestion.value), SearchSuggestion.value
+    ).limit(limit).all()
+
+def return_all_contracts(filter_and, archived=False, page=1, per_page=50, cursor=None):
     '''Return all contracts in the event of an empty search
 
     Arguments:
         filter_and: An iterable of `Sqlalchemy query filters`_, used for exclusionary filtering
         archived: Boolean of whether or not to add the ``is_archived`` filter
+        page: One-indexed page of results to return
+        per_page: Number of results per page
+        cursor: Optional keyset cursor from a previous page's pagination.
+            If it is valid, it takes precedence over ``page``
 
     Returns:
-        A Sqlalchemy resultset that contains the fields to render the
-        search results view.
+        A two-tuple of (a Sqlalchemy resultset that contains the fields to
+        render one page of the search results view, a
+        :py:class:`~purchasing.utils.SimplePagination` for the results)
     '''
     contracts = db.session.query(
-        db.distinct(SearchView.contract_id).label('contract_id'), SearchView.company_id,
-        SearchView.contract_description, SearchView.financial_id,
-        SearchView.expiration_date, SearchView.company_name
+        SearchView.contract_id, SearchView.contract_description,
+        SearchView.financial_id, SearchView.expiration_date,
+        SearchView.company_ids, SearchView.company_names
     ).join(ContractBase, ContractBase.id == SearchView.contract_id).filter(
         *filter_and
-    )
+    ).order_by(db.text('contract_id'))
 
     contracts = add_archived_filter(contracts, archived)
 
-    return contracts.all()
+    return paginate_query(
+        contracts, page, per_page, keyset=ALL_CONTRACTS_KEYSET, cursor=cursor
+    )
@@ -3,29 +3,33 @@
 import re
 
 from flask import (
-    render_template, current_app,
+    render_template, current_app, jsonify,
     request, abort, flash, redirect, url_for
 )
 from flask_security import current_user
 from flask_security.decorators import roles_accepted
 
 from purchasing.database import db
-from purchasing.utils import SimplePagination
+from purchasing.utils import paginate_query
 from purchasing.decorators import wrap_form
 
 from purchasing.scout.forms import SearchForm, NoteForm
 from purchasing.users.models import Department
 from purchasing.data.companies import Company
 from purchasing.data.contracts import ContractBase, ContractNote, ContractType
+from purchasing.data.follows import DepartmentContractFollows
 
 from purchasing.scout.util import (
-    build_filter, build_cases, feedback_handler,
-    find_contract_metadata, return_all_contracts, FILTER_FIELDS
+    build_filter, build_cases, found_in_labels, feedback_handler,
+    find_contract_metadata, return_all_contracts, FILTER_FIELDS,
+    search_cache_key, cached_search, cached_facets, count_search_cache,
+    find_suggestions, CONTRACT_PAGE_LOADERS, COMPANY_PAGE_LOADERS
 )
 
 from purchasing.scout import blueprint
 
 CRAZY_CHARS = re.compile('[^A-Za-z0-9 ]')
+FOLLOWS_KEYSET = [('follows', True), ('id', False)]
 
 @blueprint.route('/', methods=['GET'])
 @wrap_form(SearchForm, 'search_form', 'scout/explore.html')
@@ -64,32 +68,28 @@ def filter(department_id):
 
     if department:
         pagination_per_page = current_app.config.get('PER_PAGE', 50)
-        page = int(request.args.get('page', 1))
-        lower_bound_result = (page - 1) * pagination_per_page
-        upper_bound_result = lower_bound_result + pagination_per_page
-
-        contracts = db.session.execute(
-            '''
-            SELECT
-                contract.id, description,
-                count(contract_user_association.user_id) AS follows
-            FROM contract
-            LEFT OUTER JOIN contract_user_association
-                ON contract.id = contract_user_association.contract_id
-            FULL OUTER JOIN users
-                ON contract_user_association.user_id = users.id
-            JOIN department
-                ON users.department_id = department.id
-            WHERE department.id = :department
-            GROUP BY 1,2
-            HAVING count(contract_user_association.user_id) > 0
-            ORDER BY 3 DESC, 1 ASC
-            ''', {'department': int(department_id)}
-        ).fetchall()
+        page = max(int(request.args.get('page', 1)), 1)
+
+        # counts are maintained in department_contract_follows, so this
+        # reads straight off of its (department, follows, contract) index
+        contracts, pagination = paginate_query(
+            db.session.query(
+                DepartmentContractFollows.contract_id.label('id'),
+                ContractBase.description.label('description'),
+                DepartmentContractFollows.follows.label('follows')
+            ).join(
+                ContractBase, ContractBase.id == DepartmentContractFollows.contract_id
+            ).filter(
+                DepartmentContractFollows.department_id == department.id
+            ).order_by(
+                DepartmentContractFollows.follows.desc(),
+                DepartmentContractFollows.contract_id
+            ), page, pagination_per_page,
+            keyset=FOLLOWS_KEYSET, cursor=request.args.get('cursor')
+        )
 
         if len(contracts) > 0:
-            pagination = SimplePagination(page, pagination_per_page, len(contracts))
-            results = contracts[lower_bound_result:upper_bound_result]
+            results = contracts
         else:
             pagination = None
             results = []
@@ -146,12 +146,11 @@ def search():
 
     # strip out "crazy" characters
     search_for = re.sub(CRAZY_CHARS, '', search_for)
-    search_for = ' | '.join(search_for.split())
+    search_terms = search_for.split()
+    search_for = ' | '.join(search_terms)
 
     pagination_per_page = current_app.config.get('PER_PAGE', 50)
-    page = int(request.args.get('page', 1))
-    lower_bound_result = (page - 1) * pagination_per_page
-    upper_bound_result = lower_bound_result + pagination_per_page
+    page = max(int(request.args.get('page', 1)), 1)
 
     filter_or = build_filter(
         request.args, FILTER_FIELDS, search_for, search_form,
@@ -177,22 +176,38 @@ def search():
     else:
         archived = False
 
+    cursor = request.args.get('cursor')
+    cache_key = search_cache_key(
+        search_for, request.args, page, pagination_per_page, cursor
+    )
     if search_for != '':
-        contracts = find_contract_metadata(
+        contracts, pagination, cache_hit = cached_search(
+            cache_key, find_contract_metadata,
             search_for, found_in_case, filter_or, filter_and,
-            archived
+            archived, page=page, per_page=pagination_per_page, cursor=cursor,
+            min_rank=current_app.config.get('SEARCH_MIN_RANK'),
+            and_min_hits=current_app.config.get('SEARCH_AND_MIN_HITS'),
+            search_terms=search_terms
         )
     else:
-        contracts = return_all_contracts(
-            filter_and, archived
+        contracts, pagination, cache_hit = cached_search(
+            cache_key, return_all_contracts,
+            filter_and, archived, page=page, per_page=pagination_per_page,
+            cursor=cursor
         )
 
-    pagination = SimplePagination(page, pagination_per_page, len(contracts))
+    current_app.logger.info(
+        'WEXSEARCH - {search_for}: {user} searched for "{search_for}" (cache {result} #{count})'.format(
+            search_for=search_for,
+            user=current_user.email if not current_user.is_anonymous else 'anonymous',
+            result='hit' if cache_hit else 'miss', count=count_search_cache(cache_hit)
+        )
+    )
 
-    current_app.logger.info('WEXSEARCH - {search_for}: {user} searched for "{search_for}"'.format(
-        search_for=search_for,
-        user=current_user.email if not current_user.is_anonymous else 'anonymous'
-    ))
+    facets = cached_facets(
+        search_cache_key(search_for, request.args, None, None, None),
+        search_for, contract_type=request.args.get('contract_type'), archived=archived
+    )
 
     user_follows = [] if current_user.is_anonymous else current_user.get_following()
 
@@ -201,7 +216,9 @@ def search():
         current_user=current_user,
         user_follows=user_follows,
         search_for=search_for,
-        results=contracts[lower_bound_result:upper_bound_result],
+        results=contracts,
+        found_in_labels=found_in_labels,
+        facets=facets,
         pagination=pagination,
         search_form=search_form,
         choices=Department.choices(),
@@ -210,6 +227,28 @@ def search():
         )
     )
 
+@blueprint.route('/suggest', methods=['GET'])
+def suggest():
+    '''Suggest search terms for a partially typed search
+
+    .. seealso ::
+        :py:func:`~purchasing.scout.util.find_suggestions` for how
+        suggestions are found
+
+    :status 200: JSON list of suggestions, each with a ``type`` of
+        "company", "contract", or "financial_id" and a ``value``
+    '''
+    prefix = re.sub(CRAZY_CHARS, '', request.args.get('q') or '')
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 25)
+    except ValueError:
+        limit = 10
+
+    return jsonify({'results': [
+        {'type': kind, 'value': value}
+        for kind, value in find_suggestions(prefix, limit=limit)
+    ]})
+
 @blueprint.route('/companies/<int:company_id>')
 @wrap_form(SearchForm, 'search_form', 'scout/company.html')
 def company(company_id):
@@ -219,7 +258,7 @@ def company(company_id):
     :status 200: Renders the company profile template
     :status 404: Unique company ID not found
     '''
-    company = Company.query.get(company_id)
+    company = Company.query.options(*COMPANY_PAGE_LOADERS).get(company_id)
 
     if company:
         current_app.logger.info('WEXCOMPANY - Viewed company page id: {}'.format(company.id))
@@ -246,7 +285,7 @@ def contract(contract_id):
     :status 404: Unique contract ID not found
     '''
 
-    contract = ContractBase.query.get(contract_id)
+    contract = ContractBase.query.options(*CONTRACT_PAGE_LOADERS).get(contract_id)
 
     if contract:
         note_form = NoteForm()
@@ -16,6 +16,33 @@ class Config(object):
     CACHE_TYPE = 'simple'  # Can be "memcached", "redis", etc.
     BROWSERID_URL = os_env.get('BROWSERID_URL')
     PER_PAGE = 50
+    # minimum number of seconds between two search index refreshes
+    SEARCH_REFRESH_INTERVAL = int(os_env.get('SEARCH_REFRESH_INTERVAL', 30))
+    # cached search results are thrown out when the search index changes,
+    # so they can be kept around for a while
+    SEARCH_CACHE_TIMEOUT = int(os_env.get('SEARCH_CACHE_TIMEOUT', 60 * 60))
+    # seconds to keep each version of a flow's metrics dashboard data
+    METRICS_CACHE_TIMEOUT = int(os_env.get('METRICS_CACHE_TIMEOUT', 60 * 60 * 24))
+    # match every search term first, widening to any search term if that
+    # finds fewer than this many contracts. None always matches any term
+    SEARCH_AND_MIN_HITS = None
+    # leave out search results ranked below this. None keeps everything
+    SEARCH_MIN_RANK = None
+    # count and time the statements each request runs, logging a summary
+    # line per request. Nothing is attached to the engine when this is off
+    SQL_INSTRUMENTATION = os_env.get('SQL_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+    # flag a request when it runs the same statement from the same line
+    # of code at least this many times
+    SQL_N_PLUS_ONE_THRESHOLD = int(os_env.get('SQL_N_PLUS_ONE_THRESHOLD', 5))
+    # log statements from these views that run longer than this many
+    # milliseconds, along with their query plans. None turns it off
+    SLOW_QUERY_THRESHOLD = int(os_env['SLOW_QUERY_THRESHOLD']) if 'SLOW_QUERY_THRESHOLD' in os_env else None
+    SLOW_QUERY_BLUEPRINTS = ['scout', 'conductor', 'opportunities']
+    SLOW_QUERY_LOG = os_env.get('SLOW_QUERY_LOG', os.path.join(PROJECT_ROOT, 'log', 'slow_queries.jsonl'))
+    SLOW_QUERY_LOG_BYTES = 10000000
+    SLOW_QUERY_LOG_BACKUPS = 10
+    # gzip the conductor tsv downloads for clients that accept it
+    GZIP_DOWNLOADS = True
     MAIL_DEFAULT_SENDER = os_env.get('MAIL_DEFAULT_SENDER', 'no-reply@buildpgh.com')
     BEACON_SENDER = os_env.get('BEACON_SENDER', 'beaconbot@buildpgh.com')
     CONDUCTOR_SENDER = os_env.get('CONDUCTOR_SENDER', 'conductorbot@buildpgh.com')
@@ -84,6 +111,7 @@ class DevConfig(Config):
     # CELERY_BROKER_URL = os_env.get('REDIS_URL', 'redis://localhost:6379/0')
     # CELERY_RESULT_BACKEND = os_env.get('REDIS_URL', 'redis://localhost:6379/0')
     CELERY_ALWAYS_EAGER = True
+    SEARCH_REFRESH_INTERVAL = 0
     UGLIFYJS_BIN = os.path.join(PROJECT_ROOT, 'node_modules', '.bin', 'uglifyjs')
     LESS_BIN = os.path.join(PROJECT_ROOT, 'node_modules', '.bin', 'lessc')
     # MAIL_SUPPRESS_SEND = True
@@ -101,5 +129,6 @@ class TestConfig(Config):
     UPLOAD_DESTINATION = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'test_uploads'))
     UPLOAD_FOLDER = UPLOAD_DESTINATION
     CELERY_ALWAYS_EAGER = True
+    SEARCH_REFRESH_INTERVAL = 0
     DISPLAY_TIMEZONE = pytz.timezone('UTC')
     SECURITY_PASSWORD_SALT = 'test'
@@ -1,36 +1,166 @@
 $(document).ready(function() {
-  $.fn.dataTableExt.afnFiltering.push(function (oSettings, aData, iDataIndex) {
-    if (oSettings.sTableId === "js-table-progress" || oSettings.sTableId === "js-table-all") {
-      if ($('#' + oSettings.sTableId + '-container').find('.js-show-only-mine').is(':checked')) {
-        return aData[0] === currentUser;
-      }
-      return true;
-    }
-    return true;
-  });
+  // names of everyone a contract can be reassigned to, in the same
+  // order as each row's reassign links
+  var conductors = [];
+
+  function escapeHtml(value) {
+    // .html() leaves quotes alone, so escape them too for use in attributes
+    return $('<div>').text(value === null || value === undefined ? '' : value).html()
+      .replace(/"/g, '&quot;').replace(/'/g, '&#39;');
+  }
+
+  function truncate(value, length) {
+    return value.length > length ? value.substring(0, length - 3) + '...' : value;
+  }
+
+  function dayClass(date, danger, warning) {
+    if (!date) { return ''; }
+    if (date.days < danger) { return 'contract-expiring-danger'; }
+    if (date.days < warning) { return 'contract-expiring-warning'; }
+    return '';
+  }
+
+  function renderDate(date, danger, warning, prefix) {
+    if (!date) { return '--'; }
+    return '<strong class="' + dayClass(date, danger, warning) + '">' + date.fromToday + '</strong><br>' +
+      '<span class="text-muted text-normal"><small>' + (prefix || '') + date.formatted + '</small></span>';
+  }
+
+  function renderAssigned(row) {
+    var name = row.first_name || (row.email ? row.email.split('@')[0] : 'Unassigned');
+    var links = row.urls.reassign.map(function(url, ix) {
+      return '<li><a href="' + escapeHtml(url) + '">' + escapeHtml(conductors[ix]) + '</a></li>';
+    });
+    return '<div class="dropdown">' +
+      '<button id="dLabel-' + row.id + '" class="btn btn-default btn-sm btn-assigned" type="button" data-toggle="dropdown" aria-haspopup="true" aria-expanded="false">' +
+        escapeHtml(name) + ' <span class="caret"></span>' +
+      '</button>' +
+      '<ul class="dropdown-menu" role="menu" aria-labelledby="dLabel-' + row.id + '">' + links.join('') + '</ul>' +
+    '</div>';
+  }
+
+  function actionLink(url, icon, text, newTab) {
+    return '<li><a href="' + escapeHtml(url) + '"' + (newTab ? ' target="_blank"' : '') + '>' +
+      '<span class="fa-stack"><i class="fa fa-fw ' + icon + '"></i></span> ' + text +
+    '</a></li>';
+  }
+
+  function renderActions(row, buttonClass, links) {
+    return '<div class="dropdown">' +
+      '<button class="btn btn-default btn-sm dropdown-toggle ' + buttonClass + '" type="button" id="actionDropdown-' + row.id + '"' +
+        ' data-toggle="dropdown" aria-haspopup="true" aria-expanded="true">' +
+        'Actions <span class="caret"></span>' +
+      '</button>' +
+      '<ul class="dropdown-menu pull-right" aria-labelledby="actionDropdown-' + row.id + '">' + links.join('') + '</ul>' +
+    '</div>';
+  }
+
+  // load one page at a time from the table's data source, translating
+  // between datatables' parameters and the ones the server takes
+  function serverData(tableName) {
+    var table = $('#js-table-' + tableName);
+    return function(data, callback, settings) {
+      var order = data.order[0];
+      $.ajax({
+        url: table.attr('data-source'),
+        data: {
+          page: Math.floor(data.start / data.length) + 1,
+          per_page: data.length,
+          sort: order ? data.columns[order.column].name : '',
+          direction: order ? order.dir : 'asc',
+          q: data.search.value,
+          mine: $('.js-show-only-mine[data-table-name="' + tableName + '"]').is(':checked') ? 1 : ''
+        }
+      }).done(function(response) {
+        conductors = response.conductors;
+        callback({
+          draw: data.draw, recordsTotal: response.total,
+          recordsFiltered: response.total, data: response.results
+        });
+      }).fail(function() {
+        callback({
+          draw: data.draw, recordsTotal: 0, recordsFiltered: 0, data: [],
+          error: 'Something went wrong loading contracts. Please try again later.'
+        });
+      });
+    };
+  }
+
+  var detailsControl = {
+    data: null, orderable: false, className: 'details-control',
+    render: function() { return '<i class="fa fa-plus"></i>'; }
+  };
 
   var progressTable = $('#js-table-progress').DataTable({
-    // order by expiration date -- column 4
-    'order': [[8, 'asc']],
-
-    'aoColumnDefs': [
-      { 'orderable': false, 'aTargets': [1] },
-      { 'bVisible': false, 'aTargets': [0, 4, 7, 11] },
-      { 'iDataSort': 7, 'aTargets': [8] },
-      { 'iDataSort': 4, 'aTargets': [5] }
-    ],
+    serverSide: true,
+    ajax: serverData('progress'),
+    searchDelay: 400,
+    lengthMenu: [10, 25, 50],
+    // order by current step started -- column 5
+    order: [[5, 'asc']],
+    columns: [
+      detailsControl,
+      { data: null, name: 'spec_number', render: function(data, type, row) {
+        if (row.spec_number) { return escapeHtml(row.spec_number); }
+        if (row.parent_spec) {
+          return escapeHtml(row.parent_spec) + '<br><span class="text-muted text-normal"><small>Old spec</small></span>';
+        }
+        return row.id + '<br><span class="text-muted text-normal"><small>Item #</small></span>';
+      }},
+      { data: null, name: 'description', render: function(data, type, row) {
+        return '<span class="title-update-span">' + escapeHtml(truncate(row.title, 35)) + '</span><br />' +
+          '<a href="' + row.urls.detail + '"><small><strong>Update</strong></small></a>';
+      }},
+      { data: null, name: 'parent_expiration', render: function(data, type, row) {
+        return renderDate(row.parent_expiration, 60, 120);
+      }},
+      { data: 'stage_name', name: 'stage_name', render: escapeHtml },
+      { data: null, name: 'entered', render: function(data, type, row) {
+        return renderDate(row.entered, -14, -7, 'Started: ');
+      }},
+      { data: null, name: 'email', render: function(data, type, row) {
+        return renderAssigned(row);
+      }},
+      { data: null, orderable: false, render: function(data, type, row) {
+        var links = [actionLink(row.urls.detail, 'fa-search-plus', 'Update contract')];
+        if (row.urls.contract) { links.push(actionLink(row.urls.contract, 'fa-file-pdf-o', 'View Contract', true)); }
+        links.push(actionLink(row.urls.scout, 'fa-search', 'View on Scout'));
+        links.push(actionLink(row.urls.kill, 'fa-times-circle', 'Remove contract from Conductor'));
+        return renderActions(row, dayClass(row.entered, -14, -7), links);
+      }}
+    ]
   });
 
   var allTable = $('#js-table-all').DataTable({
-    // order by expiration date -- column 4
-    'order': [[7, 'asc']],
-    // use column 3 (actual timestamps) as a sort proxy for
-    // column 4 (formatted "days since")
-    'aoColumnDefs': [
-      { 'orderable': false, 'aTargets': [1] },
-      { 'bVisible': false, 'aTargets': [0, 6, 10] },
-      { 'iDataSort': 6, 'aTargets': [7] }
-    ],
+    serverSide: true,
+    ajax: serverData('all'),
+    searchDelay: 400,
+    lengthMenu: [10, 25, 50],
+    // order by expiration date -- column 5
+    order: [[5, 'asc']],
+    columns: [
+      detailsControl,
+      { data: 'id', name: 'id' },
+      { data: null, name: 'description', render: function(data, type, row) {
+        return '<span>' + escapeHtml(truncate(row.title, 50)) + '</span>';
+      }},
+      { data: 'spec_number', name: 'spec_number', render: escapeHtml },
+      { data: 'financial_id', name: 'financial_id', render: escapeHtml },
+      { data: null, name: 'expiration_date', render: function(data, type, row) {
+        return renderDate(row.expiration_date, 60, 120);
+      }},
+      { data: null, name: 'email', render: function(data, type, row) {
+        return renderAssigned(row);
+      }},
+      { data: null, orderable: false, render: function(data, type, row) {
+        var links = [actionLink(row.urls.start, 'fa-play-circle-o', 'Start work')];
+        if (row.urls.contract) { links.push(actionLink(row.urls.contract, 'fa-file-pdf-o', 'View contract', true)); }
+        links.push(actionLink(row.urls.scout, 'fa-search', 'View on Scout'));
+        links.push(actionLink(row.urls.remove, 'fa-chain-broken', 'Remove contract from Conductor only'));
+        links.push(actionLink(row.urls.kill, 'fa-times-circle', 'Remove contract from Scout and Conductor'));
+        return renderActions(row, dayClass(row.expiration_date, 60, 120), links);
+      }}
+    ]
   });
 
   $('.js-show-only-mine').on('change', function() {
@@ -44,13 +174,13 @@ $(document).ready(function() {
 
   function format(itemNumber, description, department, controller, spec, parentSpec, companies) {
     var table = '<table class="table table-condensed table-bordered"><tbody>';
-    if (itemNumber) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Item #</strong></td><td>' + itemNumber + '</td></tr>' }
-    if (description) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Full Description</strong></td><td>' + description + '</td></tr>' }
-    if (department) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Department</strong></td><td>' + department + '</td></tr>' }
-    if (controller) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Controller #</strong></td><td>' + controller + '</td></tr>' }
-    if (spec) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Spec #</strong></td><td>' + spec + '</td></tr>' }
-    if (parentSpec) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Old Spec #</strong></td><td>' + parentSpec + '</td></tr>' }
-    if (companies) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Companies</strong></td><td>' + companies + '</td></tr>' }
+    if (itemNumber) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Item #</strong></td><td>' + escapeHtml(itemNumber) + '</td></tr>' }
+    if (description) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Full Description</strong></td><td>' + escapeHtml(description) + '</td></tr>' }
+    if (department) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Department</strong></td><td>' + escapeHtml(department) + '</td></tr>' }
+    if (controller) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Controller #</strong></td><td>' + escapeHtml(controller) + '</td></tr>' }
+    if (spec) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Spec #</strong></td><td>' + escapeHtml(spec) + '</td></tr>' }
+    if (parentSpec) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Old Spec #</strong></td><td>' + escapeHtml(parentSpec) + '</td></tr>' }
+    if (companies) { table += '<tr><td class="dropdown-table-border-right col-md-3"><strong>Companies</strong></td><td>' + escapeHtml(companies) + '</td></tr>' }
     table += '</tbody></table></div>';
 
     return table;
@@ -66,23 +196,25 @@ $(document).ready(function() {
       tr.removeClass('shown');
       clicked.find('.fa').removeClass('fa-minus').addClass('fa-plus');
     } else {
-      row.child(format(
-        tr.attr('data-item-number'), tr.attr('data-full-description'),
-        tr.attr('data-department'), tr.attr('data-controller'),
-        tr.attr('data-spec-number'), tr.attr('data-parent-spec-number'),
-        tr.attr('data-companies')
-      )).show();
+      row.child(formatMethod(row.data())).show();
       tr.addClass('shown');
       clicked.find('.fa').removeClass('fa-plus').addClass('fa-minus');
     }
   }
 
   $('#js-table-progress tbody').on('click', 'td.details-control', function() {
-    showHideAdditionalInformation(this, progressTable);
+    showHideAdditionalInformation(this, progressTable, function(row) {
+      return format(
+        row.id, row.title, row.department, null,
+        row.spec_number, row.parent_spec || '--', row.companies
+      );
+    });
   });
 
   $('#js-table-all tbody').on('click', 'td.details-control', function() {
-    showHideAdditionalInformation(this, allTable);
+    showHideAdditionalInformation(this, allTable, function(row) {
+      return format(null, row.title, null, null, null, null, row.companies);
+    });
   });
 
   $('.js-conductor-init-hidden').removeClass('hidden');
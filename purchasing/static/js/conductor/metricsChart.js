@@ -1,7 +1,7 @@
 (function() {
   'use strict';
 
-  var flowData;
+  var flowData, rawData;
   var dayInSeconds = 60 * 60 * 24;
   var defaultBuckets = {
     '< 1 day': 0, '< 7 days': 0, '8 - 15 days': 0,
@@ -12,46 +12,32 @@
 
   var circleScale = d3.scale.linear().range([3, 7]);
 
-  function makeBuckets(stage) {
+  function makeBuckets(histogram) {
     var newBuckets = $.extend({}, defaultBuckets);
-    stage.forEach(function(d) {
-      switch (true) {
-        case d < dayInSeconds: newBuckets['< 1 day'] += 1 ; break;
-        case d < dayInSeconds * 7:  newBuckets['< 7 days'] += 1 ; break;
-        case d < dayInSeconds * 15: newBuckets['8 - 15 days'] += 1 ; break;
-        case d < dayInSeconds * 30: newBuckets['16 - 30 days'] += 1 ; break;
-        default: newBuckets['30+ days'] += 1;
-      }
+    histogram.forEach(function(count, ix) {
+      newBuckets[defaultBuckets.order[ix]] = count;
     });
     return newBuckets;
   }
 
   function buildChartData(data, defaultObj, stageOrder) {
-    var chartDataObj = {}, chartData = [];
-    d3.map(data).forEach(function(ix, i) {
-      return d3.map(i.stages).forEach(function(idx, d) {
-        if (chartDataObj[d.id]) {
-          chartDataObj[d.id].push(d.seconds);
-        } else {
-          chartDataObj[d.id] = [{name: d.name, id: d.id}, d.seconds];
-        }
-      });
+    var summaries = {}, chartData = [];
+    data.forEach(function(d) {
+      summaries[d.id] = d;
     });
 
     d3.map(defaultObj).values().forEach(function(d, idx) {
-      var stage = chartDataObj[d3.map(d).keys()[0]];
-      if (stage) {
+      var stageIdx = +d3.map(d).keys()[0];
+      var summary = summaries[stageIdx];
+      if (summary) {
         chartData.push({
-          category: {name: stage[0].name, id: stage[0].id},
-          average: d3.mean(stage.slice(1).map(function(e) {
-            return d3.round(e/dayInSeconds, 1);
-          })),
-          count: stage.slice(1).length,
-          buckets: makeBuckets(stage.slice(1)),
+          category: {name: summary.name, id: summary.id},
+          average: d3.round(summary.mean/dayInSeconds, 1),
+          count: summary.count,
+          buckets: makeBuckets(summary.histogram),
         });
       } else {
-        var stageIdx = +d3.map(d).keys()[0];
-        stage = defaultObj[stageOrder.indexOf(+stageIdx)][stageIdx];
+        var stage = defaultObj[stageOrder.indexOf(stageIdx)][stageIdx];
         chartData.push({
           category: {name: stage.name, id: stage.id},
           buckets: makeBuckets([]),
@@ -63,12 +49,22 @@
     return chartData;
   }
 
+  function getRawData() {
+    // every contract's stages are only needed for the distribution
+    // modal, so they aren't fetched until it is first opened
+    if (!rawData) {
+      rawData = $.ajax({ url: ajaxUrl, data: { raw: true } });
+    }
+    return rawData;
+  }
+
   function getStageBreakouts(clickedStage) {
-    if (stageData.keys().indexOf(clickedStage.id) > -1) {
-      return stageData[clickedStage.id];
-    } else {
+    return getRawData().then(function(data) {
+      if (stageData.keys().indexOf(clickedStage.id) > -1) {
+        return stageData[clickedStage.id];
+      }
       var stages = [];
-      flowData.complete.forEach(function(i, ix) {
+      data.complete.forEach(function(i, ix) {
         var stage = i.stages.filter(function(d) {
           return d.id == clickedStage.id;
         });
@@ -81,7 +77,7 @@
       });
       stageData[clickedStage.id] = stages;
       return stages;
-    }
+    });
   }
 
   function rollUpStages(stageBreakouts) {
@@ -180,11 +176,14 @@
         onclick: function(d, element) {
           var stage = data[d.index].category;
           $('#js-distribution-modal-title').text('Time distribution for "' + stage.name + '"');
-          var stageBreakouts = getStageBreakouts(stage);
-          var stageRollup = rollUpStages(stageBreakouts);
-          drawDistributionChart(stageRollup);
-          renderDistributionTable(stageBreakouts);
-          $('#js-distribution-modal').modal('show');
+          getStageBreakouts(stage).done(function(stageBreakouts) {
+            var stageRollup = rollUpStages(stageBreakouts);
+            drawDistributionChart(stageRollup);
+            renderDistributionTable(stageBreakouts);
+            $('#js-distribution-modal').modal('show');
+          }).fail(function() {
+            renderError();
+          });
         }
       },
       size: { height: 400 },
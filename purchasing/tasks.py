@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import math
+
+from flask import current_app
+
 from purchasing.app import celery
 from purchasing.extensions import mail, db, cache
 
@@ -11,21 +15,62 @@ def send_email(messages):
 
 @celery.task
 def rebuild_search_view():
+    from purchasing.data.searches import rebuild_search_index, bump_search_generation
     session = db.create_scoped_session()
     try:
-        session.execute(
-            '''
-            REFRESH MATERIALIZED VIEW CONCURRENTLY search_view
-            '''
-        )
+        rebuild_search_index(session)
         session.commit()
+        bump_search_generation()
     except Exception, e:
+        session.rollback()
         raise e
     finally:
-        cache.delete('refresh-lock')
         session.close()
         db.engine.dispose()
 
+# set while a delayed search index refresh is waiting to run, so that a
+# burst of writes inside the minimum interval schedules only one of them
+SEARCH_REFRESH_SCHEDULED = 'search-refresh-scheduled'
+
+@celery.task
+def refresh_search_index(scheduled=False):
+    from purchasing.data.searches import (
+        refresh_queued_changes, has_queued_changes, bump_search_generation
+    )
+    if scheduled:
+        # this is the pending retry, so a later write can schedule the next one
+        cache.delete(SEARCH_REFRESH_SCHEDULED)
+
+    interval = current_app.config.get('SEARCH_REFRESH_INTERVAL', 0)
+    session = db.create_scoped_session()
+    try:
+        refresh, retry_in = refresh_queued_changes(session, interval)
+        session.commit()
+        if refresh is not None:
+            bump_search_generation()
+            current_app.logger.info(
+                'SEARCHREFRESH: {} changes, {} contracts, {:.3f}s duration, {:.3f}s lag'.format(
+                    refresh.changes, refresh.contracts, refresh.duration, refresh.lag
+                )
+            )
+            # changes that came in while we were refreshing need another pass
+            if has_queued_changes(session):
+                retry_in = interval
+    except Exception, e:
+        session.rollback()
+        raise e
+    finally:
+        session.close()
+        db.engine.dispose()
+
+    # the queue table holds the changes, so one pending retry is enough to
+    # pick up everything written before it runs. The flag outlives the
+    # countdown a little, and expires in case the retry is lost
+    if retry_in is not None and cache.add(
+        SEARCH_REFRESH_SCHEDULED, True, timeout=int(math.ceil(retry_in)) + 60
+    ):
+        refresh_search_index.apply_async(kwargs={'scheduled': True}, countdown=retry_in)
+
 @celery.task
 def scrape_county_task(job):
     from purchasing.data.importer.scrape_county import main as scrape_county
@@ -14,6 +14,7 @@ import pytz
 from boto.s3.connection import S3Connection
 
 import sqlalchemy
+from itsdangerous import URLSafeSerializer, BadSignature
 from wtforms.validators import InputRequired, StopValidation
 
 from flask import current_app
@@ -48,14 +49,17 @@ def enable_triggers():
         '''.format(table=table, column=column)))
 
 def refresh_search_view():
-    '''Create and execute a refresh to the search view in a scoped session
+    '''Rebuild the whole search index in a scoped session
+
+    See Also:
+        :py:func:`~purchasing.data.searches.rebuild_search_index`
     '''
-    print 'Refreshing the search view...'
+    from purchasing.data.searches import rebuild_search_index, bump_search_generation
+    print 'Rebuilding the search index...'
     session = db.create_scoped_session()
-    session.execute(db.text('''
-        REFRESH MATERIALIZED VIEW CONCURRENTLY search_view
-    '''))
+    rebuild_search_index(session)
     session.commit()
+    bump_search_generation()
     db.engine.dispose()
 
 def get_all_refresh_mixin_models():
@@ -155,14 +159,147 @@ def localize_and_strip(date):
     '''
     return pytz.UTC.localize(date).astimezone(current_app.config['DISPLAY_TIMEZONE']).replace(tzinfo=None)
 
+def encode_cursor(row, keyset, page, total_count, direction):
+    '''Build an opaque, signed pagination cursor pointing at a row
+
+    Arguments:
+        row: The result row to page from
+        keyset: List of (column label, descending) two-tuples that
+            uniquely order the paginated query
+        page: One-indexed page number the cursor leads to
+        total_count: Total number of results, carried along so that
+            cursor pages don't need to recount
+        direction: "next" to fetch rows after ``row``, "prev" to fetch
+            rows before it
+
+    Returns:
+        A url-safe string
+    '''
+    return URLSafeSerializer(
+        current_app.config['SECRET_KEY'], salt='pagination-cursor'
+    ).dumps({
+        'k': [getattr(row, name) for name, _ in keyset],
+        'd': direction, 'p': page, 't': total_count
+    })
+
+def decode_cursor(cursor):
+    '''Turn a cursor built by :py:func:`encode_cursor` back into a position
+
+    Returns:
+        The cursor's payload dictionary, or None if the cursor was tampered
+        with or is otherwise unreadable
+    '''
+    try:
+        return URLSafeSerializer(
+            current_app.config['SECRET_KEY'], salt='pagination-cursor'
+        ).loads(cursor)
+    except BadSignature:
+        return None
+
+def _keyset_clause(columns, keyset, values, forward):
+    clauses = []
+    for ix, (column, (_, descending)) in enumerate(zip(columns, keyset)):
+        beyond = column < values[ix] if descending == forward else column > values[ix]
+        clauses.append(db.and_(
+            *[columns[i] == values[i] for i in range(ix)] + [beyond]
+        ))
+    return db.or_(*clauses)
+
+def _offset_page(query, page, per_page):
+    rows = query.add_columns(
+        db.func.count().over().label('total_count')
+    ).limit(per_page).offset((page - 1) * per_page).all()
+
+    if len(rows) > 0:
+        return rows, rows[0].total_count
+    elif page > 1:
+        return rows, query.order_by(None).count()
+    return rows, 0
+
+def _keyset_page(query, keyset, position, per_page):
+    forward = position['d'] == 'next'
+    results = query.order_by(None).subquery()
+    columns = [results.c[name] for name, _ in keyset]
+
+    rows = db.session.query(results).filter(
+        _keyset_clause(columns, keyset, position['k'], forward)
+    ).order_by(*[
+        column.desc() if descending == forward else column.asc()
+        for column, (_, descending) in zip(columns, keyset)
+    ]).limit(per_page).all()
+
+    return rows if forward else list(reversed(rows))
+
+def paginate_query(query, page, per_page, keyset=None, cursor=None):
+    '''Fetch a single page of a query along with its pagination
+
+    Pages are fetched one of two ways:
+
+    * By offset. The total is computed in the same round trip with a
+      ``count(*) OVER ()`` window, so only one page of rows ever leaves
+      the database. If the requested page is past the end of the results,
+      the window has no rows to ride along on and we fall back to a
+      separate count query.
+    * By keyset, if a ``cursor`` is passed. The cursor holds the ordering
+      key of the row the page starts after (or before), so deep pages cost
+      the same as the first one. The total count is carried in the cursor.
+
+    If a ``keyset`` is given, the returned pagination carries cursors for
+    the previous and next pages, so walking through results page by page
+    only ever pays for the offset once.
+
+    Arguments:
+        query: Sqlalchemy query to paginate. It should already be ordered
+        page: One-indexed page number, used when there is no valid cursor
+        per_page: Number of results per page
+
+    Keyword Arguments:
+        keyset: List of (column label, descending) two-tuples matching the
+            query's ordering. The labels together must uniquely identify a row
+        cursor: A cursor from :py:func:`encode_cursor`, or None
+
+    Returns:
+        Two-tuple of (list of result rows, :py:class:`SimplePagination`)
+    '''
+    position = decode_cursor(cursor) if keyset and cursor else None
+    if position and len(position['k']) != len(keyset):
+        # the cursor was made for a different ordering
+        position = None
+
+    if position:
+        page, total_count = position['p'], position['t']
+        rows = _keyset_page(query, keyset, position, per_page)
+    else:
+        rows, total_count = _offset_page(query, page, per_page)
+
+    pagination = SimplePagination(page, per_page, total_count)
+
+    if keyset and len(rows) > 0:
+        if pagination.has_prev:
+            pagination.prev_cursor = encode_cursor(
+                rows[0], keyset, page - 1, total_count, 'prev'
+            )
+        if pagination.has_next:
+            pagination.next_cursor = encode_cursor(
+                rows[-1], keyset, page + 1, total_count, 'next'
+            )
+
+    return rows, pagination
+
 class SimplePagination(object):
     '''
     Simple pagination support
+
+    ``prev_cursor`` and ``next_cursor`` are set by
+    :py:func:`paginate_query` when the adjacent pages can be
+    fetched by keyset instead of by offset.
     '''
-    def __init__(self, page, per_page, total_count):
+    def __init__(self, page, per_page, total_count, prev_cursor=None, next_cursor=None):
         self.page = page
         self.per_page = per_page
         self.total_count = total_count
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
 
     @property
     def pages(self):
@@ -8,11 +8,13 @@ from mock import Mock, patch
 from flask import session
 from werkzeug.datastructures import ImmutableMultiDict
 
+from purchasing.database import db
 from purchasing.users.models import User
 from purchasing.data.contracts import ContractBase
 from purchasing.data.contract_stages import ContractStage, ContractStageActionItem
 from purchasing.data.stages import Stage
 from purchasing.data.flows import Flow
+from purchasing.data.conductor_queue import ConductorQueue, rebuild_conductor_queue
 
 from purchasing.opportunities.models import Opportunity
 from purchasing.extensions import mail
@@ -23,7 +25,7 @@ from purchasing_test.factories import ContractTypeFactory, DepartmentFactory, Ca
 from purchasing_test.test_base import BaseTestCase
 from purchasing_test.util import (
     insert_a_contract, insert_a_stage, insert_a_flow,
-    insert_a_role, insert_a_user
+    insert_a_role, insert_a_user, count_queries
 )
 
 class TestConductorSetup(BaseTestCase):
@@ -116,9 +118,11 @@ class TestConductor(TestConductorSetup):
         self.assert200(index_view)
         self.assert_template_used('conductor/index.html')
 
-        # we have 2 contracts
-        _all = self.get_context_variable('_all')
-        self.assertEquals(len(_all), 2)
+        # we have 2 contracts, loaded separately from the page
+        _all = self.client.get('/conductor/index/all')
+        self.assert200(_all)
+        self.assertEquals(_all.json['total'], 2)
+        self.assertEquals(len(_all.json['results']), 2)
 
         # we can't get to the page normally
         self.logout_user()
@@ -133,6 +137,85 @@ class TestConductor(TestConductorSetup):
         # it should redirect us to the home page
         self.assert_template_used('public/home.html')
 
+    def test_conductor_index_tables(self):
+        _all = self.client.get('/conductor/index/all?sort=id&direction=desc').json
+        self.assertEquals(
+            [i['id'] for i in _all['results']], [self.contract2.id, self.contract1.id]
+        )
+        self.assertEquals(len(_all['results'][0]['urls']['reassign']), len(_all['conductors']))
+
+        # one contract per page, with the total of all of them
+        page = self.client.get('/conductor/index/all?per_page=1&page=2&sort=id').json
+        self.assertEquals(page['total'], 2)
+        self.assertEquals([i['id'] for i in page['results']], [self.contract2.id])
+
+        # search looks through descriptions and spec numbers
+        self.assertEquals(self.client.get('/conductor/index/all?q=repair').json['total'], 1)
+        self.assertEquals(self.client.get('/conductor/index/all?q=123').json['total'], 1)
+
+        # nothing in progress until a contract is assigned
+        self.assertEquals(self.client.get('/conductor/index/in-progress').json['total'], 0)
+        self.assign_contract()
+        in_progress = self.client.get('/conductor/index/in-progress?mine=1').json
+        self.assertEquals(in_progress['total'], 1)
+        self.assertEquals(in_progress['results'][0]['stage_name'], self.stage1.name)
+
+        self.login_user(self.conductor2)
+        self.assertEquals(self.client.get('/conductor/index/in-progress?mine=1').json['total'], 0)
+        self.assertEquals(self.client.get('/conductor/index/in-progress').json['total'], 1)
+
+        self.login_user(self.staff)
+        self.assertEquals(self.client.get('/conductor/index/in-progress').status_code, 302)
+
+    def test_conductor_queue(self):
+        def queue(contract):
+            db.session.expire_all()
+            return ConductorQueue.query.get(contract.id)
+
+        self.assertTrue(queue(self.contract1).available)
+        self.assertFalse(queue(self.contract1).in_progress)
+
+        # starting work takes the parent off of the all contracts table
+        assign = self.assign_contract()
+        self.assertFalse(queue(self.contract1).available)
+        self.assertTrue(queue(assign).in_progress)
+        self.assertEquals(queue(assign).stage_name, self.stage1.name)
+        self.assertEquals(queue(assign).parent_spec, '123')
+        self.assertEquals(queue(assign).email, self.conductor.email)
+
+        self.client.get(self.build_detail_view(assign) + '/transition')
+        self.assertEquals(queue(assign).stage_name, self.stage2.name)
+
+        self.client.get('/conductor/contract/{}/assign/{}'.format(assign.id, self.conductor2.id))
+        self.assertEquals(queue(assign).email, self.conductor2.email)
+
+        self.client.post(self.build_detail_view(assign) + '?form=update-metadata', data=dict(
+            financial_id=999, spec_number='789'
+        ))
+        self.assertEquals(queue(assign).spec_number, '789')
+
+        # renaming a stage updates every contract sitting in it
+        self.stage2.update(name='renamed')
+        self.assertEquals(queue(assign).stage_name, 'renamed')
+
+        self.client.get('/conductor/contract/{}/kill'.format(assign.id))
+        self.assertFalse(queue(assign).in_progress)
+
+        # logins and follows don't show up in the queue, so they leave it alone
+        with count_queries() as statements:
+            self.conductor.update(last_login_at=datetime.datetime.now())
+            self.contract2.followers.append(self.conductor)
+            db.session.commit()
+        self.assertEquals(len([i for i in statements if 'conductor_queue' in i]), 0)
+
+        # a rebuild repairs any drift
+        ConductorQueue.query.delete()
+        db.session.commit()
+        rebuild_conductor_queue(db.session)
+        db.session.commit()
+        self.assertEquals(ConductorQueue.query.count(), 3)
+        self.assertTrue(queue(self.contract2).available)
+
     def test_conductor_start_new(self):
         self.assertEquals(ContractStage.query.count(), 0)
         self.assert200(self.client.get('/conductor/contract/new'))
@@ -362,6 +445,47 @@ class TestConductor(TestConductorSetup):
         self.assertTrue(ContractStage.query.filter(ContractStage.stage_id == self.stage2.id).first().exited is None)
         self.assertTrue(ContractStage.query.filter(ContractStage.stage_id == self.stage3.id).first().exited is None)
 
+    def test_conductor_filter_action_log(self):
+        assign = self.assign_contract()
+        transition_url = self.build_detail_view(assign) + '/transition'
+        self.client.get(transition_url)
+        self.client.get(transition_url)
+        self.client.post(self.build_detail_view(assign) + '?form=activity', data=dict(
+            note='a test note!'
+        ))
+
+        # restarting stages leaves behind actions that get filtered out
+        revert_url = self.build_detail_view(assign) + '/transition?destination={}'
+        self.client.get(revert_url.format(self.stage1.id))
+        self.client.get(self.build_detail_view(assign) + '/transition')
+        self.assertEquals(ContractStageActionItem.query.count(), 9)
+
+        self.assertEquals(assign.filter_action_log(), assign.filter_action_log_python())
+        self.assertEquals(
+            sorted(i.action_type for i in assign.filter_action_log()),
+            ['entered', 'exited', 'note', 'reversion']
+        )
+
+        self.client.get(self.detail_view.format(assign.id, assign.get_current_stage().id) +
+            '/flow-switch/{}'.format(self.flow2.id))
+        self.assertEquals(assign.filter_action_log(), assign.filter_action_log_python())
+
+    def test_conductor_transition_loads_stages_once(self):
+        assign = self.assign_contract()
+
+        # forward twice, then back to the start
+        for destination in [None, None, self.stage1.id]:
+            with count_queries() as statements:
+                actions = assign.transition(self.conductor, destination=destination)
+            self.assertEquals(len([i for i in statements if 'FROM contract_stage ' in i]), 1)
+            self.assertEquals(len([i for i in statements if 'FROM stage' in i]), 0)
+
+            db.session.add_all(actions)
+            db.session.commit()
+
+        self.assertEquals(assign.current_stage_id, self.stage1.id)
+        self.assertEquals(ContractStageActionItem.query.count(), 6)
+
     def test_conductor_link_directions(self):
         assign = self.assign_contract()
         self.client.get(self.detail_view.format(assign.id, assign.get_current_stage().id) + '/transition')
@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
+import zlib
 import datetime
 from collections import defaultdict
 from purchasing.database import db
+from purchasing.data.flow_metrics import FlowStageSnapshot, FlowThroughput
+from purchasing.jobs.conductor_nightly import ConductorMetricsSnapshotJob
 from purchasing_test.integration.conductor.test_conductor import TestConductorSetup
 from purchasing_test.util import insert_a_contract
 
@@ -51,6 +54,21 @@ class TestConductorMetrics(TestConductorSetup):
             # there should be four metadata columns plus the number of stages
             self.assertEquals(len(row.split('\t')), len(self.flow.stage_order) + 4)
 
+    def test_metrics_tsv_download_gzip(self):
+        request = self.client.get(
+            '/conductor/metrics/download/{}'.format(self.flow.id),
+            headers={'Accept-Encoding': 'gzip, deflate'}
+        )
+        self.assertEquals(request.headers.get('Content-Encoding'), 'gzip')
+
+        tsv_data = zlib.decompress(request.data, zlib.MAX_WBITS | 16).split('\n')[:-1]
+        self.assertEquals(len(tsv_data), 3)
+
+    def test_metrics_granular_streaming(self):
+        results, headers = self.flow.reshape_metrics_granular()
+        self.assertEquals(self.flow.metrics_granular_headers(), headers)
+        self.assertEquals(dict(self.flow.iter_metrics_granular()), dict(results))
+
     def test_metrics_tsv_download_all(self):
         insert_a_contract(
             contract_type=self.county_type, description='scuba supplies 2', financial_id=789,
@@ -96,7 +114,7 @@ class TestConductorMetrics(TestConductorSetup):
         self.assertEquals(in_metrics['False'], 1)
 
     def test_metrics_data(self):
-        data = self.client.get('/conductor/metrics/overview/{}/data'.format(self.flow.id))
+        data = self.client.get('/conductor/metrics/overview/{}/data?raw=true'.format(self.flow.id))
         self.assert200(data)
         self.assertEquals(len(data.json['complete']), 2)
         self.assertEquals(len(data.json['current']), 0)
@@ -106,7 +124,7 @@ class TestConductorMetrics(TestConductorSetup):
         transition_url = self.build_detail_view(assign) + '/transition'
         self.client.get(transition_url)
 
-        data = self.client.get('/conductor/metrics/overview/{}/data'.format(self.flow.id))
+        data = self.client.get('/conductor/metrics/overview/{}/data?raw=true'.format(self.flow.id))
         self.assert200(data)
         self.assertEquals(len(data.json['complete']), 3)
         self.assertEquals(len(data.json['current']), 1)
@@ -114,7 +132,117 @@ class TestConductorMetrics(TestConductorSetup):
         assign.update(is_archived=True, flow=self.flow, has_metrics=True)
         db.session.commit()
 
-        data = self.client.get('/conductor/metrics/overview/{}/data'.format(self.flow.id))
+        data = self.client.get('/conductor/metrics/overview/{}/data?raw=true'.format(self.flow.id))
         self.assert200(data)
         self.assertEquals(len(data.json['complete']), 3)
         self.assertEquals(len(data.json['current']), 0)
+
+    def test_metrics_summary(self):
+        data = self.client.get('/conductor/metrics/overview/{}/data'.format(self.flow.id))
+        self.assert200(data)
+        self.assertEquals(len(data.json['current']), 0)
+        self.assertEquals(
+            [i['id'] for i in data.json['complete']], self.flow.stage_order
+        )
+        for stage in data.json['complete']:
+            self.assertEquals(stage['count'], 2)
+            self.assertEquals(sum(stage['histogram']), 2)
+            self.assertTrue(stage['min'] <= stage['median'] <= stage['p90'] <= stage['max'])
+
+    def test_metrics_summary_matches_raw(self):
+        assign = self.assign_contract(contract=self.contract3)
+        self.client.get(self.build_detail_view(assign) + '/transition')
+
+        raw = self.flow.build_metrics_data()
+        summary = self.flow.build_metrics_summary()
+
+        for status in ['complete', 'current']:
+            seconds = defaultdict(list)
+            for contract in raw[status].values():
+                for stage in contract['stages']:
+                    seconds[stage['id']].append(stage['seconds'])
+
+            self.assertEquals(
+                sorted(seconds.keys()), sorted(i['id'] for i in summary[status])
+            )
+            for stage in summary[status]:
+                self.assertEquals(stage['count'], len(seconds[stage['id']]))
+                self.assertAlmostEquals(
+                    stage['mean'], sum(seconds[stage['id']]) / len(seconds[stage['id']]), delta=5
+                )
+
+    def test_metrics_snapshot(self):
+        nightly = ConductorMetricsSnapshotJob(time_override=True)
+        scheduled, existing_job = nightly.schedule_job()
+        nightly.run_job(scheduled)
+        self.assertEquals(scheduled.status, 'success')
+
+        snapshot = FlowStageSnapshot.query.filter(FlowStageSnapshot.flow_id == self.flow.id).all()
+        self.assertEquals(len(snapshot), len(self.flow.stage_order))
+        self.assertTrue(all(i.status == 'complete' and i.count == 2 for i in snapshot))
+        self.assertEquals(
+            sum(i.completed for i in FlowThroughput.query.filter(FlowThroughput.flow_id == self.flow.id)), 2
+        )
+
+        # the dashboard adds on whatever happened after the snapshot
+        assign = self.assign_contract(contract=self.contract3)
+        self.client.get(self.build_detail_view(assign) + '/transition')
+
+        data = self.client.get('/conductor/metrics/overview/{}/data'.format(self.flow.id))
+        self.assert200(data)
+        self.assertTrue(data.json['snapshotTakenAt'] is not None)
+        self.assertEquals(len(data.json['current']), 1)
+        self.assertEquals(data.json['complete'][0]['count'], 3)
+        self.assertEquals(sum(data.json['complete'][0]['histogram']), 3)
+        self.assertEquals(data.json['complete'][1]['count'], 2)
+        self.assertEquals(sum(i['completed'] for i in data.json['throughput']), 2)
+
+        history = self.client.get('/conductor/metrics/overview/{}/history'.format(self.flow.id))
+        self.assert200(history)
+        self.assertEquals(len(history.json['snapshots']), 1)
+        self.assertEquals(
+            len(history.json['snapshots'][0]['complete']), len(self.flow.stage_order)
+        )
+
+    def test_metrics_data_conditional(self):
+        url = '/conductor/metrics/overview/{}/data'.format(self.flow.id)
+        data = self.client.get(url)
+        self.assert200(data)
+        etag = data.headers.get('ETag')
+        self.assertTrue(etag is not None)
+        self.assertTrue(data.headers.get('Last-Modified') is not None)
+
+        unchanged = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEquals(unchanged.status_code, 304)
+        self.assertEquals(unchanged.data, '')
+
+        # the raw data is versioned separately from the summary
+        self.assert200(self.client.get(url + '?raw=true', headers={'If-None-Match': etag}))
+
+        assign = self.assign_contract(contract=self.contract3)
+        self.client.get(self.build_detail_view(assign) + '/transition')
+
+        changed = self.client.get(url, headers={'If-None-Match': etag})
+        self.assert200(changed)
+        self.assertNotEquals(changed.headers.get('ETag'), etag)
+        self.assertEquals(len(changed.json['current']), 1)
+
+        # renaming a stage changes the labels on the charts
+        etag = changed.headers.get('ETag')
+        self.stage1.update(name='renamed')
+        renamed = self.client.get(url, headers={'If-None-Match': etag})
+        self.assert200(renamed)
+        self.assertNotEquals(renamed.headers.get('ETag'), etag)
+
+        # as does a contract leaving the flow, even without touching updated_at
+        etag = renamed.headers.get('ETag')
+        db.session.execute('UPDATE contract SET flow_id = NULL WHERE id = :id', {'id': assign.id})
+        db.session.commit()
+        left = self.client.get(url, headers={'If-None-Match': etag})
+        self.assert200(left)
+        self.assertNotEquals(left.headers.get('ETag'), etag)
+
+        # If-Modified-Since alone isn't enough, since the data changes daily
+        self.assert200(self.client.get(url, headers={
+            'If-Modified-Since': left.headers.get('Last-Modified')
+        }))
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import tempfile
+
+from purchasing.app import create_app as _create_app
+from purchasing.settings import TestConfig
+from purchasing.extensions import sql_instrumentation
+from purchasing.users.models import Department
+
+from purchasing_test.test_base import BaseTestCase
+from purchasing_test.util import insert_a_user, insert_a_role
+
+class InstrumentedConfig(TestConfig):
+    SQL_INSTRUMENTATION = True
+    SQL_N_PLUS_ONE_THRESHOLD = 3
+
+class SlowQueryConfig(TestConfig):
+    SLOW_QUERY_THRESHOLD = 0
+    SLOW_QUERY_LOG = os.path.join(tempfile.mkdtemp(), 'slow_queries.jsonl')
+
+def department_lookups():
+    for _ in range(4):
+        Department.choices()
+    return 'ok'
+
+class TestSQLInstrumentation(BaseTestCase):
+    def create_app(self):
+        os.environ['CONFIG'] = 'purchasing_test.integration.other.test_sql_instrumentation.InstrumentedConfig'
+        return _create_app()
+
+    def setUp(self):
+        super(TestSQLInstrumentation, self).setUp()
+        sql_instrumentation.reset()
+        self.client.application.add_url_rule(
+            '/department-lookups', 'department_lookups', department_lookups
+        )
+        self.admin = insert_a_user(email='foo@foo.com', role=insert_a_role('admin'))
+        self.staff = insert_a_user(email='bar@foo.com', role=insert_a_role('staff'))
+
+    def test_n_plus_one(self):
+        self.client.get('/department-lookups')
+        self.client.get('/department-lookups')
+
+        stats = sql_instrumentation.summary()['department_lookups']
+        self.assertEquals(stats['requests'], 2)
+        self.assertTrue(stats['statements'] >= 8)
+        self.assertEquals(stats['n_plus_one_requests'], 2)
+        self.assertEquals(len(stats['n_plus_one_call_sites']), 1)
+        self.assertTrue(
+            stats['n_plus_one_call_sites'].keys()[0].startswith('users/models.py:')
+        )
+
+    def test_sql_status(self):
+        self.client.get('/department-lookups')
+
+        self.login_user(self.staff)
+        self.assertEquals(self.client.get('/_status/sql').status_code, 302)
+
+        self.login_user(self.admin)
+        response = self.client.get('/_status/sql')
+        self.assert200(response)
+        self.assertTrue(response.json['enabled'])
+        self.assertTrue('department_lookups' in response.json['endpoints'])
+
+class TestSlowQueryLog(BaseTestCase):
+    def create_app(self):
+        os.environ['CONFIG'] = 'purchasing_test.integration.other.test_sql_instrumentation.SlowQueryConfig'
+        return _create_app()
+
+    def setUp(self):
+        super(TestSlowQueryLog, self).setUp()
+        self.client.application.add_url_rule(
+            '/department-lookups', 'department_lookups', department_lookups
+        )
+        open(SlowQueryConfig.SLOW_QUERY_LOG, 'w').close()
+
+    def logged(self):
+        with open(SlowQueryConfig.SLOW_QUERY_LOG) as f:
+            return [json.loads(line) for line in f]
+
+    def test_slow_query_log(self):
+        # views outside of scout, conductor and opportunities aren't watched
+        self.client.get('/department-lookups')
+        self.assertEquals(len(self.logged()), 0)
+
+        self.client.get('/scout/')
+        logged = self.logged()
+        self.assertTrue(len(logged) > 0)
+        self.assertTrue(all(i['endpoint'] == 'scout.explore' for i in logged))
+
+        departments = [i for i in logged if 'FROM department' in i['statement']][0]
+        self.assertTrue(departments['duration_ms'] >= 0)
+        self.assertTrue('Scan' in departments['plan'])
+
+        # the request's transaction is still usable after explaining
+        self.assert200(self.client.get('/scout/'))
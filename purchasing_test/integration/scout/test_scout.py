@@ -1,15 +1,21 @@
 # -*- coding: utf-8 -*-
 
+import threading
+
 from flask_security import current_user
 from purchasing.extensions import mail
 from purchasing_test.test_base import BaseTestCase
 from purchasing_test.util import (
     insert_a_company, insert_a_contract,
-    insert_a_user, insert_a_role
+    insert_a_user, insert_a_role, count_queries
 )
 from purchasing_test.factories import DepartmentFactory
 
+from purchasing.database import db
 from purchasing.data.contracts import ContractBase, LineItem, ContractNote
+from purchasing.data.follows import (
+    DepartmentContractFollows, apply_department_follows, rebuild_department_follows
+)
 
 class TestScout(BaseTestCase):
     render_templates = True
@@ -149,6 +155,121 @@ class TestScout(BaseTestCase):
         request = self.client.get('/scout/filter/FAKEFAKEFAKE')
         self.assertEquals(request.status_code, 404)
 
+    def follow_counts(self):
+        return dict(
+            ((i.department_id, i.contract_id), i.follows)
+            for i in DepartmentContractFollows.query.all()
+        )
+
+    def test_department_follows(self):
+        department2 = DepartmentFactory()
+
+        self.contract1.add_follower(self.admin_user)
+        self.contract1.add_follower(self.superadmin_user)
+        self.contract2.add_follower(self.admin_user)
+        db.session.commit()
+        self.assertEquals(self.follow_counts(), {
+            (self.department1.id, self.contract1.id): 2,
+            (self.department1.id, self.contract2.id): 1
+        })
+
+        # following from the user's side of the relationship counts too
+        self.superadmin_user.contracts_following.append(self.contract2)
+        self.contract1.remove_follower(self.admin_user)
+        db.session.commit()
+        self.assertEquals(self.follow_counts(), {
+            (self.department1.id, self.contract1.id): 1,
+            (self.department1.id, self.contract2.id): 2
+        })
+
+        # moving departments moves the user's follows with them
+        self.superadmin_user.department = department2
+        db.session.commit()
+        self.assertEquals(self.follow_counts(), {
+            (department2.id, self.contract1.id): 1,
+            (department2.id, self.contract2.id): 1,
+            (self.department1.id, self.contract2.id): 1
+        })
+
+        self.client.get('/scout/filter/{}'.format(department2.id))
+        self.assertEquals(
+            [i.id for i in self.get_context_variable('results')],
+            [self.contract1.id, self.contract2.id]
+        )
+
+        # a rebuild repairs any drift
+        DepartmentContractFollows.query.delete()
+        db.session.commit()
+        rebuild_department_follows(db.session)
+        db.session.commit()
+        self.assertEquals(len(self.follow_counts()), 3)
+
+    def test_department_follows_concurrently(self):
+        db.session.commit()
+        key = (self.department1.id, self.contract1.id)
+
+        # two people in the same department follow the same contract at the
+        # same time. The second has to wait for the first to commit, and then
+        # adds to the first one's count instead of replacing it
+        first, second = db.engine.connect(), db.engine.connect()
+        first_transaction, second_transaction = first.begin(), second.begin()
+        apply_department_follows(first, {key: 1})
+        waiting = threading.Thread(target=apply_department_follows, args=(second, {key: 1}))
+        waiting.start()
+        first_transaction.commit()
+        waiting.join()
+        second_transaction.commit()
+        self.assertEquals(self.follow_counts(), {key: 2})
+
+        # and unfollowing at the same time takes the count all the way down
+        first_transaction, second_transaction = first.begin(), second.begin()
+        apply_department_follows(first, {key: -1})
+        waiting = threading.Thread(target=apply_department_follows, args=(second, {key: -1}))
+        waiting.start()
+        first_transaction.commit()
+        waiting.join()
+        second_transaction.commit()
+        first.close()
+        second.close()
+
+        db.session.expire_all()
+        self.assertEquals(self.follow_counts(), {})
+
+    def profile_queries(self, url):
+        db.session.expire_all()
+        with count_queries() as statements:
+            self.assert200(self.client.get(url))
+        return len(statements)
+
+    def test_profile_page_queries(self):
+        contract_url = '/scout/contracts/{}'.format(self.contract1.id)
+        company_url = '/scout/companies/{}'.format(self.company1.id)
+
+        self.contract1.add_follower(self.admin_user)
+        db.session.commit()
+        contract_queries = self.profile_queries(contract_url)
+        company_queries = self.profile_queries(company_url)
+
+        # more followers from more departments, more companies, more line
+        # items and more contracts shouldn't mean more queries
+        for ix in range(5):
+            user = insert_a_user(
+                email='follower{}@foo.com'.format(ix), role=self.admin_role,
+                department=DepartmentFactory()
+            )
+            self.contract1.add_follower(user)
+            self.contract1.line_items.append(LineItem(description='item {}'.format(ix)))
+            self.contract1.companies.append(
+                insert_a_company(name=u'company {}'.format(ix), insert_contract=False)
+            )
+            insert_a_contract(description='more {}'.format(ix), companies=[self.company1])
+        db.session.commit()
+
+        self.assertEquals(self.profile_queries(contract_url), contract_queries)
+        self.assertEquals(len(self.get_context_variable('departments')), 6)
+        self.assertEquals(self.profile_queries(company_url), company_queries)
+        self.assertEquals(len(self.get_context_variable('company').contracts), 6)
+
     def test_notes(self):
         # assert you can't take a note on a contract
         self.assertEquals(ContractNote.query.count(), 0)
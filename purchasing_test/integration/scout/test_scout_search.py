@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+from collections import defaultdict
+from mock import Mock, patch
 
 from purchasing.app import db
 from purchasing_test.test_base import BaseTestCase
@@ -10,7 +12,22 @@ from purchasing_test.util import (
 
 from purchasing_test.factories import ContractTypeFactory, ContractBaseFactory, ContractPropertyFactory
 
+from purchasing.extensions import cache
+from purchasing.tasks import refresh_search_index, SEARCH_REFRESH_SCHEDULED
 from purchasing.data.contracts import LineItem
+from purchasing.scout.util import (
+    found_in_labels, find_contract_metadata, build_filter, build_cases, FILTER_FIELDS
+)
+from purchasing.data.searches import (
+    rebuild_search_index, refresh_queued_changes, has_queued_changes,
+    SearchIndexQueue, SearchIndexRefresh, SearchView, bump_search_generation
+)
+
+def search_rank(search_for, description):
+    return db.session.execute(db.text('''
+        SELECT ts_rank(tsv_document, to_tsquery('english', :search_for))::float
+        FROM search_index WHERE contract_description = :description
+    '''), {'search_for': search_for, 'description': description}).scalar()
 
 class TestScoutSearch(BaseTestCase):
     render_templates = True
@@ -56,9 +73,6 @@ class TestScoutSearch(BaseTestCase):
             contract_type=self.contract_type2
         )
 
-        # db.session.execute('''
-        #     REFRESH MATERIALIZED VIEW CONCURRENTLY search_view
-        # ''')
         db.session.commit()
 
     def tearDown(self):
@@ -70,9 +84,7 @@ class TestScoutSearch(BaseTestCase):
         db.get_engine(self.app).dispose()
 
     def test_search(self):
-        db.session.execute('''
-            REFRESH MATERIALIZED VIEW CONCURRENTLY search_view
-        ''')
+        rebuild_search_index(db.session)
         db.session.commit()
 
         self.assert200(self.client.get('/scout/search?q=ship'))
@@ -115,3 +127,303 @@ class TestScoutSearch(BaseTestCase):
         # make sure that contract types are properly handled
         self.assert200(self.client.get('/scout/search?archived=y&contract_type={}&q='.format(self.contract_type2.id)))
         self.assertEquals(len(self.get_context_variable('results')), 1)
+
+    def test_search_document_ranking(self):
+        rebuild_search_index(db.session)
+        db.session.commit()
+
+        # one row per contract, however many children it has
+        self.assertEquals(SearchView.query.count(), 4)
+        self.assertEquals(SearchView.query.filter(SearchView.tsv_document == None).count(), 0)
+
+        # descriptions are weighted above line items
+        self.assert200(self.client.get('/scout/search?q=sunfish&archived=y'))
+        results = self.get_context_variable('results')
+        self.assertEquals(len(results), 3)
+        self.assertEquals(results[0].contract_description, 'sunfish')
+        self.assertEquals(results[-1].contract_description, 'sail')
+
+        # and the found in bitmask says where each contract matched
+        self.assertEquals(found_in_labels(results[0].found_in), ['Contract Description'])
+        self.assertEquals(found_in_labels(results[-1].found_in), ['Line Item'])
+        self.assertEquals(results[-1].company_names, ['ship'])
+
+    def test_search_strategies(self):
+        rebuild_search_index(db.session)
+        db.session.commit()
+
+        search_terms = ['sunfish', 'engine']
+        search_for = ' | '.join(search_terms)
+        filter_or = build_filter({}, FILTER_FIELDS, search_for, None, True)
+        case_statements = build_cases({}, FILTER_FIELDS, search_for, True)
+
+        def search(filter_or=filter_or, **kwargs):
+            results, _ = find_contract_metadata(
+                search_for, case_statements, filter_or, [], search_terms=search_terms, **kwargs
+            )
+            return [i.contract_description for i in results]
+
+        self.assertEquals(search(), ['sunfish', 'sail'])
+
+        # only the best results
+        self.assertEquals(search(top_k=1), ['sunfish'])
+        self.assertEquals(search(top_k=1, page=2, per_page=1), ['sail'])
+        self.assertEquals(search(min_rank=search_rank(search_for, 'sail') + 0.0001), ['sunfish'])
+
+        # matching every term first, and widening when that finds too little
+        self.assertEquals(search(and_min_hits=1), ['sunfish'])
+        self.assertEquals(search(and_min_hits=2), ['sunfish', 'sail'])
+
+        # the "sunfish" contract only has "engine" in its details, so it
+        # doesn't match every term when details aren't being searched
+        fields = {'contract_description': 'y', 'line_item': 'y'}
+        restricted = build_filter(fields, FILTER_FIELDS, search_for, defaultdict(Mock), False)
+        self.assertEquals(search(filter_or=restricted, and_min_hits=1), ['sunfish', 'sail'])
+
+    def test_search_facets(self):
+        rebuild_search_index(db.session)
+        db.session.commit()
+
+        self.assert200(self.client.get('/scout/search?q=sunfish'))
+        facets = self.get_context_variable('facets')
+        self.assertEquals(facets['found_in']['contract_description'], 1)
+        self.assertEquals(facets['found_in']['line_item'], 1)
+        self.assertEquals(facets['found_in']['company_name'], 0)
+        self.assertEquals((facets['active'], facets['archived']), (2, 1))
+        self.assertEquals([i[1:] for i in facets['contract_type']], [('test', 2)])
+
+        self.assert200(self.client.get('/scout/search?q=sunfish&archived=y'))
+        facets = self.get_context_variable('facets')
+        self.assertEquals(facets['found_in']['contract_description'], 2)
+        self.assertEquals([i[1:] for i in facets['contract_type']], [('test', 2), ('test2', 1)])
+
+        # each facet ignores its own filter, but respects the others
+        self.assert200(self.client.get('/scout/search?q=sunfish&archived=y&contract_type={}'.format(
+            self.contract_type2.id
+        )))
+        facets = self.get_context_variable('facets')
+        self.assertEquals(facets['found_in']['contract_description'], 1)
+        self.assertEquals((facets['active'], facets['archived']), (0, 1))
+        self.assertEquals(len(facets['contract_type']), 2)
+
+        # browsing everything still counts by type and status
+        self.assert200(self.client.get('/scout/search?q='))
+        facets = self.get_context_variable('facets')
+        self.assertEquals(facets['found_in'], {})
+        self.assertEquals((facets['active'], facets['archived']), (3, 1))
+
+        # contracts without a type are counted last, without a filter link
+        ContractBaseFactory.create(
+            description='sunfish', financial_id='345', contract_type=None, is_archived=False,
+            expiration_date=datetime.datetime.today() + datetime.timedelta(1)
+        )
+        db.session.commit()
+        rebuild_search_index(db.session)
+        db.session.commit()
+
+        request = self.client.get('/scout/search?q=sunfish')
+        self.assert200(request)
+        facets = self.get_context_variable('facets')
+        self.assertEquals([i[1:] for i in facets['contract_type']], [('test', 2), (None, 1)])
+        self.assertTrue('Other (1)' in request.data)
+        self.assertEquals(request.data.count('contract_type='), 1)
+
+    def test_suggest(self):
+        rebuild_search_index(db.session)
+        db.session.commit()
+
+        suggestions = self.client.get('/scout/suggest?q=sun').json['results']
+        self.assertEquals(suggestions, [{'type': 'contract', 'value': 'sunfish'}])
+
+        suggestions = self.client.get('/scout/suggest?q=BO').json['results']
+        self.assertEquals(suggestions, [{'type': 'company', 'value': 'boat'}])
+
+        suggestions = self.client.get('/scout/suggest?q=12').json['results']
+        self.assertEquals(suggestions, [{'type': 'financial_id', 'value': '123'}])
+
+        self.assertEquals(self.client.get('/scout/suggest?q=').json['results'], [])
+        self.assertEquals(self.client.get('/scout/suggest?q=**').json['results'], [])
+        self.assertEquals(len(self.client.get('/scout/suggest?q=s&limit=foo').json['results']), 3)
+
+        # suggestions follow changes to the index
+        self.contract1.description = 'sunscreen'
+        db.session.commit()
+        suggestions = self.client.get('/scout/suggest?q=sun').json['results']
+        self.assertEquals(len(suggestions), 2)
+
+    def test_suggest_hidden_contracts(self):
+        ContractBaseFactory.create(
+            description='archived anchors', financial_id='345', is_archived=True,
+            expiration_date=datetime.datetime.today() + datetime.timedelta(1)
+        )
+        # conductor's in progress copies are invisible and stripped
+        ContractBaseFactory.create(
+            description='anchor clone', financial_id=None, expiration_date=None,
+            is_archived=False, is_visible=False
+        )
+        rebuild_search_index(db.session)
+        db.session.commit()
+
+        self.assertEquals(self.client.get('/scout/suggest?q=anch').json['results'], [])
+        # the expired sunfish contract's controller number isn't suggested either
+        self.assertEquals(self.client.get('/scout/suggest?q=01').json['results'], [])
+
+    def test_search_pagination(self):
+        rebuild_search_index(db.session)
+        db.session.commit()
+        self.app.config['PER_PAGE'] = 1
+
+        self.assert200(self.client.get('/scout/search?q='))
+        self.assertEquals(len(self.get_context_variable('results')), 1)
+        self.assertEquals(self.get_context_variable('pagination').total_count, 3)
+
+        self.assert200(self.client.get('/scout/search?q=sunfish&page=2'))
+        self.assertEquals(len(self.get_context_variable('results')), 1)
+        self.assertEquals(self.get_context_variable('pagination').total_count, 2)
+
+        # pages past the end still know how many results there are
+        self.assert200(self.client.get('/scout/search?q=&page=4'))
+        self.assertEquals(len(self.get_context_variable('results')), 0)
+        self.assertEquals(self.get_context_variable('pagination').total_count, 3)
+
+    def test_search_keyset_pagination(self):
+        rebuild_search_index(db.session)
+        db.session.commit()
+        self.app.config['PER_PAGE'] = 1
+
+        seen = []
+        self.assert200(self.client.get('/scout/search?q=&archived=y'))
+        pagination = self.get_context_variable('pagination')
+        seen.append(self.get_context_variable('results')[0].contract_id)
+        self.assertTrue(pagination.prev_cursor is None)
+
+        # walk forward through every page with the next cursor
+        while pagination.next_cursor:
+            self.assert200(self.client.get('/scout/search?q=&archived=y&page={}&cursor={}'.format(
+                pagination.page + 1, pagination.next_cursor
+            )))
+            pagination = self.get_context_variable('pagination')
+            seen.append(self.get_context_variable('results')[0].contract_id)
+
+        self.assertEquals(len(seen), 4)
+        self.assertEquals(seen, sorted(seen))
+        self.assertEquals(pagination.total_count, 4)
+
+        # and back one page with the previous cursor
+        self.assert200(self.client.get('/scout/search?q=&archived=y&page={}&cursor={}'.format(
+            pagination.page - 1, pagination.prev_cursor
+        )))
+        self.assertEquals(self.get_context_variable('results')[0].contract_id, seen[-2])
+
+        # a tampered cursor falls back to paging by offset
+        self.assert200(self.client.get('/scout/search?q=&archived=y&page=2&cursor=FAKEFAKE'))
+        self.assertEquals(self.get_context_variable('results')[0].contract_id, seen[1])
+
+        # so does one that isn't ascii, rather than breaking the cache key
+        self.assert200(self.client.get(u'/scout/search?q=&archived=y&page=2&cursor=\xe9'))
+        self.assertEquals(self.get_context_variable('results')[0].contract_id, seen[1])
+
+    def test_search_index_follows_changes(self):
+        rebuild_search_index(db.session)
+        db.session.commit()
+
+        self.assert200(self.client.get('/scout/search?q=trawler'))
+        self.assertEquals(len(self.get_context_variable('results')), 0)
+
+        # editing a contract reindexes only that contract on commit
+        self.contract1.description = 'trawler'
+        db.session.commit()
+
+        self.assert200(self.client.get('/scout/search?q=trawler'))
+        self.assertEquals(len(self.get_context_variable('results')), 1)
+        self.assert200(self.client.get('/scout/search?q=vessel'))
+        self.assertEquals(len(self.get_context_variable('results')), 0)
+
+        # so does attaching a company to it
+        self.contract1.companies.append(self.company_1)
+        db.session.commit()
+
+        self.assert200(self.client.get('/scout/search?q=ship'))
+        self.assertEquals(len(self.get_context_variable('results')), 2)
+
+        # and renaming a company reindexes all of its contracts
+        self.company_1.company_name = 'schooner'
+        db.session.commit()
+
+        self.assert200(self.client.get('/scout/search?q=schooner'))
+        self.assertEquals(len(self.get_context_variable('results')), 2)
+
+    def test_search_index_refresh_scheduler(self):
+        # commits drain the queue and log how long it took
+        self.assertFalse(has_queued_changes(db.session))
+        refresh = SearchIndexRefresh.query.order_by(SearchIndexRefresh.id.desc()).first()
+        self.assertTrue(refresh is not None)
+        self.assertTrue(refresh.lag >= 0)
+        self.assertTrue(refresh.duration >= 0)
+
+        # nothing to do when the queue is empty
+        self.assertEquals(refresh_queued_changes(db.session), (None, None))
+        db.session.commit()
+
+        db.session.add(SearchIndexQueue(contract_id=self.contract1.id))
+        db.session.add(SearchIndexQueue(contract_id=self.contract1.id))
+        db.session.commit()
+
+        # refreshes too close together wait for the minimum interval
+        refresh, retry_in = refresh_queued_changes(db.session, 600)
+        self.assertTrue(refresh is None)
+        self.assertTrue(0 < retry_in <= 600)
+        db.session.commit()
+        self.assertTrue(has_queued_changes(db.session))
+
+        # duplicate changes are coalesced into one reindex
+        refresh, retry_in = refresh_queued_changes(db.session)
+        db.session.commit()
+        self.assertTrue(retry_in is None)
+        self.assertEquals(refresh.changes, 2)
+        self.assertEquals(refresh.contracts, 1)
+        self.assertFalse(has_queued_changes(db.session))
+
+        # a burst of writes inside the interval schedules only one retry
+        def retries(apply_async):
+            return [i for i in apply_async.call_args_list if 'countdown' in i[1]]
+
+        self.app.config['SEARCH_REFRESH_INTERVAL'] = 600
+        with patch('purchasing.tasks.refresh_search_index.apply_async') as apply_async:
+            for _ in range(3):
+                db.session.add(SearchIndexQueue(contract_id=self.contract1.id))
+                db.session.commit()
+                refresh_search_index()
+        self.assertEquals(len(retries(apply_async)), 1)
+        self.assertEquals(retries(apply_async)[0][1]['kwargs'], {'scheduled': True})
+
+        # and running that retry lets the next burst schedule another
+        with patch('purchasing.tasks.refresh_search_index.apply_async') as apply_async:
+            refresh_search_index(scheduled=True)
+        self.assertEquals(len(retries(apply_async)), 1)
+        cache.delete(SEARCH_REFRESH_SCHEDULED)
+
+    def test_search_cache(self):
+        rebuild_search_index(db.session)
+        db.session.commit()
+        bump_search_generation()
+
+        self.assert200(self.client.get('/scout/search?q=sunfish'))
+        self.assertEquals(len(self.get_context_variable('results')), 2)
+
+        # empty the index behind the cache's back
+        db.session.execute('''DELETE FROM search_index''')
+        db.session.commit()
+
+        self.assert200(self.client.get('/scout/search?q=sunfish'))
+        self.assertEquals(len(self.get_context_variable('results')), 2)
+        self.assertEquals(self.get_context_variable('results')[0].contract_description, 'sunfish')
+
+        # different filters are cached separately
+        self.assert200(self.client.get('/scout/search?q=sunfish&line_item=y'))
+        self.assertEquals(len(self.get_context_variable('results')), 0)
+
+        # a new search generation throws the cached results away
+        bump_search_generation()
+        self.assert200(self.client.get('/scout/search?q=sunfish'))
+        self.assertEquals(len(self.get_context_variable('results')), 0)
@@ -75,7 +75,7 @@ class TestContractStageSort(TestCase):
         self.contract.build_complete_action_log.return_value = [
             self.enter_one, self.exit_one, self.enter_two
         ]
-        order = self.contract.filter_action_log()
+        order = self.contract.filter_action_log_python()
         self.assertEquals(order, [self.enter_two, self.exit_one, self.enter_one])
 
     def test_complex_sort(self):
@@ -85,8 +85,48 @@ class TestContractStageSort(TestCase):
             self.enter_two_post_revert, self.note
         ]
 
-        order = self.contract.filter_action_log()
+        order = self.contract.filter_action_log_python()
         self.assertEquals(order, [
             self.note, self.enter_two_post_revert,
             self.exit_one_post_revert, self.revert_one
         ])
+
+class TestStagePositions(TestCase):
+    def setUp(self):
+        super(TestStagePositions, self).setUp()
+        self.stage1, self.stage2, self.stage3 = [StageFactory.build() for i in range(3)]
+        self.flow = FlowFactory.build(stage_order=[self.stage1.id, self.stage2.id, self.stage3.id])
+        self.contract_stage = ContractStageFactory.build(
+            stage=self.stage2, stage_id=self.stage2.id, flow=self.flow
+        )
+
+    def test_positions(self):
+        positions = self.flow.stage_positions
+        self.assertEquals(positions.first, self.stage1.id)
+        self.assertEquals(positions.last, self.stage3.id)
+        self.assertEquals(positions.next(self.stage1.id), self.stage2.id)
+        self.assertEquals(positions.next(self.stage3.id), None)
+        self.assertEquals(positions.previous(self.stage1.id), None)
+        self.assertEquals(positions.previous(self.stage3.id), self.stage2.id)
+        self.assertEquals(
+            positions.between(self.stage1.id, self.stage2.id), [self.stage1.id, self.stage2.id]
+        )
+
+    def test_positions_cached(self):
+        positions = self.flow.stage_positions
+        self.assertTrue(self.flow.stage_positions is positions)
+
+        # a different object for the same flow shares the lookup
+        same_flow = flows.Flow(id=self.flow.id, stage_order=list(self.flow.stage_order))
+        self.assertTrue(same_flow.stage_positions is positions)
+
+        # changing the stage order builds a new one
+        self.flow.stage_order = [self.stage3.id, self.stage2.id, self.stage1.id]
+        self.assertEquals(self.flow.stage_positions.first, self.stage3.id)
+
+    def test_happens_before_after(self):
+        self.assertTrue(self.contract_stage.happens_before(self.stage3.id))
+        self.assertFalse(self.contract_stage.happens_before(self.stage2.id))
+        self.assertTrue(self.contract_stage.happens_before_or_on(self.stage2.id))
+        self.assertTrue(self.contract_stage.happens_after(self.stage1.id))
+        self.assertFalse(self.contract_stage.happens_after(-1))
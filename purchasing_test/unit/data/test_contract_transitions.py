@@ -57,9 +57,12 @@ class TestContractTransition(ContractObjectTestBase):
         self.assertEquals(_next.call_count, 2)
         self.assertEquals(last.call_count, 1)
 
-    def test_transition_start(self):
-        _get = Mock(return_value=ContractStage(stage=self.stage1))
-        ContractStage.get_one = _get
+    def contract_stage(self, stage):
+        return ContractStage(stage=stage, stage_id=stage.id)
+
+    @patch('purchasing.data.contract_stages.ContractStage.get_working_set')
+    def test_transition_start(self, _get):
+        _get.return_value = {self.stage1.id: self.contract_stage(self.stage1)}
 
         self.assertTrue(self.active_contract.current_stage_id is None)
         action = self.active_contract.transition(self.user)
@@ -68,10 +71,12 @@ class TestContractTransition(ContractObjectTestBase):
         self.assertEquals(action[0].action_type, 'entered')
         self.assertEquals(self.active_contract.current_stage_id, self.stage1.id)
 
-    def test_transition_next(self):
-        _get = Mock()
-        _get.side_effect = [ContractStage(stage=self.stage1), ContractStage(stage=self.stage2)]
-        ContractStage.get_one = _get
+    @patch('purchasing.data.contract_stages.ContractStage.get_working_set')
+    def test_transition_next(self, _get):
+        _get.return_value = {
+            self.stage1.id: self.contract_stage(self.stage1),
+            self.stage2.id: self.contract_stage(self.stage2)
+        }
         _fix = Mock(return_value=[])
         ContractStage._fix_start_time = _fix
 
@@ -80,7 +85,7 @@ class TestContractTransition(ContractObjectTestBase):
 
         action = self.active_contract.transition(self.user)
         self.assertEquals(len(action), 2)
-        self.assertTrue(_get.called)
+        self.assertEquals(_get.call_count, 1)
         self.assertTrue(_fix.called_once)
         self.assertEquals(action[0].action_type, 'exited')
         self.assertEquals(action[0].action_detail['stage_name'], self.stage1.name)
@@ -88,10 +93,10 @@ class TestContractTransition(ContractObjectTestBase):
         self.assertEquals(action[1].action_detail['stage_name'], self.stage2.name)
         self.assertEquals(self.active_contract.current_stage_id, self.stage2.id)
 
+    @patch('purchasing.data.contract_stages.ContractStage.get_working_set')
     @patch('purchasing.data.contracts.ContractBase.complete')
-    def test_transition_last(self, complete):
-        _get = Mock(return_value=ContractStage(stage=self.stage1))
-        ContractStage.get_one = _get
+    def test_transition_last(self, complete, _get):
+        _get.return_value = {self.stage3.id: self.contract_stage(self.stage3)}
 
         self.active_contract.parent = ContractBaseFactory.build(description='test')
         self.active_contract.current_stage_id = self.stage3.id
@@ -103,9 +108,12 @@ class TestContractTransition(ContractObjectTestBase):
         self.assertEquals(action[0].action_type, 'exited')
         self.assertTrue(complete.called_once)
 
-    def test_transition_backward(self):
-        _get = Mock(return_value=[ContractStage(stage=self.stage1), ContractStage(stage=self.stage2)])
-        ContractStage.get_multiple = _get
+    @patch('purchasing.data.contract_stages.ContractStage.get_working_set')
+    def test_transition_backward(self, _get):
+        _get.return_value = {
+            self.stage1.id: self.contract_stage(self.stage1),
+            self.stage2.id: self.contract_stage(self.stage2)
+        }
 
         self.active_contract.current_stage_id = self.stage2.id
         self.active_contract.current_stage = self.stage2
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+from contextlib import contextmanager
+
 from purchasing.database import db
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 
 from purchasing.data.contracts import ContractBase
@@ -146,3 +149,18 @@ def insert_an_opportunity(
     ))
 
     return opportunity
+
+@contextmanager
+def count_queries():
+    '''Collect the statements run against the database inside the block
+    '''
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)